@@ -0,0 +1,355 @@
+"""
+LINEスタンプ丸投げちゃん - ASGI（async）版エントリポイント（オプション）
+
+キャラクター提案・グリッド画像生成の Gemini 呼び出しを async SDK で行うので、
+API の応答待ちの間にスレッドを占有せず、多数の生成リクエストを少ないスレッドで
+同時に処理できます。スタンプ変換などの CPU 処理はスレッドプールで実行し、
+イベントループを止めません。
+
+    pip install quart hypercorn
+    python asgi.py
+    # または: hypercorn asgi:application -b 127.0.0.1:5000
+
+async で処理するエンドポイント:
+    /api/propose-characters, /api/generate-grid, /api/resize-stamps, /api/download/<folder>
+それ以外（/api/config, /api/generate-grid/jobs など）は server.py の Flask アプリに
+そのまま渡すので、Web UI はこれまでどおり使えます。
+"""
+
+import asyncio
+import os
+
+try:
+    from quart import Quart, Response, g, request, jsonify, send_file, send_from_directory
+    from hypercorn.middleware import AsyncioWSGIMiddleware
+except ImportError:
+    print("quart / hypercorn がインストールされていません: pip install quart hypercorn")
+    raise SystemExit(1)
+
+from werkzeug.exceptions import NotFound, MethodNotAllowed
+
+import server
+from server import (
+    BASE_DIR, OUTPUT_DIR, ZIP_CACHE_DIR, MAX_FILE_SIZE, MAX_FILES_PER_REQUEST,
+    get_api_key, is_loopback, is_measured_path, validate_extension, log_proposal, save_grid, grid_response,
+    check_character, check_stamp_request, convert_stamps, list_zip_entries, get_zip_cache_key, stream_zip
+)
+from core import metrics
+from core.gemini_client import get_client
+
+# ========================================
+# Quart アプリ設定
+# ========================================
+
+app = Quart(__name__, static_folder=None)
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE * MAX_FILES_PER_REQUEST
+
+# Quart に無いルートを処理する Flask アプリ（リクエストごとにスレッドで実行）
+flask_app = AsyncioWSGIMiddleware(server.app, max_body_size=MAX_FILE_SIZE * MAX_FILES_PER_REQUEST)
+
+
+@app.before_request
+async def start_request_metrics():
+    """API リクエストの計測を開始"""
+    if is_measured_path(request.path):
+        g.metrics_token = metrics.start_request()
+
+
+@app.after_request
+async def finish_request_metrics(response):
+    """API リクエストの処理時間を記録し、JSON ログを1行出力"""
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.finish_request(token, request.method, endpoint, request.path, response.status_code)
+    return response
+
+
+@app.before_request
+async def allow_localhost_only():
+    """ローカルホスト以外からのリクエストを拒否（誤って外部公開した場合の保険）"""
+    if not is_loopback(request.remote_addr):
+        return jsonify({'success': False, 'error': 'ローカルホストからのみ利用できます'}), 403
+
+
+async def iterate_in_thread(generator):
+    """同期ジェネレーターをスレッドで1要素ずつ進める（ファイル I/O でイベントループを止めない）"""
+    done = object()
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, generator, done)
+            if chunk is done:
+                break
+            yield chunk
+    finally:
+        await asyncio.to_thread(generator.close)
+
+
+# ========================================
+# 静的ファイル配信
+# ========================================
+
+@app.route('/')
+async def index():
+    """メインページ"""
+    return await send_file(BASE_DIR / 'index.html')
+
+
+@app.route('/static/<path:filename>')
+async def serve_static(filename):
+    """静的ファイル配信"""
+    return await send_from_directory(BASE_DIR / 'static', filename)
+
+
+@app.route('/output/<path:filename>')
+async def serve_output(filename):
+    """出力ファイル配信"""
+    return await send_from_directory(OUTPUT_DIR, filename)
+
+
+# ========================================
+# API エンドポイント
+# ========================================
+
+@app.route('/api/propose-characters', methods=['POST'])
+async def api_propose_characters():
+    """売れそうなキャラクターを5案提案"""
+    api_key = get_api_key()
+    if not api_key:
+        return jsonify({'success': False, 'error': 'APIキーが設定されていません'}), 400
+
+    data = await request.get_json() or {}
+    user_request = data.get('request', '')
+
+    try:
+        client = get_client(api_key)
+        characters, model_info = await client.propose_characters_async(user_request)
+        log_proposal(user_request, model_info)
+
+        return jsonify({
+            'success': True,
+            'characters': characters,
+            'model_info': model_info
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+async def run_grid_pipeline_async(client, character):
+    """
+    server.run_grid_pipeline の async 版
+
+    英語登録情報の生成をタスクとして開始し、プロンプト生成・画像生成と並行して待つ。
+    """
+    prepared_registration = character.get('registration')
+    if prepared_registration:
+        registration_task = None
+    else:
+        registration_task = asyncio.create_task(client.generate_registration_info_async(character))
+
+    try:
+        # キャラクター情報から英語プロンプトを生成
+        if character.get('grid_prompt'):
+            prompt = character['grid_prompt']
+            prompt_model_info = {'model_version': 'prepared', 'requested_model': client.text_model}
+        else:
+            prompt, prompt_model_info = await client.create_grid_prompt_async(character)
+            print(f"[プロンプト生成] 使用モデル: {prompt_model_info.get('model_version', 'unknown')}")
+
+        # 画像生成
+        image, image_model_info = await client.generate_image_async(prompt)
+        print(f"[画像生成] 使用モデル: {image_model_info.get('model_version', 'unknown')}")
+
+        # 保存（PNG エンコードはスレッドで）
+        filename = await asyncio.to_thread(save_grid, image)
+    except BaseException:
+        if registration_task is not None:
+            registration_task.cancel()
+        raise
+
+    # 英語登録情報の完了を待つ
+    if registration_task is None:
+        en_info = prepared_registration
+    else:
+        try:
+            en_info = await registration_task
+            print(f"[英語登録情報] 生成完了")
+        except Exception as e:
+            print(f"[英語登録情報] 生成失敗: {e}")
+            en_info = {'title_en': '', 'description_en': ''}
+
+    return grid_response(character, filename, en_info, prompt_model_info, image_model_info)
+
+
+@app.route('/api/generate-grid', methods=['POST'])
+async def api_generate_grid():
+    """キャラクターから6x3グリッド画像を生成"""
+    api_key = get_api_key()
+    if not api_key:
+        return jsonify({'success': False, 'error': 'APIキーが設定されていません'}), 400
+
+    data = await request.get_json() or {}
+    character = data.get('character')
+
+    error = check_character(character)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+
+    try:
+        client = get_client(api_key)
+        return jsonify(await run_grid_pipeline_async(client, character))
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/resize-stamps', methods=['POST'])
+async def api_resize_stamps():
+    """
+    切り抜き画像をアップロードしてLINE仕様（370x320px）にリサイズ
+    （変換はスレッドプールで実行）
+
+    ※ アップロードの受信はストリーミングではない: Quart がリクエスト全体を受け取って
+      ファイルごとに SpooledTemporaryFile（500KB を超える分は一時ファイル）へ書き出してから
+      変換を始める。メモリ使用量は抑えられるが、一時ファイルへの書き込みはイベントループ上で行い、
+      受信の上限は MAX_CONTENT_LENGTH（1ファイルの上限 × ファイル数の上限）で決まる。
+    """
+    files = (await request.files).getlist('files')
+    if not files:
+        return jsonify({'success': False, 'error': 'ファイルがありません'}), 400
+
+    form = await request.form
+    error = check_stamp_request(form.get('profile'), form.get('folder', ''))
+    if error:
+        message, status = error
+        return jsonify({'success': False, 'error': message}), status
+
+    try:
+        images = [
+            file.stream
+            for file in files
+            if file.filename and validate_extension(file.filename)
+        ]
+
+        result = await asyncio.to_thread(
+            convert_stamps, images, len(files),
+            profile=form.get('profile'),
+            folder=form.get('folder', ''),
+            workers=form.get('workers', type=int)
+        )
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/download/<folder>', methods=['GET'])
+async def api_download(folder):
+    """出力フォルダをZIPでダウンロード"""
+    folder_path = OUTPUT_DIR / folder
+    if not folder_path.exists() or not folder_path.is_dir():
+        return jsonify({'success': False, 'error': 'フォルダが見つかりません'}), 404
+
+    entries = await asyncio.to_thread(list_zip_entries, folder_path)
+    cache_key = await asyncio.to_thread(get_zip_cache_key, entries)
+    cache_path = ZIP_CACHE_DIR / f"{folder}_{cache_key}.zip"
+
+    # キャッシュ済みならファイルとして配信（Range / ETag 対応）
+    if cache_path.exists():
+        response = await send_file(
+            cache_path,
+            mimetype='application/zip',
+            as_attachment=True,
+            attachment_filename=f'{folder}.zip',
+            add_etags=False
+        )
+        # 条件付きリクエストの判定より前に ETag を付ける（If-None-Match で 304 を返すため）
+        response.set_etag(cache_key)
+        return await response.make_conditional(
+            request, accept_ranges=True, complete_length=response.content_length
+        )
+
+    # 未キャッシュならストリーミングで送信しつつキャッシュを作成
+    ZIP_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    response = Response(
+        iterate_in_thread(stream_zip(folder, entries, cache_path)),
+        mimetype='application/zip'
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{folder}.zip"'
+    response.set_etag(cache_key)
+    return response
+
+
+@app.route('/api/metrics', methods=['GET'])
+async def api_metrics():
+    """メトリクス（Prometheus 形式。集計は Flask 側のルートと共通）"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# ========================================
+# エラーハンドリング
+# ========================================
+
+@app.errorhandler(413)
+async def request_entity_too_large(error):
+    return jsonify({
+        'success': False,
+        'error': 'ファイルサイズが大きすぎます（上限: 50MB）'
+    }), 413
+
+
+@app.errorhandler(500)
+async def internal_error(error):
+    return jsonify({
+        'success': False,
+        'error': 'サーバーエラーが発生しました'
+    }), 500
+
+
+# ========================================
+# ASGI アプリ
+# ========================================
+
+def is_async_route(path, method):
+    """Quart アプリで処理するリクエストか"""
+    try:
+        app.url_map.bind('localhost').match(path, method)
+    except NotFound:
+        return False
+    except MethodNotAllowed:
+        pass
+    return True
+
+
+async def application(scope, receive, send):
+    """ASGI サーバーが参照するアプリ（Quart に無いルートは Flask アプリへ）"""
+    if scope['type'] == 'http' and not is_async_route(scope['path'], scope['method']):
+        await flask_app(scope, receive, send)
+    else:
+        await app(scope, receive, send)
+
+
+# ========================================
+# サーバー起動
+# ========================================
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    port = int(os.environ.get('PORT', 5000))
+
+    print("=" * 60)
+    print("  LINEスタンプ丸投げちゃん（async モード）")
+    print("=" * 60)
+    print()
+    print(f"  ブラウザで http://localhost:{port} を開いてください")
+    print()
+    print("  終了: Ctrl+C")
+    print("=" * 60)
+
+    # 重要: 127.0.0.1 でローカルホストのみに制限
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    asyncio.run(serve(application, config))
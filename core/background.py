@@ -0,0 +1,198 @@
+"""
+背景削除モジュール
+
+rembg のモデルセッションを1つだけ作って使い回し、専用スレッドで推論します。
+rembg がインストールされていない場合や、Gemini の白背景グリッドには
+NumPy による白背景キー（外周からの塗りつぶし）を使います。
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from .line_spec import COLOR_MODE
+
+# 背景削除（オプション）
+try:
+    from rembg import new_session, remove as rembg_remove
+    REMBG_AVAILABLE = True
+except ImportError:
+    REMBG_AVAILABLE = False
+
+# rembg のモデル名
+DEFAULT_REMBG_MODEL = "u2net"
+
+# 白キー: 白からの距離（255 - RGB最小値）がこの範囲でアルファを 0→255 に変化させる
+WHITE_KEY_LOW = 8
+WHITE_KEY_HIGH = 40
+
+# RGB最小値 → キー後のアルファ（0〜255）の変換表
+_WHITE_KEY_ALPHA = np.clip(
+    (255 - np.arange(256) - WHITE_KEY_LOW) * 255 // (WHITE_KEY_HIGH - WHITE_KEY_LOW), 0, 255
+).astype(np.uint8)
+
+
+def _connected_runs(starts: np.ndarray, ends: np.ndarray, row_width: int) -> np.ndarray:
+    """
+    上下に接する連続区間どうしをつなぎ、区間ごとの連結成分の番号（成分内の最小の区間番号）を返す
+
+    区間は平坦化した座標の [start, end)（昇順・重なりなし）。1行下の区間とは
+    座標を row_width ずらして重なるかで判定し、searchsorted でまとめて辺を作る。
+    連結成分は「辺の両端の根を小さい方へつなぐ → 経路を縮める」を変化がなくなるまで繰り返す。
+    """
+    count = starts.size
+    first = np.searchsorted(ends, starts + row_width, "right")
+    last = np.searchsorted(starts, ends + row_width, "left")
+    degree = np.maximum(last - first, 0)
+    source = np.repeat(np.arange(count), degree)
+    offsets = np.arange(degree.sum()) - np.repeat(np.cumsum(degree) - degree, degree)
+    target = np.repeat(first, degree) + offsets
+
+    label = np.arange(count)
+    while True:
+        source_root, target_root = label[source], label[target]
+        root = np.minimum(source_root, target_root)
+        merged = label.copy()
+        np.minimum.at(merged, source_root, root)
+        np.minimum.at(merged, target_root, root)
+        while True:
+            jumped = merged[merged]
+            if np.array_equal(jumped, merged):
+                break
+            merged = jumped
+        if np.array_equal(merged, label):
+            return label
+        label = merged
+
+
+def _flood_from_border(candidate: np.ndarray) -> np.ndarray:
+    """
+    画像の外周から候補ピクセルをたどって（上下左右に）到達できる領域を求める
+
+    ピクセル単位で塗り広げず、各行の候補ピクセルの連続区間を単位にする:
+    区間を取り出し、上下に接する区間どうしの連結成分を求め、
+    外周に接する区間を含む成分の区間だけを塗る（いずれも NumPy の一括演算）。
+    区間の数はピクセル数よりずっと少ないので、曲がりくねった背景でも速い。
+    """
+    height, width = candidate.shape
+    row_width = width + 1
+
+    # 行末に候補でない列を足して平坦化すると、区間が次の行へまたがらない
+    padded = np.zeros((height, row_width), dtype=np.int8)
+    padded[:, :width] = candidate
+    changes = np.flatnonzero(np.diff(padded.ravel(), prepend=np.int8(0)))
+    starts, ends = changes[0::2], changes[1::2]
+
+    filled = np.zeros(height * row_width, dtype=np.int8)
+    if starts.size:
+        label = _connected_runs(starts, ends, row_width)
+        on_border = (
+            (starts < row_width) | (starts >= (height - 1) * row_width)
+            | (starts % row_width == 0) | (ends % row_width == width)
+        )
+        background_root = np.zeros(starts.size, dtype=bool)
+        background_root[label[on_border]] = True
+        background = background_root[label]
+
+        # 背景の区間の始点に +1、終点に -1 を置いて累積和で塗る
+        filled[starts[background]] = 1
+        filled[ends[background]] = -1
+        np.cumsum(filled, out=filled)
+    return filled.view(bool).reshape(height, row_width)[:, :width]
+
+
+def key_white_background(image: Image.Image) -> Image.Image:
+    """
+    白背景を透過にする（外周からの塗りつぶしによるキー）
+
+    外周とつながった白に近い領域だけを背景とみなすので、
+    キャラクター内部の白（目・吹き出しなど）は残る。
+    背景の縁は白からの距離に応じてアルファを滑らかに変化させ（アンチエイリアス）、
+    白が混ざった縁の色は白を差し引いて補正する。
+
+    Args:
+        image: 入力画像
+
+    Returns:
+        RGBA の PIL Image
+    """
+    arr = np.array(image.convert(COLOR_MODE))
+    if arr.shape[0] < 2 or arr.shape[1] < 2:
+        return Image.fromarray(arr, COLOR_MODE)
+
+    # RGB の最小値（白からの距離）を求め、変換表でアルファにする
+    min_rgb = np.minimum(np.minimum(arr[..., 0], arr[..., 1]), arr[..., 2])
+    background = _flood_from_border(min_rgb > 255 - WHITE_KEY_HIGH)
+    key_alpha = np.take(_WHITE_KEY_ALPHA, min_rgb)
+
+    # 縁の半透明ピクセルは白との合成を戻す: fg = (観測値 - (1 - a) * 255) / a
+    fringe = np.nonzero(background & (key_alpha > 0) & (key_alpha < 255))
+    if fringe[0].size:
+        a = key_alpha[fringe].astype(np.int32)[:, None]
+        rgb = arr[fringe][:, :3].astype(np.int32)
+        arr[fringe[0], fringe[1], :3] = np.clip((rgb * 255 - (255 - a) * 255) // a, 0, 255)
+
+    alpha = arr[..., 3]
+    np.minimum(alpha, key_alpha, out=alpha, where=background)
+    return Image.fromarray(arr, COLOR_MODE)
+
+
+class BackgroundRemover:
+    """
+    背景削除サービス
+
+    rembg のセッション（モデル）は初回だけ読み込み、以後は使い回す。
+    推論は専用の1スレッドで行うので、セッションが複数スレッドから同時に使われることはない
+    （呼び出し元は推論の完了を待つ）。
+    rembg がない場合の白背景キーは NumPy だけの処理なので、推論スレッドを通さず
+    呼び出し元のスレッドでそのまま行う（リクエストどうしで直列にならない）。
+    """
+
+    def __init__(self, model_name: str = DEFAULT_REMBG_MODEL):
+        """
+        Args:
+            model_name: rembg のモデル名
+        """
+        self.model_name = model_name
+        self._session = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rembg")
+
+    def remove_batch(self, images: list) -> list:
+        """複数画像の背景を削除（1回の呼び出しでまとめて処理）"""
+        if not REMBG_AVAILABLE:
+            return [key_white_background(image) for image in images]
+        return self._executor.submit(self._remove_many, list(images)).result()
+
+    def remove(self, image: Image.Image) -> Image.Image:
+        """1枚の背景を削除"""
+        return self.remove_batch([image])[0]
+
+    def _remove_many(self, images: list) -> list:
+        """推論スレッドで実行される本体"""
+        if self._session is None:
+            self._session = new_session(self.model_name)
+
+        # PIL Image をそのまま渡す（PNG へのエンコード/デコードをしない）
+        return [
+            rembg_remove(image, session=self._session).convert(COLOR_MODE)
+            for image in images
+        ]
+
+
+# プロセスごとに1つ（fork 後の子プロセスでは推論スレッドを作り直す）
+_remover = None
+_remover_pid = None
+_remover_lock = threading.Lock()
+
+
+def get_background_remover() -> BackgroundRemover:
+    """共有の背景削除サービスを取得"""
+    global _remover, _remover_pid
+    with _remover_lock:
+        if _remover is None or _remover_pid != os.getpid():
+            _remover = BackgroundRemover()
+            _remover_pid = os.getpid()
+        return _remover
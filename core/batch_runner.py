@@ -0,0 +1,387 @@
+"""
+複数セット一括処理モジュール
+
+多数のグリッド画像・スタンプフォルダ（またはそれらを列挙したリストファイル）を
+まとめて受け取り、全セットの全コマを1つのワーカープールで処理します。
+各ワーカーは共有キューから空いた順に次のコマを取るので、
+セットごとの枚数や処理時間に偏りがあっても全コアが埋まります。
+
+使用方法:
+    python -m core.batch_runner <grid.png | dir> [...] [--list sets.txt] [--grid 3x6]
+"""
+
+import os
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image
+
+from .background import get_background_remover, key_white_background
+from .grid_detector import detect_grid_cells
+from .line_spec import MAX_STAMPS
+from .stamp_processor import (
+    StampProcessor, DEFAULT_ENCODER_PROFILE, IMAGE_EXTENSIONS, process_pool_context, scan_stamp_images,
+    unique_set_name
+)
+
+# グリッドの既定の分割数（Gemini の 6x3 シート）
+DEFAULT_GRID_ROWS = 3
+DEFAULT_GRID_COLS = 6
+
+
+def _convert_job(
+    output_dir: str,
+    encoder_profile: str,
+    image,
+    index: int,
+    key_white: bool,
+    with_main_and_tab: bool
+) -> tuple[dict, float]:
+    """
+    プロセスプール用ワーカー（1コマ分の白背景キー + 変換）
+
+    Returns:
+        (処理結果, 処理時間[秒])
+    """
+    start = time.perf_counter()
+    if key_white:
+        image = key_white_background(image)
+    processor = StampProcessor(output_dir, encoder_profile)
+    result = processor.process_single_image(image, index, with_main_and_tab=with_main_and_tab)
+    return result, time.perf_counter() - start
+
+
+def _prepare_job(
+    path: str,
+    grid_spec: Optional[str],
+    detect: bool,
+    remove_bg: bool,
+    key_white: bool
+) -> tuple[list, bool, float]:
+    """
+    プロセスプール用ワーカー（1セット分の入力を準備）
+
+    グリッドはデコード・コマ検出・切り出し（remove_bg なら rembg も）、フォルダは画像を列挙する。
+
+    Returns:
+        (変換ジョブに渡す画像のリスト, 変換ジョブで白背景キーをするか, 処理時間[秒])
+    """
+    start = time.perf_counter()
+    source = Path(path)
+    if source.is_dir():
+        return scan_stamp_images(source)[:MAX_STAMPS], False, time.perf_counter() - start
+
+    if source.suffix.lower() not in IMAGE_EXTENSIONS:
+        raise ValueError(f"画像でもフォルダでもありません: {path}")
+
+    rows, cols = DEFAULT_GRID_ROWS, DEFAULT_GRID_COLS
+    if grid_spec:
+        rows, cols = map(int, grid_spec.split("x"))
+
+    with Image.open(source) as opened:
+        grid = opened.convert("RGBA")
+
+    if detect:
+        cells = detect_grid_cells(grid, rows, cols)
+    else:
+        cells = StampProcessor._split_grid_evenly(grid.size, rows, cols)
+    images = [grid.crop(cell) for cell in cells]
+
+    if remove_bg:
+        # rembg のモデルはワーカープロセスごとに1回だけ読み込む
+        images, key_white = get_background_remover().remove_batch(images), False
+    return images, key_white, time.perf_counter() - start
+
+
+def read_set_list(list_file: str) -> list[tuple[str, Optional[str]]]:
+    """
+    セット一覧ファイルを読み込む
+
+    1行に1セット。「パス」または「パス 行x列」（グリッドの分割数）。
+    空行と # で始まる行は無視する。
+
+    Returns:
+        [(パス, 分割指定 or None), ...]
+    """
+    entries = []
+    for line in Path(list_file).read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        path, _, grid_spec = line.partition(" ")
+        entries.append((path, grid_spec.strip() or None))
+    return entries
+
+
+def write_set_zip(output_dir: Path, results: list[dict]) -> Path:
+    """
+    セットの変換結果を ZIP にまとめる（PNG は圧縮済みなので無圧縮で格納）
+
+    出力フォルダに前回の実行の PNG が残っていても含めないよう、
+    今回成功したコマ（と main.png / tab.png）だけを格納する。
+    ZIP は出力フォルダと同じ階層に <セット名>.zip で作る
+    （セット名に "." を含んでも with_suffix のように名前を切り詰めない）。
+    """
+    paths = []
+    for result in results:
+        if result["success"]:
+            paths += [result["path"], result.get("main_path"), result.get("tab_path")]
+
+    zip_path = output_dir.parent / f"{output_dir.name}.zip"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zf:
+        for path in dict.fromkeys(p for p in paths if p):
+            zf.write(path, Path(path).name)
+    return zip_path
+
+
+class BatchRunner:
+    """
+    複数セット一括処理クラス
+
+    1. 準備: グリッドはデコード・コマ検出・切り出し、フォルダは画像を列挙（ワーカー）
+    2. 変換: 準備できたセットのコマから共有プールに投入（白背景キー・リサイズ・エンコード）
+    3. ZIP: セットの全コマが終わったら、そのセットの ZIP を作成（メインプロセス）
+
+    準備と変換は同じプールで行い、同時に投入するのはワーカー数の2倍まで
+    （切り出したコマを一度に抱え込まないよう、準備済みセットの変換を先に投入する）。
+    """
+
+    def __init__(
+        self,
+        output_root: str = "data/output",
+        workers: Optional[int] = None,
+        encoder_profile: str = DEFAULT_ENCODER_PROFILE,
+        remove_bg: bool = False,
+        key_white: bool = True,
+        detect: bool = True
+    ):
+        """
+        Args:
+            output_root: 出力先（セットごとに <output_root>/<セット名>/ を作成）
+            workers: ワーカープロセス数（None で CPU 数）
+            encoder_profile: PNG エンコード設定
+            remove_bg: グリッドの背景を rembg で削除するか
+            key_white: remove_bg しない場合にグリッドの白背景を透過にするか
+            detect: グリッドのコマを自動検出するか（False で等分割）
+        """
+        self.output_root = Path(output_root)
+        self.workers = workers or os.cpu_count() or 1
+        self.encoder_profile = encoder_profile
+        self.remove_bg = remove_bg
+        self.key_white = key_white
+        self.detect = detect
+
+    def run(self, entries: list[tuple[str, Optional[str]]]) -> dict:
+        """
+        セットをまとめて処理
+
+        Args:
+            entries: [(グリッド画像 or フォルダのパス, 分割指定 "6x3" or None), ...]
+
+        Returns:
+            {sets, total_images, success_count, failed, elapsed, stage_seconds, images_per_second}
+        """
+        stage_seconds = {"prepare": 0.0, "convert": 0.0, "zip": 0.0}
+        run_start = time.perf_counter()
+
+        sets = []
+        used_names = set()
+        for path, grid_spec in entries:
+            # 同名のセット（別フォルダの grid.png 等）は _2, _3 ... を付ける
+            name = unique_set_name(path, used_names)
+
+            sets.append({
+                "name": name,
+                "source": path,
+                "grid_spec": grid_spec,
+                "output_dir": self.output_root / name,
+                "key_white": False,
+                "results": [],
+                "remaining": 0,
+                "error": None,
+                "zip_path": None,
+            })
+
+        # 投入待ちのジョブ: ("prepare", セット) / ("convert", セット, 番号, 画像)
+        queue = deque(("prepare", set_info) for set_info in sets)
+        max_in_flight = self.workers * 2
+        total_images = 0
+
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=process_pool_context()) as executor:
+            futures = {}
+            while queue or futures:
+                while queue and len(futures) < max_in_flight:
+                    job = queue.popleft()
+                    futures[self._submit(executor, job)] = job
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = futures.pop(future)
+                    set_info = job[1]
+
+                    # 1. 準備が終わったら、そのセットのコマを次に投入する
+                    if job[0] == "prepare":
+                        try:
+                            images, set_info["key_white"], seconds = future.result()
+                            stage_seconds["prepare"] += seconds
+                        except Exception as e:
+                            set_info["error"] = str(e)
+                            continue
+                        set_info["output_dir"].mkdir(parents=True, exist_ok=True)
+                        set_info["results"] = [None] * len(images)
+                        set_info["remaining"] = len(images)
+                        total_images += len(images)
+                        queue.extendleft(
+                            ("convert", set_info, i, image)
+                            for i, image in reversed(list(enumerate(images, start=1)))
+                        )
+                        continue
+
+                    # 2. 変換結果
+                    i = job[2]
+                    try:
+                        result, seconds = future.result()
+                        stage_seconds["convert"] += seconds
+                    except Exception as e:
+                        result = {"success": False, "error": str(e), "index": i}
+                    set_info["results"][i - 1] = result
+                    set_info["remaining"] -= 1
+
+                    # 3. セットが揃ったら ZIP
+                    if set_info["remaining"] == 0 and any(r["success"] for r in set_info["results"]):
+                        start = time.perf_counter()
+                        set_info["zip_path"] = write_set_zip(set_info["output_dir"], set_info["results"])
+                        stage_seconds["zip"] += time.perf_counter() - start
+
+        elapsed = time.perf_counter() - run_start
+
+        failed = []
+        success_count = 0
+        for set_info in sets:
+            if set_info["error"]:
+                failed.append(f"{set_info['source']}: {set_info['error']}")
+            for i, result in enumerate(set_info["results"], start=1):
+                if result["success"]:
+                    success_count += 1
+                else:
+                    failed.append(f"{set_info['source']} #{i}: {result.get('error')}")
+
+        return {
+            "sets": [
+                {
+                    "name": s["name"],
+                    "source": s["source"],
+                    "output_dir": str(s["output_dir"]),
+                    "zip_path": str(s["zip_path"]) if s["zip_path"] else None,
+                    "success_count": sum(1 for r in s["results"] if r["success"]),
+                    "total": len(s["results"]),
+                    "error": s["error"],
+                }
+                for s in sets
+            ],
+            "total_images": total_images,
+            "success_count": success_count,
+            "failed": failed,
+            "elapsed": elapsed,
+            "stage_seconds": stage_seconds,
+            "images_per_second": total_images / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def _submit(self, executor: ProcessPoolExecutor, job: tuple):
+        """準備 / 変換のジョブをプールに投入"""
+        if job[0] == "prepare":
+            set_info = job[1]
+            return executor.submit(
+                _prepare_job, set_info["source"], set_info["grid_spec"],
+                self.detect, self.remove_bg, self.key_white
+            )
+
+        _, set_info, i, image = job
+        return executor.submit(
+            _convert_job, str(set_info["output_dir"]), self.encoder_profile,
+            image, i, set_info["key_white"], i == 1
+        )
+
+
+def print_summary(summary: dict) -> None:
+    """処理結果のサマリーを表示"""
+    print("=" * 60)
+    for s in summary["sets"]:
+        if s["error"]:
+            print(f"  {s['name']}: 読み込み失敗")
+            continue
+        status = f"{s['success_count']}/{s['total']}"
+        print(f"  {s['name']}: {status}  → {s['zip_path'] or s['output_dir']}")
+    print("-" * 60)
+    print(f"  画像数: {summary['total_images']}（成功 {summary['success_count']}）")
+    print(f"  所要時間: {summary['elapsed']:.2f} 秒（{summary['images_per_second']:.1f} 枚/秒）")
+    stages = summary["stage_seconds"]
+    print(
+        f"  ステージ別: 準備 {stages['prepare']:.2f} 秒 / "
+        f"変換 {stages['convert']:.2f} 秒（ともにワーカー合計） / ZIP {stages['zip']:.2f} 秒"
+    )
+    if summary["failed"]:
+        print(f"  失敗: {len(summary['failed'])}件")
+        for failure in summary["failed"]:
+            print(f"    - {failure}")
+    print("=" * 60)
+
+
+# CLI用
+if __name__ == "__main__":
+    import sys
+
+    from .stamp_processor import ENCODER_PROFILES
+
+    VALUE_OPTIONS = {"--list", "--grid", "--workers", "--profile", "--output"}
+
+    def get_option(name: str):
+        if name not in sys.argv:
+            return None
+        idx = sys.argv.index(name)
+        return sys.argv[idx + 1] if idx + 1 < len(sys.argv) else None
+
+    grid_spec = get_option("--grid")
+    entries = []
+    args = iter(sys.argv[1:])
+    for arg in args:
+        if arg in VALUE_OPTIONS:
+            next(args, None)
+        elif not arg.startswith("--"):
+            entries.append((arg, grid_spec))
+
+    list_file = get_option("--list")
+    if list_file:
+        entries += [(path, spec or grid_spec) for path, spec in read_set_list(list_file)]
+
+    if not entries:
+        print("使用方法:")
+        print("  python -m core.batch_runner <grid.png | dir> [...] [オプション]")
+        print("  オプション: --list FILE  （1行1セットのリスト。「パス [行x列]」）")
+        print(f"              --grid RxC  （グリッドの分割数。既定 {DEFAULT_GRID_ROWS}x{DEFAULT_GRID_COLS}）")
+        print("              --workers N  （ワーカープロセス数。既定は CPU 数）")
+        print(f"              --profile NAME  （PNG エンコード設定: {', '.join(ENCODER_PROFILES)}）")
+        print("              --output DIR  （出力先。既定 data/output）")
+        print("              --remove-bg  （グリッドの背景を rembg で削除）")
+        print("              --no-bg  （グリッドの白背景キーをしない）")
+        print("              --no-detect  （コマ検出をせずに等分割）")
+        sys.exit(1)
+
+    workers = get_option("--workers")
+    runner = BatchRunner(
+        output_root=get_option("--output") or "data/output",
+        workers=int(workers) if workers else None,
+        encoder_profile=get_option("--profile") or DEFAULT_ENCODER_PROFILE,
+        remove_bg="--remove-bg" in sys.argv,
+        key_white="--no-bg" not in sys.argv,
+        detect="--no-detect" not in sys.argv
+    )
+
+    print(f"{len(entries)}セットを処理中（ワーカー {runner.workers}）...")
+    summary = runner.run(entries)
+    print_summary(summary)
+    sys.exit(1 if summary["failed"] else 0)
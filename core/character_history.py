@@ -0,0 +1,286 @@
+"""
+生成済みキャラクター履歴モジュール
+
+キャラクター提案の重複防止に使う生成済みキャラクター名を、
+追記専用のログ（JSON Lines）に保存します。
+メモリ上に直近の名前のリストと集合を持つので、重複チェックは O(1)、
+追加はファイル末尾への追記だけで済みます（ファイル全体は書き直さない）。
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # Windows（waitress の1プロセス構成）ではプロセス間ロックなし
+    fcntl = None
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+
+# 履歴ログ（1行1件: {"name": ..., "at": ...}）
+HISTORY_FILE = DATA_DIR / "generated_characters.jsonl"
+
+# 旧形式（{"characters": [...]} を毎回全体書き直し）。初回読み込み時にログへ移行する
+LEGACY_HISTORY_FILE = DATA_DIR / "generated_characters.json"
+
+# 保持する件数（環境変数 GENERATED_HISTORY_LIMIT で変更可）
+DEFAULT_HISTORY_LIMIT = 100
+
+# ログの行数が保持件数のこの倍を超えたら、保持分だけに詰め直す
+COMPACT_RATIO = 2
+
+
+def _history_limit() -> int:
+    try:
+        return max(1, int(os.environ.get("GENERATED_HISTORY_LIMIT", DEFAULT_HISTORY_LIMIT)))
+    except ValueError:
+        return DEFAULT_HISTORY_LIMIT
+
+
+class CharacterHistory:
+    """
+    生成済みキャラクター名の履歴
+
+    - 同じ名前は1件として扱う（直近 limit 件の一意な名前を保持）
+    - 追加は1回の書き込みでログ末尾に追記し、肥大化したら一時ファイル経由で
+      アトミックに詰め直す
+    - 同一プロセス内のスレッドはロックで直列化する。別プロセス（複数ワーカー）とは
+      ロックファイル（<ログ>.lock）の flock で追記・詰め直し・移行を直列化し、
+      他プロセスが追記した分は次のアクセス時にログの増えた部分だけ読み込んで取り込む
+      （fcntl のない Windows ではプロセス間の排他はしない）
+    """
+
+    def __init__(
+        self,
+        path: Path = HISTORY_FILE,
+        limit: Optional[int] = None,
+        legacy_path: Optional[Path] = LEGACY_HISTORY_FILE
+    ):
+        """
+        Args:
+            path: 履歴ログのパス
+            limit: 保持件数（None で環境変数 GENERATED_HISTORY_LIMIT または既定値）
+            legacy_path: 旧形式の履歴ファイル（ログがなければここから移行）
+        """
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(f"{self.path.name}.lock")
+        self.limit = limit or _history_limit()
+        self.legacy_path = Path(legacy_path) if legacy_path else None
+        self._names = deque()
+        self._index = set()
+        self._lines = 0
+        self._file_id = None
+        self._head = b""
+        self._offset = 0
+        self._lock = threading.Lock()
+        self._file_locked = False
+
+    def names(self) -> list[str]:
+        """保持している名前（古い順）"""
+        with self._lock:
+            self._refresh_locked()
+            return list(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            self._refresh_locked()
+            return name in self._index
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh_locked()
+            return len(self._names)
+
+    def add(self, names: Iterable[str]) -> list[str]:
+        """
+        名前を追加（保持中の名前・空の名前は無視）
+
+        Returns:
+            新たに追加した名前
+        """
+        with self._lock, self._file_lock():
+            self._refresh_locked()
+
+            added = []
+            for name in names:
+                name = (name or "").strip()
+                if name and name not in self._index and name not in added:
+                    added.append(name)
+            if not added:
+                return []
+
+            now = time.time()
+            data = "".join(
+                json.dumps({"name": name, "at": now}, ensure_ascii=False) + "\n"
+                for name in added
+            ).encode("utf-8")
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "ab") as f:
+                    f.write(data)
+                # 自分の追記分（と、その間の他プロセスの追記分）をログから取り込む
+                self._refresh_locked()
+            except OSError as e:
+                print(f"[履歴] 保存失敗: {e}")
+                for name in added:
+                    self._remember(name)
+
+            if self._lines > self.limit * COMPACT_RATIO:
+                self._compact_locked()
+            return added
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        他プロセスとの排他（ログは詰め直しで置き換わるので、別のロックファイルを使う）
+
+        self._lock を持った状態で呼ぶ。取得済みなら何もしない（add からの入れ子）。
+        """
+        if self._file_locked:
+            yield
+            return
+
+        lock_file = None
+        if fcntl is not None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                lock_file = open(self.lock_path, "a")
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            except OSError as e:
+                print(f"[履歴] ロック失敗: {e}")
+                if lock_file is not None:
+                    lock_file.close()
+                    lock_file = None
+        self._file_locked = True
+        try:
+            yield
+        finally:
+            self._file_locked = False
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    def _remember(self, name: str) -> None:
+        """メモリ上の履歴に追加（上限を超えたら最も古い名前を外す）"""
+        if name in self._index:
+            return
+        self._names.append(name)
+        self._index.add(name)
+        while len(self._names) > self.limit:
+            self._index.discard(self._names.popleft())
+
+    @staticmethod
+    def _stat_id(stat: os.stat_result) -> tuple:
+        return (stat.st_dev, stat.st_ino)
+
+    def _refresh_locked(self) -> None:
+        """ログの変化（初回・他プロセスの追記・詰め直し）を取り込む"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self._file_id is None and not self._names:
+                with self._file_lock():
+                    # ロック待ちの間に他プロセスが移行・追記していればそれを読む
+                    if self.path.exists():
+                        self._refresh_locked()
+                    else:
+                        self._migrate_legacy_locked()
+            return
+
+        file_id = self._stat_id(stat)
+        if file_id != self._file_id or stat.st_size < self._offset or not self._same_head_locked():
+            # 初回、または別プロセスが詰め直した: 全体を読み直す
+            self._names.clear()
+            self._index.clear()
+            self._lines = 0
+            self._offset = 0
+            self._head = b""
+            self._file_id = file_id
+        if stat.st_size > self._offset:
+            self._read_from_locked(self._offset)
+
+    def _same_head_locked(self) -> bool:
+        """
+        読み込み済みのログと先頭行が同じか
+
+        詰め直しで置き換わったファイルが解放済みの inode 番号を再利用すると
+        (st_dev, st_ino) だけでは置き換えに気付けないため、先頭行も比べる。
+        """
+        if not self._head:
+            return True
+        try:
+            with open(self.path, "rb") as f:
+                return f.read(len(self._head)) == self._head
+        except OSError:
+            return True
+
+    def _read_from_locked(self, offset: int) -> None:
+        """ログの offset 以降を読み込む（書きかけの最終行は次回に回す）"""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except OSError as e:
+            print(f"[履歴] 読み込み失敗: {e}")
+            return
+
+        end = data.rfind(b"\n") + 1
+        if offset == 0 and end:
+            self._head = data[:data.index(b"\n") + 1]
+        for line in data[:end].splitlines():
+            self._lines += 1
+            try:
+                name = json.loads(line).get("name")
+            except (ValueError, AttributeError):
+                continue
+            if isinstance(name, str) and name:
+                self._remember(name)
+        self._offset = offset + end
+
+    def _compact_locked(self) -> None:
+        """保持中の名前だけのログを一時ファイルに書き、置き換える"""
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            now = time.time()
+            lines = [
+                (json.dumps({"name": name, "at": now}, ensure_ascii=False) + "\n").encode("utf-8")
+                for name in self._names
+            ]
+            with open(tmp_path, "wb") as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+                stat = os.fstat(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._file_id, self._offset = self._stat_id(stat), stat.st_size
+            self._head = lines[0] if lines else b""
+            self._lines = len(self._names)
+        except OSError as e:
+            print(f"[履歴] 詰め直し失敗: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    def _migrate_legacy_locked(self) -> None:
+        """旧形式の履歴ファイルがあればログへ移行"""
+        if not self.legacy_path or not self.legacy_path.exists():
+            return
+        try:
+            data = json.loads(self.legacy_path.read_text(encoding="utf-8"))
+            legacy = [name for name in data.get("characters", []) if isinstance(name, str) and name]
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"[履歴] 旧形式の読み込み失敗: {e}")
+            return
+        for name in legacy:
+            self._remember(name)
+        if self._names:
+            self._compact_locked()
+            print(f"[履歴] {self.legacy_path.name} から {len(self._names)}件を移行しました")
+
+
+character_history = CharacterHistory()
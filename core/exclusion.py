@@ -0,0 +1,137 @@
+"""
+キャラクター名の除外リストモジュール
+
+キャラクター提案プロンプトの除外リストを一定の大きさに抑えるため、
+文字 n-gram の類似度で似た名前をまとめ、新しい順に代表だけを選びます。
+提案された名前は応答後に履歴全体と照合し、重複したものだけ再依頼します。
+"""
+
+import unicodedata
+from collections import defaultdict
+from typing import Iterable, Optional
+
+# 類似度に使う文字 n-gram の長さ（日本語の名前なので 2-gram）
+NGRAM = 2
+
+# プロンプトに載せる除外名の上限
+MAX_EXCLUSION_NAMES = 30
+
+# この類似度以上の名前は同じグループとみなし、除外リストには代表（最新）だけ載せる
+CLUSTER_THRESHOLD = 0.4
+
+# 提案された名前がこの類似度以上で履歴と一致したら重複とみなす
+DUPLICATE_THRESHOLD = 0.6
+
+
+def normalize_name(name: str) -> str:
+    """比較用に正規化（NFKC・小文字化・文字と数字以外を除去）"""
+    name = unicodedata.normalize("NFKC", name).lower()
+    return "".join(ch for ch in name if unicodedata.category(ch)[0] in "LN")
+
+
+def name_ngrams(name: str, n: int = NGRAM) -> frozenset:
+    """正規化した名前の文字 n-gram の集合"""
+    key = normalize_name(name)
+    if len(key) <= n:
+        return frozenset([key]) if key else frozenset()
+    return frozenset(key[i:i + n] for i in range(len(key) - n + 1))
+
+
+class NameIndex:
+    """
+    名前の n-gram 転置インデックス
+
+    n-gram を共有する名前だけを候補にして Jaccard 係数を計算する。
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self._grams = {}
+        self._postings = defaultdict(set)
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str) -> None:
+        grams = name_ngrams(name)
+        if not grams or name in self._grams:
+            return
+        self._grams[name] = grams
+        for gram in grams:
+            self._postings[gram].add(name)
+
+    def most_similar(self, name: str) -> tuple[Optional[str], float]:
+        """
+        最も似ている登録済みの名前
+
+        Returns:
+            (名前, Jaccard 係数)。候補がなければ (None, 0.0)
+        """
+        grams = name_ngrams(name)
+        shared = defaultdict(int)
+        for gram in grams:
+            for other in self._postings.get(gram, ()):
+                shared[other] += 1
+
+        best, best_score = None, 0.0
+        for other, count in shared.items():
+            score = count / (len(grams) + len(self._grams[other]) - count)
+            if score > best_score:
+                best, best_score = other, score
+        return best, best_score
+
+
+def select_exclusions(
+    names: list[str],
+    limit: int = MAX_EXCLUSION_NAMES,
+    threshold: float = CLUSTER_THRESHOLD
+) -> list[str]:
+    """
+    プロンプトに載せる除外名を選ぶ
+
+    新しい名前から順に見て、すでに選んだ名前と似ていないものだけを選ぶ
+    （似た名前のグループからは最新の1件が代表になる）。
+
+    Args:
+        names: 履歴（古い順）
+        limit: 選ぶ件数の上限
+        threshold: 同じグループとみなす類似度
+
+    Returns:
+        除外名（新しい順）
+    """
+    index = NameIndex()
+    selected = []
+    for name in reversed(names):
+        if len(selected) >= limit:
+            break
+        if index.most_similar(name)[1] >= threshold:
+            continue
+        selected.append(name)
+        index.add(name)
+    return selected
+
+
+def find_duplicates(
+    candidates: list[str],
+    history: Iterable[str],
+    threshold: float = DUPLICATE_THRESHOLD
+) -> dict[int, str]:
+    """
+    提案された名前のうち、履歴（または先に出た提案）と重複するものを探す
+
+    Args:
+        candidates: 提案された名前
+        history: 履歴の名前（プロンプトに載せなかった分も含めて全件）
+        threshold: 重複とみなす類似度
+
+    Returns:
+        {重複した提案の位置: 一致した既存の名前}
+    """
+    index = NameIndex(history)
+    duplicates = {}
+    for i, name in enumerate(candidates):
+        match, score = index.most_similar(name)
+        if match is not None and score >= threshold:
+            duplicates[i] = match
+        else:
+            index.add(name)
+    return duplicates
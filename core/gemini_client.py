@@ -18,44 +18,36 @@ Gemini API で LINE スタンプ用画像を生成します。
 
 from google import genai
 from google.genai import types
+from google.genai import errors as genai_errors
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable, Optional, TypedDict
+import asyncio
+import contextvars
+import hashlib
+import httpx
 import json
 import io
+import os
+import random
+import re
+import threading
+import time
+import uuid
 
-# 生成済みキャラクター保存ファイル（直近100件）
-GENERATED_CHARACTERS_FILE = Path(__file__).parent.parent / "data" / "generated_characters.json"
-MAX_GENERATED_HISTORY = 100
+from .character_history import character_history
+from .exclusion import find_duplicates, select_exclusions
+from .metrics import GEMINI_ATTEMPT_SECONDS, GEMINI_CALL_SECONDS, format_samples, registry
 
 
 def load_generated_characters() -> list[str]:
-    """生成済みキャラクター名のリストを読み込む"""
-    try:
-        if GENERATED_CHARACTERS_FILE.exists():
-            with open(GENERATED_CHARACTERS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get('characters', [])
-    except:
-        pass
-    return []
-
-
-def save_generated_characters(characters: list[str]) -> None:
-    """生成済みキャラクター名を保存（直近100件）"""
-    try:
-        GENERATED_CHARACTERS_FILE.parent.mkdir(parents=True, exist_ok=True)
-        # 直近100件に制限
-        recent = characters[-MAX_GENERATED_HISTORY:]
-        with open(GENERATED_CHARACTERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump({'characters': recent}, f, ensure_ascii=False, indent=2)
-    except:
-        pass
+    """生成済みキャラクター名のリストを読み込む（古い順）"""
+    return character_history.names()
 
 
 def add_generated_characters(new_names: list[str]) -> None:
     """新しいキャラクター名を追加"""
-    existing = load_generated_characters()
-    existing.extend(new_names)
-    save_generated_characters(existing)
+    character_history.add(new_names)
 
 
 # ============================================================
@@ -65,6 +57,700 @@ def add_generated_characters(new_names: list[str]) -> None:
 ALLOWED_TEXT_MODEL = "gemini-3-flash-preview"
 ALLOWED_IMAGE_MODEL = "gemini-3-pro-image-preview"
 
+# 独立した API 呼び出しを並行実行するためのスレッドプール（I/O 待ちが中心）
+MAX_CONCURRENT_CALLS = 8
+_call_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CALLS, thread_name_prefix="gemini")
+
+
+# ============================================================
+# API 呼び出しスケジューラ（レート制限・リトライ・期限）
+# ============================================================
+# モデルごとのレート制限: (1秒あたりの補充数, バースト上限)
+# ※ プロセスごとの制限。サーバーは1プロセスで動かす前提（wsgi.py 参照）
+RATE_LIMITS = {
+    ALLOWED_TEXT_MODEL: (1.0, 5),        # 60 RPM
+    ALLOWED_IMAGE_MODEL: (10 / 60, 2),   # 10 RPM
+}
+
+# 1回の呼び出し（リトライ込み）の期限（秒）
+CALL_DEADLINES = {
+    ALLOWED_TEXT_MODEL: 60,
+    ALLOWED_IMAGE_MODEL: 180,
+}
+
+# async 版（call_async）の同時実行数の上限（スレッドを使わないので大きめ）
+MAX_CONCURRENT_ASYNC_CALLS = 64
+
+# リトライ対象の HTTP ステータス
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+MAX_ATTEMPTS = 4
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+
+
+class GeminiAPIError(Exception):
+    """Gemini API 呼び出しの失敗（リトライしても成功しなかった場合を含む）"""
+
+    def __init__(
+        self,
+        message: str,
+        model: str = "",
+        attempts: int = 0,
+        status_code: Optional[int] = None,
+        retryable: bool = False
+    ):
+        super().__init__(f"Gemini API エラー: {message}")
+        self.model = model
+        self.attempts = attempts
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+class GeminiDeadlineError(GeminiAPIError):
+    """期限までに呼び出しが完了しなかった"""
+
+
+def _status_code(exc: Exception) -> Optional[int]:
+    """例外から HTTP ステータスを取得（なければ None）"""
+    if isinstance(exc, genai_errors.APIError):
+        return exc.code
+    return None
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """一時的なエラー（レート制限・過負荷・通信エラー）か"""
+    if isinstance(exc, (httpx.TransportError, TimeoutError, ConnectionError)):
+        return True
+    return _status_code(exc) in RETRYABLE_STATUS_CODES
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """Retry-After ヘッダーの秒数（なければ None）"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    トークンバケット（レート制限）
+
+    1秒あたり rate 個のトークンを capacity 個まで補充し、
+    呼び出しごとに1個消費する。
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: int,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline: float) -> bool:
+        """
+        トークンを1個取得（なければ補充まで待つ）
+
+        Args:
+            deadline: 待機の期限（clock の値）
+
+        Returns:
+            取得できたか（期限までに補充されない場合は False）
+        """
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return True
+            if self._clock() + wait > deadline:
+                return False
+            self._sleep(wait)
+
+    async def acquire_async(self, deadline: float) -> bool:
+        """acquire の async 版（待機中はイベントループを止めない）"""
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return True
+            if self._clock() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+    def _take(self) -> float:
+        """トークンがあれば1個消費して 0 を、なければ補充までの秒数を返す"""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+class RequestScheduler:
+    """
+    Gemini API 呼び出しのスケジューラ
+
+    - 同時実行数の上限（全モデル共通。API を呼んでいる間だけ占有する）
+    - モデルごとのトークンバケットによるレート制限
+    - 一時的なエラー（429/503 等）は指数バックオフ + ジッターでリトライ
+      （Retry-After があればそれ以上待つ）
+    - 呼び出しごとの期限（待ち時間・リトライ込み）
+
+    スレッドからは call、イベントループからは call_async を使う
+    （レート制限とメトリクスは共有し、同時実行数の上限はそれぞれに持つ）。
+    clock / sleep を差し替えればテストで実時間を待たずに動かせる。
+    """
+
+    def __init__(
+        self,
+        rate_limits: dict = RATE_LIMITS,
+        max_concurrent: int = MAX_CONCURRENT_CALLS,
+        max_concurrent_async: int = MAX_CONCURRENT_ASYNC_CALLS,
+        max_attempts: int = MAX_ATTEMPTS,
+        backoff_base: float = BACKOFF_BASE_SECONDS,
+        backoff_max: float = BACKOFF_MAX_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        """
+        Args:
+            rate_limits: {モデル名: (1秒あたりの補充数, バースト上限)}
+            max_concurrent: 同時実行数の上限（call）
+            max_concurrent_async: 同時実行数の上限（call_async）
+            max_attempts: 最大試行回数（初回を含む）
+            backoff_base: リトライ待機の基準秒数（試行ごとに倍）
+            backoff_max: リトライ待機の上限秒数
+        """
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets = {
+            model: TokenBucket(rate, capacity, clock, sleep)
+            for model, (rate, capacity) in rate_limits.items()
+        }
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self.max_concurrent_async = max_concurrent_async
+        self._async_slots = None
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def call(self, model: str, fn: Callable[[float], object], timeout: Optional[float] = None):
+        """
+        レート制限・リトライ付きで fn を呼ぶ
+
+        Args:
+            model: モデル名（レート制限とメトリクスの単位）
+            fn: fn(残り秒数) で API を1回呼ぶ関数（残り秒数を HTTP タイムアウトに使う）
+            timeout: 期限（秒）。None でモデルごとの既定値
+
+        Returns:
+            fn の戻り値
+
+        Raises:
+            GeminiDeadlineError: 期限までに完了しなかった場合
+            GeminiAPIError: リトライ不可能なエラー、または試行回数の上限に達した場合
+        """
+        steps = self._call_steps(model, timeout)
+        reply = None
+        try:
+            while True:
+                try:
+                    step, value = steps.send(reply)
+                except StopIteration as stop:
+                    return stop.value
+
+                if step == 'bucket':
+                    reply = self._buckets[model].acquire(value)
+                elif step == 'slot':
+                    reply = self._slots.acquire(timeout=value)
+                elif step == 'attempt':
+                    try:
+                        reply = fn(value), None
+                    except Exception as e:
+                        reply = None, e
+                    finally:
+                        self._slots.release()
+                else:
+                    self._sleep(value)
+                    reply = None
+        finally:
+            steps.close()
+
+    async def call_async(self, model: str, fn: Callable, timeout: Optional[float] = None):
+        """
+        call の async 版
+
+        Args:
+            model: モデル名
+            fn: fn(残り秒数) で API を1回呼ぶ coroutine 関数
+            timeout: 期限（秒）。None でモデルごとの既定値
+
+        Returns:
+            fn の戻り値
+        """
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrent_async)
+
+        steps = self._call_steps(model, timeout)
+        reply = None
+        try:
+            while True:
+                try:
+                    step, value = steps.send(reply)
+                except StopIteration as stop:
+                    return stop.value
+
+                if step == 'bucket':
+                    reply = await self._buckets[model].acquire_async(value)
+                elif step == 'slot':
+                    try:
+                        await asyncio.wait_for(self._async_slots.acquire(), value)
+                        reply = True
+                    except asyncio.TimeoutError:
+                        reply = False
+                elif step == 'attempt':
+                    try:
+                        reply = await fn(value), None
+                    except Exception as e:
+                        reply = None, e
+                    finally:
+                        self._async_slots.release()
+                else:
+                    await asyncio.sleep(value)
+                    reply = None
+        finally:
+            steps.close()
+
+    def _call_steps(self, model: str, timeout: Optional[float]):
+        """
+        call / call_async 共通の手順（待機と API 呼び出しは呼び出し側が行う）
+
+        次の要求を yield し、結果を send で受け取る:
+            ('bucket', 期限)       レート制限のトークンを取る → 取れたか
+            ('slot', 秒数)         同時実行枠を取る → 取れたか
+            ('attempt', 残り秒数)  API を1回呼び、同時実行枠を返す → (戻り値, 例外)
+            ('sleep', 秒数)        リトライ前に待つ
+
+        Returns:
+            fn の戻り値（StopIteration.value）
+        """
+        start = self._clock()
+        deadline = start + (timeout or CALL_DEADLINES.get(model, 60))
+        has_bucket = model in self._buckets
+        self._record(model, calls=1)
+        outcome = 'error'
+
+        try:
+            attempt = 0
+            while True:
+                # レート制限のトークンを先に取り、同時実行枠は API を呼ぶ間だけ持つ
+                # （レート制限・バックオフの待機中に他のモデルの呼び出しを塞がない）
+                if has_bucket and not (yield 'bucket', deadline):
+                    self._record(model, errors=1)
+                    raise GeminiDeadlineError("レート制限の待機中に期限切れになりました", model, attempt)
+                if not (yield 'slot', max(0.0, deadline - self._clock())):
+                    self._record(model, errors=1)
+                    raise GeminiDeadlineError("同時実行数の上限で待機中に期限切れになりました", model, attempt)
+                if attempt == 0:
+                    self._record_wait(model, self._clock() - start)
+
+                attempt += 1
+                self._record(model, attempts=1)
+                attempt_start = self._clock()
+                result, error = yield 'attempt', max(1.0, deadline - self._clock())
+                if error is None:
+                    GEMINI_ATTEMPT_SECONDS.observe(self._clock() - attempt_start, model=model, outcome='ok')
+                    self._record(model, successes=1)
+                    outcome = 'ok'
+                    return result
+
+                GEMINI_ATTEMPT_SECONDS.observe(self._clock() - attempt_start, model=model, outcome='error')
+                yield 'sleep', self._retry_delay(model, error, attempt, deadline)
+        finally:
+            GEMINI_CALL_SECONDS.observe(self._clock() - start, model=model, outcome=outcome)
+
+    def _retry_delay(self, model: str, error: Exception, attempt: int, deadline: float) -> float:
+        """
+        失敗した試行のリトライ待機秒数を決める（リトライしない場合は例外を送出）
+
+        Raises:
+            GeminiAPIError: リトライ不可能なエラー、または試行回数の上限に達した場合
+            GeminiDeadlineError: 待機すると期限を過ぎる場合
+        """
+        retryable = _is_retryable(error)
+        if not retryable or attempt >= self.max_attempts:
+            self._record(model, errors=1)
+            raise GeminiAPIError(str(error), model, attempt, _status_code(error), retryable) from error
+
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        delay = max(delay, _retry_after(error) or 0)
+        if self._clock() + delay > deadline:
+            self._record(model, errors=1)
+            raise GeminiDeadlineError(str(error), model, attempt, _status_code(error), retryable) from error
+
+        print(f"[Gemini] {model} リトライ {attempt}/{self.max_attempts - 1}（{delay:.1f}秒後）: {error}")
+        self._record(model, retries=1)
+        return delay
+
+    def _record(self, model: str, **counts) -> None:
+        with self._lock:
+            metrics = self._metrics.setdefault(model, {
+                'calls': 0, 'attempts': 0, 'retries': 0, 'successes': 0, 'errors': 0,
+                'queue_wait_seconds': 0.0, 'queue_wait_max_seconds': 0.0
+            })
+            for name, value in counts.items():
+                metrics[name] += value
+
+    def _record_wait(self, model: str, seconds: float) -> None:
+        with self._lock:
+            metrics = self._metrics[model]
+            metrics['queue_wait_seconds'] += seconds
+            metrics['queue_wait_max_seconds'] = max(metrics['queue_wait_max_seconds'], seconds)
+
+    def stats(self) -> dict:
+        """モデルごとの呼び出し数・試行数・リトライ数・待ち時間"""
+        with self._lock:
+            return {model: dict(metrics) for model, metrics in self._metrics.items()}
+
+
+request_scheduler = RequestScheduler()
+
+
+# ============================================================
+# テキスト応答キャッシュ
+# ============================================================
+RESPONSE_CACHE_DIR = Path(__file__).parent.parent / "data" / "gemini_cache"
+RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60  # 7日
+RESPONSE_CACHE_MAX_ENTRIES = 500
+
+
+class ResponseCache:
+    """
+    テキストモデル応答のディスクキャッシュ
+
+    キーは「モデル名 + プロンプト」のハッシュ。
+    有効期限（TTL）付きで、件数が上限を超えたら最終使用が古いものから削除する（LRU）。
+    最終使用時刻はファイルの更新時刻で管理する。
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path = RESPONSE_CACHE_DIR,
+        ttl: int = RESPONSE_CACHE_TTL,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, prompt: str) -> str:
+        """キャッシュキー（モデル名 + プロンプトの SHA-256）"""
+        return hashlib.sha256(f"{model}\0{prompt}".encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, model: str, prompt: str) -> Optional[dict]:
+        """キャッシュを取得（なし・期限切れなら None）"""
+        path = self._path(self.make_key(model, prompt))
+        entry = None
+        try:
+            entry = json.loads(path.read_text(encoding='utf-8'))
+            if time.time() - entry.get('created_at', 0) > self.ttl:
+                path.unlink(missing_ok=True)
+                entry = None
+            else:
+                # LRU: 最終使用時刻を更新
+                os.utime(path)
+        except (OSError, ValueError):
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def put(self, model: str, prompt: str, text: str, model_version: str) -> None:
+        """応答を保存（書き込みはアトミック）"""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            path = self._path(self.make_key(model, prompt))
+            tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+            tmp_path.write_text(json.dumps({
+                'model': model,
+                'model_version': model_version,
+                'text': text,
+                'created_at': time.time()
+            }, ensure_ascii=False), encoding='utf-8')
+            os.replace(tmp_path, path)
+            self._evict()
+        except OSError as e:
+            print(f"[キャッシュ] 保存失敗: {e}")
+
+    def discard(self, model: str, prompt: str) -> None:
+        """キャッシュを削除（パースできない応答など）"""
+        self._path(self.make_key(model, prompt)).unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        """件数上限を超えた分を最終使用が古い順に削除"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.json'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            Path(path).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        """ヒット/ミス数"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+response_cache = ResponseCache()
+
+
+# ============================================================
+# プロンプト部品（単体生成・一括生成で共通）
+# ============================================================
+GRID_PROMPT_RULES = """【厳守ルール】
+1. 構成：横6列 × 縦3行（Total 18 panels）のグリッド画像
+2. アスペクト比：Wide (16:9)
+3. 背景は「白 (White Background)」
+4. 文字は「日本語」でスタンプ内に入れる
+5. スタイル: Kawaii, Simple flat illustration
+6. 上部タイトルは「日本語」で表示（英語禁止）"""
+
+REGISTRATION_RULES = """【条件】
+- 魅力的でキャッチーなタイトルと説明文を作成
+- 購入意欲を高める説明文にする
+- 「○月○日発売」「○○と検索」等の告知文言はNG"""
+
+
+
+def _grid_prompt_format(char_name: str) -> str:
+    """グリッド画像生成プロンプト（英語）の出力形式"""
+    return f"""Create a character sheet for LINE stickers with 18 variations (6 columns x 3 rows).
+Aspect Ratio: Wide (16:9)
+Add a Title Text at the top in JAPANESE: "{char_name}"
+
+Character Settings:
+Name: {char_name} (display in Japanese)
+Visual: [キャラの見た目を英語で]
+Style: Kawaii, Simple flat illustration, Soft colors
+Background: White
+Text Style: Black text with white outline, Japanese text
+Title: Must be in Japanese, not English
+
+Panels Detail (18 Variations):
+Row 1: 1. [セリフ] 2. [セリフ] ... 6. [セリフ]
+Row 2: 7. [セリフ] ... 12. [セリフ]
+Row 3: 13. [セリフ] ... 18. [セリフ]"""
+
+
+# ============================================================
+# 構造化出力（JSON スキーマ）
+# ============================================================
+class CharacterProposal(TypedDict):
+    """キャラクター案"""
+    name: str
+    concept: str
+    target: str
+
+
+class RegistrationInfo(TypedDict):
+    """LINE 登録情報（日英のタイトルと説明文）"""
+    title_ja: str
+    description_ja: str
+    title_en: str
+    description_en: str
+
+
+def _object_schema(properties: dict) -> dict:
+    """全プロパティ必須の OBJECT スキーマ"""
+    return {'type': 'OBJECT', 'properties': properties, 'required': list(properties)}
+
+
+_STRING = {'type': 'STRING'}
+
+CHARACTERS_SCHEMA = {
+    'type': 'ARRAY',
+    'items': _object_schema({'name': _STRING, 'concept': _STRING, 'target': _STRING}),
+}
+
+REGISTRATION_SCHEMA = _object_schema({key: _STRING for key in (
+    'title_ja', 'description_ja', 'title_en', 'description_en'
+)})
+
+PREPARED_CHARACTERS_SCHEMA = {
+    'type': 'ARRAY',
+    'items': _object_schema({
+        'index': {'type': 'INTEGER'},
+        'grid_prompt': _STRING,
+        **REGISTRATION_SCHEMA['properties'],
+    }),
+}
+
+# 画像生成の設定
+IMAGE_CONFIG = types.GenerateContentConfig(
+    response_modalities=["IMAGE"],
+)
+
+# キャラクター提案の案数
+PROPOSAL_COUNT = 5
+
+# 不正な JSON を受け取ったときに再依頼で付け足す指示
+REASK_NOTE = "\n\n【注意】前回の出力は指定の JSON 形式になっていませんでした。指定のスキーマに従った JSON のみを出力してください。"
+
+# 構造化出力の集計
+_json_stats = {'responses': 0, 'repaired': 0, 'reasked': 0, 'failures': 0}
+_json_stats_lock = threading.Lock()
+
+
+def _count_json(name: str) -> None:
+    with _json_stats_lock:
+        _json_stats[name] += 1
+
+
+def json_output_stats() -> dict:
+    """構造化出力の応答数・修復数・再依頼数・失敗数"""
+    with _json_stats_lock:
+        return dict(_json_stats)
+
+
+# スケジューラ・キャッシュ・構造化出力の集計を /api/metrics に出力
+_SCHEDULER_METRICS = {
+    'calls': ('gemini_calls_total', 'Gemini API calls'),
+    'attempts': ('gemini_attempts_total', 'Gemini API request attempts including retries'),
+    'retries': ('gemini_retries_total', 'Gemini API retries'),
+    'successes': ('gemini_successes_total', 'Gemini API calls that succeeded'),
+    'errors': ('gemini_errors_total', 'Gemini API calls that failed after retries or deadline'),
+    'queue_wait_seconds': ('gemini_queue_wait_seconds_total', 'Time spent waiting for a rate-limit token or slot'),
+}
+
+
+def _collect_metrics() -> list[str]:
+    stats = request_scheduler.stats()
+    lines = []
+    for key, (name, help_text) in _SCHEDULER_METRICS.items():
+        lines += format_samples(name, help_text, 'counter', (
+            ({'model': model}, metrics[key]) for model, metrics in sorted(stats.items())
+        ))
+    lines += format_samples(
+        'gemini_response_cache_total', 'Text response cache lookups', 'counter',
+        (({'result': result}, count) for result, count in response_cache.stats().items())
+    )
+    lines += format_samples(
+        'gemini_json_output_total', 'Structured JSON output handling', 'counter',
+        (({'result': result}, count) for result, count in json_output_stats().items())
+    )
+    return lines
+
+
+registry.register_collector(_collect_metrics)
+
+
+def _require_strings(data, keys: tuple) -> dict:
+    """keys がすべて空でない文字列の dict か検証し、その keys だけの dict を返す"""
+    if not isinstance(data, dict):
+        raise ValueError(f"オブジェクトではありません: {type(data).__name__}")
+    record = {}
+    for key in keys:
+        value = data.get(key)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"{key} がありません")
+        record[key] = value.strip()
+    return record
+
+
+def _to_characters(data) -> list[CharacterProposal]:
+    """キャラクター案の配列を検証（不正な要素は除外し、1件も残らなければエラー）"""
+    if not isinstance(data, list):
+        raise ValueError("配列ではありません")
+    characters = []
+    for item in data:
+        try:
+            characters.append(CharacterProposal(**_require_strings(item, ('name', 'concept', 'target'))))
+        except ValueError:
+            continue
+    if not characters:
+        raise ValueError("有効なキャラクター案がありません")
+    return characters
+
+
+def _to_registration(data) -> RegistrationInfo:
+    """登録情報を検証"""
+    return RegistrationInfo(**_require_strings(data, tuple(REGISTRATION_SCHEMA['properties'])))
+
+
+def _to_list(data) -> list:
+    """一括生成の応答（要素は呼び出し側で個別に検証する）"""
+    if not isinstance(data, list):
+        raise ValueError("配列ではありません")
+    return data
+
+
+def _repair_json(text: str):
+    """
+    崩れた JSON の修復を試みる
+
+    コードフェンスの除去、前後の説明文の除去（最初の [ / { から最後の ] / } まで）、
+    末尾カンマの除去を行ってからパースする。
+
+    Raises:
+        ValueError: 修復できなかった場合
+    """
+    try:
+        return _extract_json(text)
+    except (ValueError, IndexError):
+        pass
+
+    starts = [i for i in (text.find('['), text.find('{')) if i >= 0]
+    end = max(text.rfind(']'), text.rfind('}'))
+    if not starts or end < min(starts):
+        raise ValueError("JSON が見つかりません")
+    body = text[min(starts):end + 1]
+    body = re.sub(r",\s*([\]}])", r"\1", body)
+    return json.loads(body)
+
+
+def _fallback_registration(character: dict) -> dict:
+    """登録情報のフォールバック: キャラクター情報をそのまま切り詰める"""
+    char_name = character.get('name', '')
+    concept = character.get('concept', '')
+    return {
+        'title_ja': char_name[:20],  # 全角20文字以内
+        'description_ja': concept[:80],  # 全角80文字以内
+        'title_en': char_name[:40],
+        'description_en': concept[:160]
+    }
+
 
 def _extract_json(text: str):
     """
@@ -117,13 +803,16 @@ class GeminiClient:
     - gemini-2.x 系は絶対に使用禁止
     """
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, client=None, scheduler: Optional[RequestScheduler] = None):
         """
         Args:
             api_key: Google AI Studio で取得した API キー
+            client: genai.Client の代わりに使うクライアント（テスト用の偽クライアント等）
+            scheduler: API 呼び出しのスケジューラ（None で共有スケジューラ）
         """
         self.api_key = api_key
-        self.client = genai.Client(api_key=api_key)
+        self.client = client or genai.Client(api_key=api_key)
+        self.scheduler = scheduler or request_scheduler
 
         # ============================================================
         # !! モデル設定 - 変更禁止 !!
@@ -143,6 +832,275 @@ class GeminiClient:
         validate_model(self.text_model)
         validate_model(self.image_model)
 
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """
+        API 呼び出しをバックグラウンドで開始し、Future を返す
+
+        互いに依存しない呼び出し（例: 画像生成と登録情報生成）を
+        並行実行するために使う。例外は future.result() で再送出される。
+
+        Args:
+            fn: このクライアントのメソッド（例: client.generate_registration_info）
+
+        Returns:
+            concurrent.futures.Future
+        """
+        # リクエスト単位のメトリクス（ステージ内訳）を引き継ぐ
+        return _call_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    def _generate_content(
+        self,
+        model: str,
+        contents: list,
+        config: Optional[types.GenerateContentConfig] = None,
+        timeout: Optional[float] = None
+    ):
+        """
+        スケジューラ経由で generate_content を呼ぶ（レート制限・リトライ・期限付き）
+
+        各試行の HTTP タイムアウトは期限までの残り時間にする。
+
+        Raises:
+            GeminiAPIError: 呼び出しに失敗した場合
+        """
+        def attempt(remaining: float):
+            return self.client.models.generate_content(
+                model=model,
+                contents=contents,
+                config=self._attempt_config(config, remaining)
+            )
+
+        return self.scheduler.call(model, attempt, timeout)
+
+    async def _generate_content_async(
+        self,
+        model: str,
+        contents: list,
+        config: Optional[types.GenerateContentConfig] = None,
+        timeout: Optional[float] = None
+    ):
+        """_generate_content の async 版（SDK の非同期クライアント client.aio を使う）"""
+        async def attempt(remaining: float):
+            return await self.client.aio.models.generate_content(
+                model=model,
+                contents=contents,
+                config=self._attempt_config(config, remaining)
+            )
+
+        return await self.scheduler.call_async(model, attempt, timeout)
+
+    @staticmethod
+    def _attempt_config(
+        config: Optional[types.GenerateContentConfig],
+        remaining: float
+    ) -> types.GenerateContentConfig:
+        """1回の試行の設定（HTTP タイムアウトを期限までの残り時間にする）"""
+        http_options = types.HttpOptions(timeout=int(remaining * 1000))
+        if config is None:
+            return types.GenerateContentConfig(http_options=http_options)
+        return config.model_copy(update={'http_options': http_options})
+
+    def _generate_text(
+        self,
+        prompt: str,
+        use_cache: bool = True,
+        schema: Optional[dict] = None
+    ) -> tuple[str, dict]:
+        """
+        テキストモデルを呼び出す（応答キャッシュ付き）
+
+        Args:
+            prompt: プロンプト
+            use_cache: False でキャッシュを使わずに必ず API を呼ぶ
+            schema: 指定すると JSON（application/json）でこのスキーマに従って出力させる
+
+        Returns:
+            (text, model_info)
+        """
+        cache_prompt = self._cache_prompt(prompt, schema)
+        if use_cache:
+            cached = self._cached_text(cache_prompt)
+            if cached is not None:
+                return cached
+
+        response = self._generate_content(self.text_model, [prompt], config=self._text_config(schema))
+        return self._text_result(response, cache_prompt, use_cache)
+
+    async def _generate_text_async(
+        self,
+        prompt: str,
+        use_cache: bool = True,
+        schema: Optional[dict] = None
+    ) -> tuple[str, dict]:
+        """_generate_text の async 版"""
+        cache_prompt = self._cache_prompt(prompt, schema)
+        if use_cache:
+            cached = self._cached_text(cache_prompt)
+            if cached is not None:
+                return cached
+
+        response = await self._generate_content_async(self.text_model, [prompt], config=self._text_config(schema))
+        return self._text_result(response, cache_prompt, use_cache)
+
+    def _cached_text(self, cache_prompt: str) -> Optional[tuple[str, dict]]:
+        """キャッシュ済みの応答（なければ None）"""
+        cached = response_cache.get(self.text_model, cache_prompt)
+        if cached is None:
+            return None
+        return cached['text'], {
+            'model_version': cached.get('model_version', 'unknown'),
+            'requested_model': self.text_model,
+            'cached': True
+        }
+
+    @staticmethod
+    def _text_config(schema: Optional[dict]) -> Optional[types.GenerateContentConfig]:
+        """スキーマ指定時は JSON 出力の設定"""
+        if schema is None:
+            return None
+        return types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=schema,
+        )
+
+    def _text_result(self, response, cache_prompt: str, use_cache: bool) -> tuple[str, dict]:
+        """応答からテキストとモデル情報を取り出し、キャッシュに保存"""
+        # モデル情報を取得
+        model_info = {
+            'model_version': getattr(response, 'model_version', 'unknown'),
+            'requested_model': self.text_model
+        }
+
+        # トークン数（取得できる場合のみ）
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None:
+            model_info['prompt_tokens'] = getattr(usage, 'prompt_token_count', None)
+            model_info['output_tokens'] = getattr(usage, 'candidates_token_count', None)
+
+        text = response.text
+        if use_cache and text:
+            response_cache.put(self.text_model, cache_prompt, text, str(model_info['model_version']))
+        return text, model_info
+
+    @staticmethod
+    def _cache_prompt(prompt: str, schema: Optional[dict]) -> str:
+        """キャッシュキー用のプロンプト（スキーマ付きの呼び出しはスキーマもキーに含める）"""
+        if schema is None:
+            return prompt
+        return f"{prompt}\0{json.dumps(schema, sort_keys=True)}"
+
+    def _generate_json(
+        self,
+        prompt: str,
+        schema: dict,
+        validate: Callable,
+        use_cache: bool = True
+    ) -> tuple[object, dict]:
+        """
+        スキーマ付きでテキストモデルを呼び出し、応答を検証して返す
+
+        パースできない応答は修復を試み、それでも検証に通らなければ
+        キャッシュを破棄して1回だけ再依頼する。
+
+        Args:
+            prompt: プロンプト
+            schema: 応答の JSON スキーマ
+            validate: パース結果を検証して返す関数（不正なら ValueError）
+            use_cache: False で応答キャッシュを使わない
+
+        Returns:
+            (validate の戻り値, model_info)
+
+        Raises:
+            ValueError: 再依頼しても有効な応答が得られなかった場合
+        """
+        return self._run_text_steps(self._json_steps(prompt, schema, validate, use_cache))
+
+    async def _generate_json_async(
+        self,
+        prompt: str,
+        schema: dict,
+        validate: Callable,
+        use_cache: bool = True
+    ) -> tuple[object, dict]:
+        """_generate_json の async 版"""
+        return await self._run_text_steps_async(self._json_steps(prompt, schema, validate, use_cache))
+
+    def _json_steps(self, prompt: str, schema: dict, validate: Callable, use_cache: bool):
+        """
+        _generate_json の手順
+
+        テキスト生成の要求 (prompt, use_cache, schema) を yield し、(text, model_info) を受け取る。
+        同期・async のどちらで呼ぶかは _run_text_steps / _run_text_steps_async が決める。
+        """
+        text, model_info = yield prompt, use_cache, schema
+        result = self._first_json_attempt(text, prompt, schema, validate)
+        if result is not None:
+            return result, model_info
+
+        text, model_info = yield prompt + REASK_NOTE, False, schema
+        return self._second_json_attempt(text, validate), model_info
+
+    def _run_text_steps(self, steps):
+        """テキスト生成の要求を yield する手順を _generate_text で実行（失敗は手順に送り返す）"""
+        reply, error = None, None
+        while True:
+            try:
+                request = steps.throw(error) if error is not None else steps.send(reply)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                reply, error = self._generate_text(*request), None
+            except Exception as e:
+                reply, error = None, e
+
+    async def _run_text_steps_async(self, steps):
+        """_run_text_steps の async 版"""
+        reply, error = None, None
+        while True:
+            try:
+                request = steps.throw(error) if error is not None else steps.send(reply)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                reply, error = await self._generate_text_async(*request), None
+            except Exception as e:
+                reply, error = None, e
+
+    def _first_json_attempt(self, text: Optional[str], prompt: str, schema: dict, validate: Callable):
+        """最初の応答を検証（不正ならキャッシュを破棄して None。再依頼する）"""
+        _count_json('responses')
+        try:
+            return self._parse_json(text, validate)
+        except ValueError as e:
+            print(f"[構造化出力] 不正な応答のため再依頼: {e}")
+            response_cache.discard(self.text_model, self._cache_prompt(prompt, schema))
+            _count_json('reasked')
+            return None
+
+    def _second_json_attempt(self, text: Optional[str], validate: Callable):
+        """再依頼の応答を検証"""
+        _count_json('responses')
+        try:
+            return self._parse_json(text, validate)
+        except ValueError as e:
+            _count_json('failures')
+            raise ValueError(f"JSON 応答の検証に失敗しました: {e}")
+
+    @staticmethod
+    def _parse_json(text: Optional[str], validate: Callable):
+        """JSON をパースして検証（失敗したら修復してもう一度）"""
+        if not text:
+            raise ValueError("応答が空です")
+        try:
+            return validate(json.loads(text))
+        except ValueError:
+            pass
+        data = _repair_json(text)
+        result = validate(data)
+        _count_json('repaired')
+        return result
+
     def verify_connection(self) -> dict:
         """
         API接続を確認し、実際に使用されるモデル情報を返す
@@ -157,10 +1115,7 @@ class GeminiClient:
         """
         try:
             # テキストモデルの確認（簡単なテスト）
-            response = self.client.models.generate_content(
-                model=self.text_model,
-                contents=["test"]
-            )
+            response = self._generate_content(self.text_model, ["test"], timeout=30)
 
             # レスポンスからモデル情報を取得
             text_model_version = getattr(response, 'model_version', self.text_model)
@@ -182,43 +1137,32 @@ class GeminiClient:
                 'error': str(e)
             }
 
-    def propose_characters(self, user_request: str = "") -> tuple[list[dict], dict]:
-        """
-        売れそうなLINEスタンプキャラクターを5案提案
-
-        Args:
-            user_request: ユーザーからのリクエスト（例: "丸投げちゃんを題材にした猫"）
-
-        Returns:
-            (characters, model_info)
-            - characters: [{name, concept, target}, ...]
-            - model_info: {'model_version': str, 'requested_model': str}
-        """
+    def _proposal_prompt(self, user_request: str, exclusions: list[str], count: int) -> str:
+        """キャラクター提案のプロンプトを作成"""
         # リクエストがある場合はプロンプトに組み込む
-        if user_request and user_request.strip():
+        if user_request:
             request_section = f"""
 【ユーザーからのリクエスト】
-「{user_request.strip()}」
-このリクエストを元に、LINEスタンプとして売れそうなキャラクターを5つ提案してください。
+「{user_request}」
+このリクエストを元に、LINEスタンプとして売れそうなキャラクターを{count}つ提案してください。
 リクエストの意図を汲み取り、より具体的で魅力的なキャラクターに発展させてください。
 """
         else:
             request_section = ""
 
-        # 生成済みキャラクター除外リスト（直近100件）
-        existing_characters = load_generated_characters()
-        if existing_characters:
+        # 生成済みキャラクター除外リスト（似た名前は代表のみ）
+        if exclusions:
             exclude_section = f"""
-【除外リスト】以下のキャラクターは既に生成済みです。これらとは全く異なる新しいアイデアを出してください:
-{', '.join(existing_characters)}
+【除外リスト】以下のキャラクター（およびこれらに似たもの）は既に生成済みです。これらとは全く異なる新しいアイデアを出してください:
+{', '.join(exclusions)}
 """
         else:
             exclude_section = ""
 
-        prompt = f"""
+        return f"""
 あなたはLINEスタンプのマーケティング専門家です。
 現在、クリエイターズマーケットで人気が出そうな
-少しニッチでシュールなキャラクターのアイデアを5つ提案してください。
+少しニッチでシュールなキャラクターのアイデアを{count}つ提案してください。
 {request_section}{exclude_section}
 【条件】
 1. 「ただ可愛い動物」はNG（レッドオーシャンなので）。
@@ -232,97 +1176,154 @@ JSON配列で出力（日本語で）:
 ]
 """
 
-        response = self.client.models.generate_content(
-            model=self.text_model,
-            contents=[prompt]
-        )
+    def propose_characters(self, user_request: str = "", use_cache: bool = False) -> tuple[list[dict], dict]:
+        """
+        売れそうなLINEスタンプキャラクターを5案提案
 
-        # モデル情報を取得
-        model_info = {
-            'model_version': getattr(response, 'model_version', 'unknown'),
-            'requested_model': self.text_model
-        }
+        除外リストは履歴全体ではなく、似た名前をまとめた代表（新しい順・上限あり）だけを送る。
+        応答の名前は履歴全体と照合し、重複した案の数だけ再依頼して差し替える。
+
+        Args:
+            user_request: ユーザーからのリクエスト（例: "丸投げちゃんを題材にした猫"）
+            use_cache: True で応答キャッシュを使う（既定は使わない。提案は毎回新しい案が欲しいので、
+                同じリクエスト・除外リストでも前回と同じ案を返さないようにする）
+
+        Returns:
+            (characters, model_info)
+            - characters: [{name, concept, target}, ...]
+            - model_info: {'model_version': str, 'requested_model': str,
+                           'prompt_tokens': int（取得できた場合）,
+                           'exclusion': {history, sent, duplicates, replaced}}
+        """
+        return self._run_text_steps(self._proposal_steps(user_request, use_cache))
+
+    async def propose_characters_async(self, user_request: str = "", use_cache: bool = False) -> tuple[list[dict], dict]:
+        """propose_characters の async 版"""
+        return await self._run_text_steps_async(self._proposal_steps(user_request, use_cache))
+
+    def _proposal_steps(self, user_request: str, use_cache: bool):
+        """propose_characters の手順（テキスト生成の要求は _json_steps と同じ形で yield する）"""
+        user_request = user_request.strip() if user_request else ""
+        history = load_generated_characters()
+        exclusions = select_exclusions(history)
 
         try:
-            characters = _extract_json(response.text)
-            # 生成したキャラクター名を保存
-            new_names = [c.get('name', '') for c in characters if c.get('name')]
-            if new_names:
-                add_generated_characters(new_names)
-            return characters, model_info
-        except:
-            # フォールバック
-            return [
-                {"name": "会議で寝落ちするカエル", "concept": "リモートワークあるある。会議中に眠くなる社会人向け", "target": "20-30代会社員"},
-                {"name": "締め切りに追われるハムスター", "concept": "いつも何かに追われている現代人向け", "target": "学生・社会人"},
-                {"name": "副業に疲れたペンギン", "concept": "本業と副業の両立に疲れた人向け", "target": "副業ワーカー"},
-                {"name": "推し活に全力なウサギ", "concept": "推しへの愛が止まらないオタク向け", "target": "推し活層"},
-                {"name": "節約に目覚めたタヌキ", "concept": "物価高で節約を始めた人向け", "target": "主婦・一人暮らし"}
-            ], model_info
-
-    def create_grid_prompt(self, character: dict) -> tuple[str, dict]:
+            prompt = self._proposal_prompt(user_request, exclusions, PROPOSAL_COUNT)
+            characters, model_info = yield from self._json_steps(prompt, CHARACTERS_SCHEMA, _to_characters, use_cache)
+        except ValueError:
+            return self._fallback_proposal()
+
+        # 履歴（プロンプトに載せなかった分も含む）と照合し、重複した案だけ再依頼
+        duplicates = find_duplicates([c['name'] for c in characters], history)
+        replacements = []
+        if duplicates:
+            prompt = self._reask_prompt(characters, duplicates, user_request, exclusions)
+            try:
+                replacements, reask_info = yield from self._json_steps(prompt, CHARACTERS_SCHEMA, _to_characters, False)
+                self._add_tokens(model_info, reask_info)
+            except (ValueError, GeminiAPIError) as e:
+                # 再依頼に失敗しても、検証済みの案（重複を含む）はそのまま返す
+                print(f"[キャラ提案] 重複の再依頼に失敗: {e}")
+
+        return self._finish_proposal(characters, model_info, history, exclusions, duplicates, replacements)
+
+    def _fallback_proposal(self) -> tuple[list[dict], dict]:
+        """提案に失敗したときの固定のキャラクター案"""
+        model_info = {'model_version': 'fallback', 'requested_model': self.text_model}
+        return [
+            {"name": "会議で寝落ちするカエル", "concept": "リモートワークあるある。会議中に眠くなる社会人向け", "target": "20-30代会社員"},
+            {"name": "締め切りに追われるハムスター", "concept": "いつも何かに追われている現代人向け", "target": "学生・社会人"},
+            {"name": "副業に疲れたペンギン", "concept": "本業と副業の両立に疲れた人向け", "target": "副業ワーカー"},
+            {"name": "推し活に全力なウサギ", "concept": "推しへの愛が止まらないオタク向け", "target": "推し活層"},
+            {"name": "節約に目覚めたタヌキ", "concept": "物価高で節約を始めた人向け", "target": "主婦・一人暮らし"}
+        ], model_info
+
+    def _reask_prompt(self, characters: list[dict], duplicates: dict, user_request: str, exclusions: list[str]) -> str:
+        """重複した案の数だけ新しい案を依頼するプロンプト"""
+        duplicate_names = list(dict.fromkeys(characters[i]['name'] for i in duplicates))
+        print(f"[キャラ提案] 重複 {len(duplicates)}件を再依頼: {', '.join(duplicate_names)}")
+        kept = [c['name'] for i, c in enumerate(characters) if i not in duplicates]
+        return self._proposal_prompt(user_request, duplicate_names + kept + exclusions, len(duplicates))
+
+    @staticmethod
+    def _add_tokens(model_info: dict, extra_info: dict) -> None:
+        """追加の呼び出しの入力トークン数を合算"""
+        if model_info.get('prompt_tokens') and extra_info.get('prompt_tokens'):
+            model_info['prompt_tokens'] += extra_info['prompt_tokens']
+
+    def _finish_proposal(
+        self,
+        characters: list[dict],
+        model_info: dict,
+        history: list[str],
+        exclusions: list[str],
+        duplicates: dict,
+        replacements: list[dict]
+    ) -> tuple[list[dict], dict]:
+        """重複した案を差し替え、履歴に保存して結果を返す"""
+        kept = [c['name'] for i, c in enumerate(characters) if i not in duplicates]
+        still_duplicate = find_duplicates([r['name'] for r in replacements], history + kept)
+        fresh = iter([r for i, r in enumerate(replacements) if i not in still_duplicate])
+        replaced = 0
+        for i in sorted(duplicates):
+            replacement = next(fresh, None)
+            if replacement is None:
+                break
+            characters[i] = replacement
+            replaced += 1
+
+        model_info['exclusion'] = {
+            'history': len(history),
+            'sent': len(exclusions),
+            'duplicates': len(duplicates),
+            'replaced': replaced
+        }
+
+        # 生成したキャラクター名を保存
+        add_generated_characters([c['name'] for c in characters])
+        return characters, model_info
+
+    def create_grid_prompt(self, character: dict, use_cache: bool = True) -> tuple[str, dict]:
         """
         キャラクター情報から6x3グリッド画像生成用の英語プロンプトを作成
 
         Args:
             character: {name, concept, target}
+            use_cache: False で応答キャッシュを使わない
 
         Returns:
             (prompt, model_info)
             - prompt: 英語プロンプト文字列
             - model_info: {'model_version': str, 'requested_model': str}
         """
+        text, model_info = self._generate_text(self._grid_prompt_request(character), use_cache)
+        return text.strip(), model_info
+
+    async def create_grid_prompt_async(self, character: dict, use_cache: bool = True) -> tuple[str, dict]:
+        """create_grid_prompt の async 版"""
+        text, model_info = await self._generate_text_async(self._grid_prompt_request(character), use_cache)
+        return text.strip(), model_info
+
+    @staticmethod
+    def _grid_prompt_request(character: dict) -> str:
+        """英語のグリッド画像プロンプトを作らせるプロンプト"""
         char_name = character.get('name', 'Character')
         concept = character.get('concept', '')
 
         # まず日本語から英語プロンプトを生成
-        translate_prompt = f"""
+        return f"""
 以下のキャラクターでLINEスタンプ18枚分の画像生成プロンプトを英語で作成してください。
 
 キャラクター名: {char_name}
 コンセプト: {concept}
 
-【厳守ルール】
-1. 構成：横6列 × 縦3行（Total 18 panels）のグリッド画像
-2. アスペクト比：Wide (16:9)
-3. 背景は「白 (White Background)」
-4. 文字は「日本語」でスタンプ内に入れる
-5. スタイル: Kawaii, Simple flat illustration
-6. 上部タイトルは「日本語」で表示（英語禁止）
+{GRID_PROMPT_RULES}
 
 以下の形式で英語プロンプトのみ出力（説明不要）:
 
-Create a character sheet for LINE stickers with 18 variations (6 columns x 3 rows).
-Aspect Ratio: Wide (16:9)
-Add a Title Text at the top in JAPANESE: "{char_name}"
-
-Character Settings:
-Name: {char_name} (display in Japanese)
-Visual: [キャラの見た目を英語で]
-Style: Kawaii, Simple flat illustration, Soft colors
-Background: White
-Text Style: Black text with white outline, Japanese text
-Title: Must be in Japanese, not English
-
-Panels Detail (18 Variations):
-Row 1: 1. [セリフ] 2. [セリフ] ... 6. [セリフ]
-Row 2: 7. [セリフ] ... 12. [セリフ]
-Row 3: 13. [セリフ] ... 18. [セリフ]
+{_grid_prompt_format(char_name)}
 """
 
-        response = self.client.models.generate_content(
-            model=self.text_model,
-            contents=[translate_prompt]
-        )
-
-        # モデル情報を取得
-        model_info = {
-            'model_version': getattr(response, 'model_version', 'unknown'),
-            'requested_model': self.text_model
-        }
-
-        return response.text.strip(), model_info
-
     def generate_image(self, prompt: str) -> tuple:
         """
         プロンプトから画像を生成（6x3グリッド）
@@ -334,34 +1335,37 @@ Row 3: 13. [セリフ] ... 18. [セリフ]
             (PIL Image, model_info)
             - image: PIL Image
             - model_info: {'model_version': str, 'requested_model': str}
+
+        Raises:
+            GeminiAPIError: API 呼び出しに失敗した、または画像が返らなかった場合
         """
-        try:
-            response = self.client.models.generate_content(
-                model=self.image_model,
-                contents=[prompt],
-                config=types.GenerateContentConfig(
-                    response_modalities=["IMAGE"],
-                )
-            )
+        response = self._generate_content(self.image_model, [prompt], config=IMAGE_CONFIG)
+        return self._image_result(response)
 
-            # モデル情報を取得
-            model_info = {
-                'model_version': getattr(response, 'model_version', 'unknown'),
-                'requested_model': self.image_model
-            }
+    async def generate_image_async(self, prompt: str) -> tuple:
+        """generate_image の async 版（待機中にスレッドを占有しない）"""
+        response = await self._generate_content_async(self.image_model, [prompt], config=IMAGE_CONFIG)
+        return self._image_result(response)
 
-            for part in response.candidates[0].content.parts:
-                if part.inline_data is not None:
-                    from PIL import Image
-                    image_bytes = part.inline_data.data
-                    return Image.open(io.BytesIO(image_bytes)), model_info
+    def _image_result(self, response) -> tuple:
+        """応答から画像とモデル情報を取り出す"""
+        # モデル情報を取得
+        model_info = {
+            'model_version': getattr(response, 'model_version', 'unknown'),
+            'requested_model': self.image_model
+        }
 
-            raise Exception("画像の生成に失敗しました")
+        candidates = response.candidates or []
+        parts = (candidates[0].content.parts or []) if candidates and candidates[0].content else []
+        for part in parts:
+            if part.inline_data is not None:
+                from PIL import Image
+                image_bytes = part.inline_data.data
+                return Image.open(io.BytesIO(image_bytes)), model_info
 
-        except Exception as e:
-            raise Exception(f"Gemini API エラー: {str(e)}")
+        raise GeminiAPIError("画像の生成に失敗しました", self.image_model)
 
-    def generate_registration_info(self, character: dict) -> dict:
+    def generate_registration_info(self, character: dict, use_cache: bool = True) -> dict:
         """
         キャラクター情報から日英のタイトルと説明文を生成
 
@@ -370,25 +1374,45 @@ Row 3: 13. [セリフ] ... 18. [セリフ]
 
         Args:
             character: {name, concept, target}
+            use_cache: False で応答キャッシュを使わない
 
         Returns:
             {title_ja, description_ja, title_en, description_en}
         """
+        try:
+            registration, _ = self._generate_json(
+                self._registration_prompt(character), REGISTRATION_SCHEMA, _to_registration, use_cache
+            )
+            return registration
+        except ValueError:
+            # フォールバック: シンプルな日英変換
+            return _fallback_registration(character)
+
+    async def generate_registration_info_async(self, character: dict, use_cache: bool = True) -> dict:
+        """generate_registration_info の async 版"""
+        try:
+            registration, _ = await self._generate_json_async(
+                self._registration_prompt(character), REGISTRATION_SCHEMA, _to_registration, use_cache
+            )
+            return registration
+        except ValueError:
+            return _fallback_registration(character)
+
+    @staticmethod
+    def _registration_prompt(character: dict) -> str:
+        """登録情報を作らせるプロンプト"""
         char_name = character.get('name', '')
         concept = character.get('concept', '')
         target = character.get('target', '')
 
-        prompt = f"""
+        return f"""
 以下のLINEスタンプキャラクター情報から、日本語と英語の登録情報を作成してください。
 
 キャラクター名（日本語）: {char_name}
 コンセプト: {concept}
 ターゲット: {target}
 
-【条件】
-- 魅力的でキャッチーなタイトルと説明文を作成
-- 購入意欲を高める説明文にする
-- 「○月○日発売」「○○と検索」等の告知文言はNG
+{REGISTRATION_RULES}
 
 【出力形式】JSON形式で出力（説明不要）:
 {{
@@ -399,18 +1423,124 @@ Row 3: 13. [セリフ] ... 18. [セリフ]
 }}
 """
 
-        response = self.client.models.generate_content(
-            model=self.text_model,
-            contents=[prompt]
+    def prepare_characters(self, characters: list[dict], use_cache: bool = True) -> tuple[list[dict], dict]:
+        """
+        複数キャラクターのグリッド画像プロンプトと登録情報を1回のテキスト生成で作成
+
+        create_grid_prompt + generate_registration_info をキャラクターごとに呼ぶ代わりに、
+        N キャラクター分を1つの JSON 配列で受け取る（5キャラで10回 → 1回）。
+        応答に欠けている・不正な項目はここでは補わず None のまま返す
+        （個別呼び出しで補うと最大 2N 回になるので、グリッド生成時に選ばれたキャラクターの分だけ作る）。
+
+        Args:
+            characters: [{name, concept, target}, ...]
+            use_cache: False で応答キャッシュを使わない
+
+        Returns:
+            (prepared, model_info)
+            - prepared: [{grid_prompt, registration: {title_ja, ...}, missing: [欠落した項目]}, ...]
+              （characters と同じ順番。欠落した項目は None）
+            - model_info: {'model_version': str, 'requested_model': str}
+        """
+        if not characters:
+            return [], {'model_version': 'unknown', 'requested_model': self.text_model}
+
+        character_list = "\n".join(
+            f"{i}. キャラクター名: {c.get('name', '')} / コンセプト: {c.get('concept', '')} / ターゲット: {c.get('target', '')}"
+            for i, c in enumerate(characters, start=1)
         )
 
+        prompt = f"""
+以下の{len(characters)}キャラクターそれぞれについて、
+LINEスタンプ18枚分の画像生成プロンプト（英語）と、日本語と英語の登録情報を作成してください。
+
+【キャラクター】
+{character_list}
+
+【画像生成プロンプト】
+{GRID_PROMPT_RULES}
+
+grid_prompt は以下の形式（"{{キャラクター名}}" は各キャラクター名に置き換える）:
+
+{_grid_prompt_format("{キャラクター名}")}
+
+【登録情報】
+{REGISTRATION_RULES}
+
+【出力形式】JSON配列で出力（キャラクターの番号順、説明不要）:
+[
+    {{
+        "index": 1,
+        "grid_prompt": "英語プロンプト",
+        "title_ja": "日本語タイトル",
+        "description_ja": "日本語説明文",
+        "title_en": "English Title",
+        "description_en": "English description"
+    }},
+    ...
+]
+"""
+
+        items = {}
         try:
-            return _extract_json(response.text)
-        except:
-            # フォールバック: シンプルな日英変換
-            return {
-                'title_ja': char_name[:20],  # 全角20文字以内
-                'description_ja': concept[:80],  # 全角80文字以内
-                'title_en': char_name[:40],
-                'description_en': concept[:160]
-            }
+            data, model_info = self._generate_json(prompt, PREPARED_CHARACTERS_SCHEMA, _to_list, use_cache)
+            for position, item in enumerate(data, start=1):
+                if isinstance(item, dict):
+                    items[item.get('index', position)] = item
+        except ValueError:
+            # 全項目をグリッド生成時に作る
+            model_info = {'model_version': 'fallback', 'requested_model': self.text_model}
+
+        prepared = []
+        missing_count = 0
+        for i in range(1, len(characters) + 1):
+            item = items.get(i, {})
+
+            entry = {'grid_prompt': None, 'registration': None, 'missing': []}
+            try:
+                entry['grid_prompt'] = _require_strings(item, ('grid_prompt',))['grid_prompt']
+            except ValueError:
+                entry['missing'].append('grid_prompt')
+            try:
+                entry['registration'] = _to_registration(item)
+            except ValueError:
+                entry['missing'].append('registration')
+            missing_count += len(entry['missing'])
+            prepared.append(entry)
+
+        if missing_count:
+            print(f"[一括準備] {len(characters)}キャラ中 {missing_count}項目が欠落（グリッド生成時に作成）")
+        return prepared, model_info
+
+
+# ============================================================
+# クライアントの共有
+# ============================================================
+# genai.Client は HTTP コネクション（keep-alive）を内部に保持するので、
+# リクエストごとに作り直さず API キー単位で使い回す
+_clients: dict[str, GeminiClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key: str) -> GeminiClient:
+    """
+    API キーに対応する共有 GeminiClient を取得（なければ作成）
+
+    Args:
+        api_key: Google AI Studio で取得した API キー
+
+    Returns:
+        GeminiClient
+    """
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = GeminiClient(api_key)
+            _clients[api_key] = client
+        return client
+
+
+def invalidate_clients() -> None:
+    """共有クライアントを破棄（APIキー変更時に呼ぶ）"""
+    with _clients_lock:
+        _clients.clear()
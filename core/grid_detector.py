@@ -0,0 +1,159 @@
+"""
+グリッド画像のセル検出モジュール
+
+Gemini が生成するキャラクターシート（上部タイトル・不均一な余白・16:9）から、
+余白（白 or 透過）の投影プロファイルを使って各コマの境界を検出します。
+"""
+
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+# 背景とみなす明るさ（RGBすべてがこの値以上なら白背景）
+WHITE_THRESHOLD = 240
+
+# 背景とみなすアルファ値（これ以下なら透過背景）
+ALPHA_THRESHOLD = 16
+
+# 行/列を「内容あり」とみなす前景ピクセル比率
+OCCUPIED_RATIO = 0.002
+
+# これより狭い余白はコマ内の隙間として無視（画像サイズ比）
+MIN_GAP_RATIO = 0.005
+
+# 先頭の帯がこの比率（中央値比）より低ければタイトル帯とみなす
+TITLE_HEIGHT_RATIO = 0.5
+
+
+def foreground_mask(image: Image.Image) -> np.ndarray:
+    """前景（白でも透過でもない）ピクセルのマスクを作成"""
+    arr = np.asarray(image.convert("RGBA"))
+    opaque = arr[..., 3] > ALPHA_THRESHOLD
+    not_white = arr[..., :3].min(axis=2) < WHITE_THRESHOLD
+    return opaque & not_white
+
+
+def find_bands(profile: np.ndarray, length: int) -> list[tuple[int, int]]:
+    """
+    投影プロファイルから内容のある区間 [start, end) を抽出
+
+    Args:
+        profile: 行/列ごとの前景ピクセル数
+        length: プロファイルと直交する方向の長さ（比率計算用）
+
+    Returns:
+        [(start, end), ...]
+    """
+    occupied = profile > max(1, length * OCCUPIED_RATIO)
+    edges = np.diff(np.concatenate(([0], occupied.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    bands = list(zip(starts.tolist(), ends.tolist()))
+
+    # 狭い隙間で分かれた区間を結合
+    min_gap = max(1, int(len(profile) * MIN_GAP_RATIO))
+    merged = []
+    for start, end in bands:
+        if merged and start - merged[-1][1] < min_gap:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _merge_to_count(bands: list[tuple[int, int]], count: int) -> list[tuple[int, int]]:
+    """隙間が最も狭い隣接区間から結合して count 個にする"""
+    bands = list(bands)
+    while len(bands) > count:
+        gaps = [bands[i + 1][0] - bands[i][1] for i in range(len(bands) - 1)]
+        i = int(np.argmin(gaps))
+        bands[i:i + 2] = [(bands[i][0], bands[i + 1][1])]
+    return bands
+
+
+def _split_evenly(start: int, end: int, count: int) -> list[tuple[int, int]]:
+    """区間を等分割（検出失敗時のフォールバック）"""
+    edges = np.linspace(start, end, count + 1).round().astype(int)
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def _resolve_bands(
+    bands: list[tuple[int, int]],
+    count: Optional[int],
+    lower: int,
+    upper: int
+) -> list[tuple[int, int]]:
+    """検出した区間を期待数に合わせる（足りなければ内容範囲を等分割）"""
+    if count is None:
+        return bands
+    if len(bands) >= count:
+        return _merge_to_count(bands, count)
+    if bands:
+        return _split_evenly(bands[0][0], bands[-1][1], count)
+    return _split_evenly(lower, upper, count)
+
+
+def _cut_lines(bands: list[tuple[int, int]], lower: int, upper: int) -> list[tuple[int, int]]:
+    """
+    区間の間の余白の中央で切り、セルの範囲に広げる
+
+    外側の端は内側の余白（最小値）の半分だけ広げ、[lower, upper) に収める。
+    """
+    if len(bands) > 1:
+        margin = min(bands[i + 1][0] - bands[i][1] for i in range(len(bands) - 1)) // 2
+    else:
+        margin = upper - lower
+
+    cells = []
+    for i, (start, end) in enumerate(bands):
+        cell_start = max(lower, start - margin) if i == 0 else (bands[i - 1][1] + start) // 2
+        cell_end = min(upper, end + margin) if i == len(bands) - 1 else (end + bands[i + 1][0]) // 2
+        cells.append((cell_start, cell_end))
+    return cells
+
+
+def detect_grid_cells(
+    image: Image.Image,
+    rows: Optional[int] = None,
+    cols: Optional[int] = None
+) -> list[tuple[int, int, int, int]]:
+    """
+    グリッド画像から各コマのバウンディングボックスを検出
+
+    行方向の投影で行の帯を見つけ（上部のタイトル帯は除外）、
+    行ごとに列方向の投影でコマを見つける。
+    rows/cols を指定した場合は隙間の狭い区間から結合して数を合わせ、
+    足りない場合は内容範囲を等分割する。
+
+    Args:
+        image: グリッド画像
+        rows: 期待する行数（None で検出結果のまま）
+        cols: 期待する列数（None で検出結果のまま）
+
+    Returns:
+        [(left, upper, right, lower), ...]（行優先順）
+    """
+    mask = foreground_mask(image)
+    height, width = mask.shape
+
+    row_bands = find_bands(mask.sum(axis=1), width)
+
+    # 上部のタイトル帯を除外
+    top = 0
+    if len(row_bands) >= 2 and len(row_bands) > (rows or 1):
+        heights = [end - start for start, end in row_bands[1:]]
+        title_start, title_end = row_bands[0]
+        if title_end - title_start < np.median(heights) * TITLE_HEIGHT_RATIO:
+            row_bands = row_bands[1:]
+            top = title_end
+
+    row_bands = _resolve_bands(row_bands, rows, top, height)
+
+    cells = []
+    for (band_top, band_bottom), (cell_top, cell_bottom) in zip(row_bands, _cut_lines(row_bands, top, height)):
+        col_profile = mask[band_top:band_bottom].sum(axis=0)
+        col_bands = _resolve_bands(find_bands(col_profile, band_bottom - band_top), cols, 0, width)
+        for left, right in _cut_lines(col_bands, 0, width):
+            cells.append((left, cell_top, right, cell_bottom))
+    return cells
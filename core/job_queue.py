@@ -0,0 +1,192 @@
+"""
+非同期ジョブ管理モジュール
+
+時間のかかる処理（Gemini API 呼び出し等）をバックグラウンドのワーカーで実行し、
+ステージ単位の進捗をポーリングで取得できるようにします。
+保存先ディレクトリを指定すると、ジョブの状態をファイルにも書き出すので、
+複数プロセスで動かしている場合でも、どのプロセスからでも進捗と結果を取得できます。
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+# ジョブ / ステージの状態
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+
+# 完了ジョブの保持時間（秒）
+JOB_TTL_SECONDS = 60 * 60
+
+# ジョブID（uuid4 の hex）
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class JobQueueFullError(RuntimeError):
+    """未完了ジョブが上限に達している"""
+
+
+class JobManager:
+    """
+    バックグラウンドジョブ管理クラス
+
+    ワーカー数を制限したスレッドプールでジョブを実行し、
+    状態をメモリ上に保持する（store_dir を指定するとファイルにも保存する）。
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_pending: int = 20,
+        ttl: int = JOB_TTL_SECONDS,
+        store_dir: Optional[Union[str, Path]] = None
+    ):
+        """
+        Args:
+            max_workers: 同時実行数
+            max_pending: このプロセスの未完了ジョブ（待機中 + 実行中）の上限
+            ttl: 完了ジョブの保持時間（秒）
+            store_dir: ジョブ状態の保存先（複数プロセスで共有する。None でメモリのみ）
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.store_dir = Path(store_dir) if store_dir else None
+
+    def submit(self, fn: Callable, stages: list[str], *args, **kwargs) -> str:
+        """
+        ジョブを登録してすぐにジョブIDを返す
+
+        fn は fn(update_stage, *args, **kwargs) として呼ばれる。
+        update_stage(stage, status) でステージの進捗を更新できる。
+        fn の戻り値がジョブの result になる。
+
+        Args:
+            fn: 実行する関数
+            stages: ステージ名のリスト（例: ["prompt", "image", "registration"]）
+
+        Returns:
+            ジョブID
+
+        Raises:
+            JobQueueFullError: 未完了ジョブが上限に達している場合
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        with self._lock:
+            self._cleanup_locked(now)
+            active = sum(
+                1 for job in self._jobs.values()
+                if job["status"] in (STATUS_PENDING, STATUS_RUNNING)
+            )
+            if active >= self.max_pending:
+                raise JobQueueFullError(f"処理待ちのジョブが多すぎます（上限: {self.max_pending}）")
+
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": STATUS_PENDING,
+                "stages": {stage: STATUS_PENDING for stage in stages},
+                "result": None,
+                "error": None,
+                "created_at": now,
+                "updated_at": now,
+            }
+            self._persist_locked(self._jobs[job_id])
+
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """
+        ジョブ状態のスナップショットを取得（存在しなければ None）
+
+        このプロセスのジョブでなければ保存先から読み込む。
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return {**job, "stages": dict(job["stages"])}
+        return self._load(job_id)
+
+    def _run(self, job_id: str, fn: Callable, args: tuple, kwargs: dict) -> None:
+        """ワーカースレッドでジョブを実行"""
+        self._update(job_id, status=STATUS_RUNNING)
+
+        def update_stage(stage: str, status: str) -> None:
+            with self._lock:
+                job = self._jobs[job_id]
+                job["stages"][stage] = status
+                job["updated_at"] = time.time()
+                self._persist_locked(job)
+
+        try:
+            result = fn(update_stage, *args, **kwargs)
+            self._update(job_id, status=STATUS_DONE, result=result)
+        except Exception as e:
+            # 実行中だったステージをエラーにする
+            with self._lock:
+                stages = self._jobs[job_id]["stages"]
+                for stage, status in stages.items():
+                    if status == STATUS_RUNNING:
+                        stages[stage] = STATUS_ERROR
+            self._update(job_id, status=STATUS_ERROR, error=str(e))
+
+    def _update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            job["updated_at"] = time.time()
+            self._persist_locked(job)
+
+    def _job_path(self, job_id: str) -> Path:
+        return self.store_dir / f"{job_id}.json"
+
+    def _persist_locked(self, job: dict) -> None:
+        """ジョブ状態を保存先に書き出す（一時ファイル経由でアトミックに置き換え）"""
+        if self.store_dir is None:
+            return
+        path = self._job_path(job["job_id"])
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            self.store_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(json.dumps(job, ensure_ascii=False, default=str), encoding="utf-8")
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[ジョブ] 状態の保存に失敗: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    def _load(self, job_id: str) -> Optional[dict]:
+        """保存先からジョブ状態を読み込む（なし・期限切れなら None）"""
+        if self.store_dir is None or not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        path = self._job_path(job_id)
+        try:
+            job = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if job.get("status") in (STATUS_DONE, STATUS_ERROR) and time.time() - job.get("updated_at", 0) > self.ttl:
+            path.unlink(missing_ok=True)
+            return None
+        return job
+
+    def _cleanup_locked(self, now: float) -> None:
+        """保持期限を過ぎた完了ジョブを削除（ロック取得済みで呼ぶ）"""
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in (STATUS_DONE, STATUS_ERROR) and now - job["updated_at"] > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+            if self.store_dir is not None:
+                self._job_path(job_id).unlink(missing_ok=True)
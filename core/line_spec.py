@@ -24,6 +24,17 @@ PADDING = 10
 MAX_CONTENT_WIDTH = STAMP_WIDTH - (PADDING * 2)
 MAX_CONTENT_HEIGHT = STAMP_HEIGHT - (PADDING * 2)
 
+# サイズバリエーション（名前: (キャンバスサイズ, 最大コンテンツサイズ)）
+# 1枚の元画像からまとめて生成する
+STAMP_VARIANT = "stamp"
+MAIN_VARIANT = "main"
+TAB_VARIANT = "tab"
+SIZE_VARIANTS = {
+    STAMP_VARIANT: ((STAMP_WIDTH, STAMP_HEIGHT), (MAX_CONTENT_WIDTH, MAX_CONTENT_HEIGHT)),
+    MAIN_VARIANT: ((MAIN_WIDTH, MAIN_HEIGHT), (MAIN_WIDTH, MAIN_HEIGHT)),
+    TAB_VARIANT: ((TAB_WIDTH, TAB_HEIGHT), (TAB_WIDTH, TAB_HEIGHT)),
+}
+
 # スタンプ枚数
 MIN_STAMPS = 8
 MAX_STAMPS = 40
@@ -31,6 +42,7 @@ COMMON_STAMPS = 16  # よく使われる枚数
 
 # ファイル形式
 FILE_FORMAT = "PNG"
+MAX_FILE_SIZE = 1024 * 1024  # 1枚あたり 1MB 以下
 COLOR_MODE = "RGBA"  # 透過必須
 
 # ファイル名規則
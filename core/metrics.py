@@ -0,0 +1,329 @@
+"""
+処理時間メトリクスモジュール
+
+Gemini API 呼び出し・スタンプ変換のステージ・サーバーのリクエスト処理の
+件数と処理時間をプロセス内で集計し、Prometheus のテキスト形式で出力します（/api/metrics）。
+リクエストごとに、そのリクエスト中に計測したステージの合計時間を
+1行の JSON としてログに出力します（負荷がかかったときにどこが律速か調べるため）。
+
+※ 集計はプロセスごと（wsgi.py は1プロセス・マルチスレッドの構成のみサポート）。
+"""
+
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+
+# 処理時間ヒストグラムの既定のバケット（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# リクエストごとのステージ内訳（start_request 〜 finish_request の間だけ dict が入る）
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_samples(name: str, help_text: str, kind: str, samples: Iterable[tuple[dict, float]]) -> list[str]:
+    """
+    1つのメトリクスを Prometheus のテキスト形式の行にする
+
+    Args:
+        name: メトリクス名
+        help_text: 説明（# HELP）
+        kind: counter / gauge / histogram
+        samples: [(ラベル, 値), ...]
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return lines
+
+
+class Counter:
+    """ラベルごとの累積カウンタ"""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return format_samples(
+            self.name, self.help_text, "counter",
+            ((dict(zip(self.label_names, key)), value) for key, value in items)
+        )
+
+
+class Histogram:
+    """
+    ラベルごとの処理時間ヒストグラム
+
+    trace を指定すると、観測値をリクエストごとのステージ内訳にも
+    「<trace>.<最初のラベルの値>」の名前で加算する（例: stamp.encode）。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        label_names: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+        trace: Optional[str] = None
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.trace = trace
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += seconds
+            series["count"] += 1
+
+        if self.trace:
+            stage = f"{self.trace}.{key[0]}" if key else self.trace
+            add_request_stage(stage, seconds)
+
+    @contextmanager
+    def time(self, **labels):
+        """with ブロックの処理時間を観測"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            items = sorted((key, dict(series, counts=list(series["counts"]))) for key, series in self._series.items())
+
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in items:
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {series['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスの登録と Prometheus テキストの出力"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, label_names: tuple = ()) -> Counter:
+        """カウンタを取得（なければ作成）"""
+        return self._get_or_create(name, lambda: Counter(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: tuple = (), **kwargs) -> Histogram:
+        """ヒストグラムを取得（なければ作成）"""
+        return self._get_or_create(name, lambda: Histogram(name, help_text, label_names, **kwargs))
+
+    def _get_or_create(self, name: str, factory: Callable):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def register_collector(self, collector: Callable[[], list[str]]) -> None:
+        """
+        出力時に呼ぶ関数を登録
+
+        各モジュールが既に持っている集計（stats() など）を出力するのに使う。
+        collector() は format_samples で作った行のリストを返す。
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines += metric.collect()
+        for collector in collectors:
+            try:
+                lines += collector()
+            except Exception as e:
+                print(f"[メトリクス] 集計失敗: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Prometheus テキストの Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ========================================
+# 共通のメトリクス
+# ========================================
+
+GEMINI_CALL_SECONDS = registry.histogram(
+    "gemini_call_duration_seconds",
+    "Gemini API call latency including rate-limit waits and retries",
+    ("model", "outcome"),
+    trace="gemini"
+)
+GEMINI_ATTEMPT_SECONDS = registry.histogram(
+    "gemini_attempt_duration_seconds",
+    "Latency of a single Gemini API request attempt",
+    ("model", "outcome")
+)
+STAMP_STAGE_SECONDS = registry.histogram(
+    "stamp_stage_duration_seconds",
+    "Stamp conversion time per stage (per image unless noted by the stage name)",
+    ("stage",),
+    trace="stamp"
+)
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds",
+    "HTTP request handling time",
+    ("method", "endpoint", "status")
+)
+
+
+class StageTimer:
+    """
+    1つの処理のステージごとの処理時間を測る
+
+        timer = StageTimer()
+        with timer.stage("decode"):
+            ...
+        timer.seconds  # {"decode": 0.012, ...}
+
+    プロセスプールのワーカー内でも使えるよう、結果は dict で返すだけにして
+    メトリクスへの記録は呼び出し元（observe_stamp_timings）で行う。
+    """
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+
+def observe_stamp_timings(timings: dict) -> None:
+    """StageTimer で測ったスタンプ1枚分のステージ時間を記録"""
+    for stage, seconds in timings.items():
+        STAMP_STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+# ========================================
+# リクエスト単位の記録
+# ========================================
+
+def add_request_stage(stage: str, seconds: float) -> None:
+    """処理中のリクエストのステージ内訳に加算（リクエスト外なら何もしない）"""
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+def request_log_enabled() -> bool:
+    """リクエストごとの JSON ログを出力するか（環境変数 REQUEST_LOG=0 で無効）"""
+    return os.environ.get("REQUEST_LOG", "1").lower() not in ("0", "false", "off")
+
+
+def start_request() -> tuple:
+    """
+    リクエストの計測を開始
+
+    Returns:
+        finish_request に渡すトークン
+    """
+    return time.perf_counter(), _request_stages.set({})
+
+
+def finish_request(token: tuple, method: str, endpoint: str, path: str, status: int) -> dict:
+    """
+    リクエストの計測を終了し、ヒストグラムに記録して JSON ログを1行出力
+
+    Args:
+        token: start_request の戻り値
+        method: HTTP メソッド
+        endpoint: ルールのパターン（例: /api/download/<folder>。ラベルの種類を抑えるため）
+        path: 実際のパス（ログ用）
+        status: ステータスコード
+
+    Returns:
+        ログに出力した内容
+    """
+    start, context_token = token
+    duration = time.perf_counter() - start
+    stages = _request_stages.get() or {}
+    try:
+        _request_stages.reset(context_token)
+    except ValueError:
+        # 別のコンテキストで終了した場合（通常は起きない）
+        _request_stages.set(None)
+
+    HTTP_REQUEST_SECONDS.observe(duration, method=method, endpoint=endpoint, status=status)
+
+    record = {
+        "event": "request",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "method": method,
+        "path": path,
+        "endpoint": endpoint,
+        "status": status,
+        "duration_ms": round(duration * 1000, 1),
+        "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in sorted(stages.items())},
+    }
+    if request_log_enabled():
+        print(json.dumps(record, ensure_ascii=False))
+    return record
@@ -5,79 +5,271 @@ LINE スタンプ画像処理モジュール
 """
 
 import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from PIL import Image
-from typing import Optional, Union
+from typing import BinaryIO, Optional, Union
+import hashlib
 import io
-
+import json
+import multiprocessing
+import re
+import threading
+import time
+
+from .background import (  # REMBG_AVAILABLE は互換性のため公開
+    REMBG_AVAILABLE, get_background_remover, key_white_background
+)
+from .grid_detector import detect_grid_cells
+from .metrics import STAMP_STAGE_SECONDS, StageTimer, observe_stamp_timings
 from .line_spec import (
-    STAMP_WIDTH, STAMP_HEIGHT,
-    MAIN_WIDTH, MAIN_HEIGHT,
-    TAB_WIDTH, TAB_HEIGHT,
-    PADDING, MAX_CONTENT_WIDTH, MAX_CONTENT_HEIGHT,
-    COLOR_MODE, FILE_FORMAT,
+    SIZE_VARIANTS, STAMP_VARIANT, MAIN_VARIANT, TAB_VARIANT,
+    COLOR_MODE, FILE_FORMAT, MAX_FILE_SIZE, MIN_STAMPS, MAX_STAMPS,
     get_stamp_filename, MAIN_FILENAME, TAB_FILENAME
 )
 
-# 背景削除（オプション）
-try:
-    from rembg import remove as remove_background
-    REMBG_AVAILABLE = True
-except ImportError:
-    REMBG_AVAILABLE = False
+# 入力として扱う画像の拡張子
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+
+# 差分処理用のマニフェスト（出力フォルダに保存。ZIP には含まれない）
+MANIFEST_FILENAME = ".manifest.json"
+MANIFEST_VERSION = 1
+
+
+def _natural_key(name: str) -> list:
+    """自然順ソート用キー（"2.png" < "10.png"）"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+
+def scan_stamp_images(input_dir: Union[str, Path], recursive: bool = False) -> list[str]:
+    """
+    ディレクトリからスタンプの元画像を探す
+
+    os.scandir で各ディレクトリを1回だけ走査し、拡張子で画像を選別する。
+    main.png / tab.png（大文字小文字を区別しない）と隠しファイルは除外する。
+    先頭が数字のファイル（01.png, 3_smile.png 等）をその番号順に並べ、
+    続けてそれ以外のファイルを自然順に並べる。
+
+    Args:
+        input_dir: 入力ディレクトリ
+        recursive: サブディレクトリも含めて1セットとして扱うか（相対パスの自然順）
+
+    Returns:
+        画像ファイルパスのリスト
+    """
+    numbered = []
+    others = []
+
+    def scan(directory: str, prefix: str) -> None:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                relative = prefix + entry.name
+                if entry.is_dir():
+                    if recursive:
+                        scan(entry.path, relative + "/")
+                    continue
+                if not entry.is_file() or os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                if not prefix and entry.name.lower() in (MAIN_FILENAME, TAB_FILENAME):
+                    continue
+
+                match = re.match(r"\d+", entry.name)
+                if match and not prefix:
+                    numbered.append((int(match.group()), _natural_key(relative), entry.path))
+                else:
+                    others.append((_natural_key(relative), entry.path))
+
+    scan(str(input_dir), "")
+    numbered.sort()
+    others.sort()
+    return [path for *_, path in numbered] + [path for _, path in others]
+
+
+def unique_set_name(path: Union[str, Path], used_names: set) -> str:
+    """
+    入力パスから出力セット名を決める
+
+    同名のセット（別フォルダの grid.png 等）は _2, _3 ... を付ける。
+    決めた名前は used_names に追加する。
+    """
+    base_name = Path(path).stem or Path(path).name
+    name, n = base_name, 1
+    while name in used_names:
+        n += 1
+        name = f"{base_name}_{n}"
+    used_names.add(name)
+    return name
+
+
+# PNG エンコード設定
+# - compress_level: zlib 圧縮レベル（0〜9）
+# - optimize: 最適な圧縮設定を探索する（遅いが小さくなる）
+# - quantize: 透過を保ったまま 256 色パレットに減色する（色数 or None）
+ENCODER_PROFILES = {
+    "default": {"compress_level": 6, "optimize": False, "quantize": None},
+    "fast": {"compress_level": 1, "optimize": False, "quantize": None},
+    "small": {"compress_level": 9, "optimize": True, "quantize": None},
+    "palette": {"compress_level": 9, "optimize": True, "quantize": 256},
+}
+DEFAULT_ENCODER_PROFILE = "default"
+
+
+# ========================================
+# プロセスプール（変換の並列化。プロセス内で1つを使い回す）
+# ========================================
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def process_pool_context():
+    """
+    プロセスプールの開始方式
+
+    サーバーはマルチスレッドで動くので fork は使わない（他スレッドが持っていたロックごと
+    複製されてワーカーが固まることがある）。使えれば forkserver、なければ spawn。
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    変換用の共有プロセスプールを取得（初回に CPU 数のワーカーで作成）
+
+    リクエストごとにプールを作るとワーカーの起動（モジュールの import）を毎回待つことになるので、
+    プロセス内で1つを使い回す。1リクエストの並列数は未完了のジョブ数で workers までに抑える（_iter_results）。
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=process_pool_context()
+            )
+        return _process_pool
+
+
+def _discard_process_pool(pool: ProcessPoolExecutor) -> None:
+    """壊れたプール（ワーカーが異常終了した）を捨て、次回に作り直す"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _process_image_job(
+    output_dir: str,
+    encoder_profile: str,
+    image,
+    index: int,
+    remove_bg: bool,
+    with_main_and_tab: bool = False
+) -> dict:
+    """プロセスプール用ワーカー（1枚分の変換）"""
+    processor = StampProcessor(output_dir, encoder_profile)
+    return processor.process_single_image(image, index, remove_bg, with_main_and_tab)
 
 
 class StampProcessor:
     """LINE スタンプ画像処理クラス"""
 
-    def __init__(self, output_dir: str = "data/output"):
+    def __init__(self, output_dir: str = "data/output", encoder_profile: str = DEFAULT_ENCODER_PROFILE):
         """
         Args:
             output_dir: 出力先ディレクトリ
+            encoder_profile: PNG エンコード設定（ENCODER_PROFILES のキー）
         """
+        if encoder_profile not in ENCODER_PROFILES:
+            raise ValueError(
+                f"不明なエンコード設定です: {encoder_profile}\n"
+                f"指定可能: {', '.join(ENCODER_PROFILES)}"
+            )
+
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.encoder_profile = encoder_profile
 
     def process_single_image(
         self,
-        image: Union[Image.Image, bytes, str],
+        image: Union[Image.Image, bytes, str, BinaryIO],
         index: int,
-        remove_bg: bool = False
+        remove_bg: bool = False,
+        with_main_and_tab: bool = False
     ) -> dict:
         """
         単一画像をLINEスタンプ仕様に変換
 
         Args:
-            image: PIL Image, バイトデータ, またはファイルパス
+            image: PIL Image, バイトデータ, ファイルパス, またはファイルストリーム
             index: スタンプ番号（1〜）
             remove_bg: 背景を削除するか
+            with_main_and_tab: main.png と tab.png も同じ元画像から生成するか
 
         Returns:
-            {success, filename, path, size, error}
+            {success, filename, path, size, file_size, timings, error}
+            （with_main_and_tab の場合は main_path, tab_path も含む）
+            timings はステージごとの処理時間（秒）: decode, remove_bg, bbox, resize, encode, save, total
         """
+        timer = StageTimer()
+        start = time.perf_counter()
         try:
-            # 画像を読み込み
-            pil_image = self._load_image(image)
+            # 画像を読み込み（背景削除しない場合はスタンプサイズに合わせて縮小デコード）
+            # 背景削除後にトリミングすると内容が小さくなるので、その場合はフル解像度
+            target_size = None if remove_bg else SIZE_VARIANTS[STAMP_VARIANT][1]
+            with timer.stage("decode"):
+                pil_image = self._load_image(image, target_size)
 
             # 背景削除（オプション）
-            if remove_bg and REMBG_AVAILABLE:
-                pil_image = self._remove_background(pil_image)
-
-            # LINE仕様にリサイズ
-            processed = self._resize_to_stamp_spec(pil_image)
+            if remove_bg:
+                with timer.stage("remove_bg"):
+                    pil_image = self._remove_background(pil_image)
+
+            # バウンディングボックスで余白をトリミング
+            with timer.stage("bbox"):
+                pil_image = self._trim_margins(pil_image)
+
+            # LINE仕様にリサイズ（必要なサイズをまとめて生成）
+            variants = [STAMP_VARIANT]
+            if with_main_and_tab:
+                variants += [MAIN_VARIANT, TAB_VARIANT]
+            with timer.stage("resize"):
+                rendered = self._resize_variants(pil_image, variants, trim=False)
+            processed = rendered[STAMP_VARIANT]
+
+            # PNG エンコード
+            with timer.stage("encode"):
+                encoded = {name: self._encode_image(rendered[name]) for name in variants}
 
             # 保存
             filename = get_stamp_filename(index)
             save_path = self.output_dir / filename
-            processed.save(save_path, FILE_FORMAT)
-
-            return {
+            with timer.stage("save"):
+                file_size = self._write_file(save_path, encoded[STAMP_VARIANT])
+                if with_main_and_tab:
+                    main_path = self.output_dir / MAIN_FILENAME
+                    tab_path = self.output_dir / TAB_FILENAME
+                    self._write_file(main_path, encoded[MAIN_VARIANT])
+                    self._write_file(tab_path, encoded[TAB_VARIANT])
+
+            result = {
                 "success": True,
                 "filename": filename,
                 "path": str(save_path),
-                "size": processed.size
+                "size": processed.size,
+                "file_size": file_size,
+                "timings": {**timer.seconds, "total": time.perf_counter() - start}
             }
 
+            if with_main_and_tab:
+                result["main_path"], result["tab_path"] = str(main_path), str(tab_path)
+
+            return result
+
         except Exception as e:
             return {
                 "success": False,
@@ -89,7 +281,9 @@ class StampProcessor:
         self,
         images: list,
         remove_bg: bool = False,
-        progress_callback=None
+        progress_callback=None,
+        workers: Optional[int] = None,
+        incremental: bool = False
     ) -> dict:
         """
         複数画像を一括処理
@@ -98,51 +292,276 @@ class StampProcessor:
             images: 画像リスト
             remove_bg: 背景削除するか
             progress_callback: 進捗コールバック fn(current, total, status)
+            workers: 並列プロセス数（None/1 で逐次処理）
+            incremental: 出力フォルダのマニフェストと比べ、
+                内容と処理設定が前回と同じ画像は再変換しない
 
         Returns:
-            {success_count, failed_count, results, main_path, tab_path}
+            {success_count, failed_count, skipped_count, results, main_path, tab_path, size_report}
         """
         results = []
         success_count = 0
         failed_count = 0
 
-        for i, img in enumerate(images, start=1):
+        cached = {}
+        source_keys = {}
+        if incremental:
+            cached, source_keys = self._plan_incremental(images, remove_bg)
+
+        for i, result in enumerate(self._iter_results(images, remove_bg, workers, cached), start=1):
             if progress_callback:
                 progress_callback(i, len(images), f"処理中: {i}/{len(images)}")
 
-            result = self.process_single_image(img, i, remove_bg)
             results.append(result)
+            if "timings" in result:
+                observe_stamp_timings(result["timings"])
 
             if result["success"]:
                 success_count += 1
             else:
                 failed_count += 1
 
-        # main.png と tab.png を生成
-        main_path = None
-        tab_path = None
+        # main.png と tab.png は1枚目の変換時に生成済み
+        main_path = results[0].get("main_path") if results else None
+        tab_path = results[0].get("tab_path") if results else None
 
-        if success_count > 0:
-            first_stamp = self.output_dir / get_stamp_filename(1)
-            if first_stamp.exists():
-                main_path, tab_path = self._generate_main_and_tab(first_stamp)
+        if incremental:
+            self._save_manifest(results, source_keys)
 
         return {
             "success_count": success_count,
             "failed_count": failed_count,
+            "skipped_count": len(cached),
             "total": len(images),
             "results": results,
             "main_path": main_path,
             "tab_path": tab_path,
-            "output_dir": str(self.output_dir)
+            "output_dir": str(self.output_dir),
+            "size_report": self._build_size_report(results)
         }
 
+    def _iter_results(
+        self,
+        images: list,
+        remove_bg: bool,
+        workers: Optional[int],
+        cached: Optional[dict] = None
+    ):
+        """
+        画像を変換し、結果を入力順に返すジェネレータ
+
+        workers が2以上の場合はプロセスプールで並列処理する。
+        完了順に関わらず 01.png〜 の番号と結果の順序は入力順のまま。
+        cached に含まれる番号は変換せず、その結果をそのまま返す。
+        """
+        cached = cached or {}
+
+        if not workers or workers <= 1 or len(images) <= 1:
+            for i, img in enumerate(images, start=1):
+                if i in cached:
+                    yield cached[i]
+                else:
+                    yield self.process_single_image(img, i, remove_bg, with_main_and_tab=(i == 1))
+            return
+
+        # 未完了のジョブは workers 個まで（共有プールは CPU 数なので、投入数で並列数を抑える）
+        pool = get_process_pool()
+
+        pending = deque()
+        running = set()
+        try:
+            for i, img in enumerate(images, start=1):
+                if i in cached:
+                    pending.append((None, i, cached[i]))
+                else:
+                    while len(running) >= workers:
+                        _, running = wait(running, return_when=FIRST_COMPLETED)
+                    # ファイルストリームはプロセス間で渡せないのでバイト列にする
+                    if hasattr(img, "read"):
+                        img = img.read()
+                    args = (str(self.output_dir), self.encoder_profile, img, i, remove_bg, i == 1)
+                    try:
+                        future = pool.submit(_process_image_job, *args)
+                    except BrokenProcessPool:
+                        _discard_process_pool(pool)
+                        pool = get_process_pool()
+                        future = pool.submit(_process_image_job, *args)
+                    pending.append((pool, i, future))
+                    running.add(future)
+
+                # 先頭から完了している分は入力順のまま返す
+                while pending and (isinstance(pending[0][2], dict) or pending[0][2].done()):
+                    yield self._future_result(*pending.popleft())
+
+            while pending:
+                yield self._future_result(*pending.popleft())
+        finally:
+            # 途中で中断された場合、未着手の分は取り消す（共有プールに残さない）
+            for _, _, future in pending:
+                if not isinstance(future, dict):
+                    future.cancel()
+
+    @staticmethod
+    def _future_result(pool: Optional[ProcessPoolExecutor], index: int, future) -> dict:
+        """並列処理の結果を取得（ワーカー自体の失敗も結果として返す）"""
+        if isinstance(future, dict):
+            return future
+        try:
+            return future.result()
+        except BrokenProcessPool as e:
+            _discard_process_pool(pool)
+            return {"success": False, "error": str(e), "index": index}
+        except Exception as e:
+            return {"success": False, "error": str(e), "index": index}
+
+    # ========================================
+    # 差分処理（マニフェスト）
+    # ========================================
+
+    def _params_signature(self, remove_bg: bool) -> str:
+        """出力に影響する処理設定（変わったら全て再変換）"""
+        return json.dumps({
+            "version": MANIFEST_VERSION,
+            "encoder_profile": self.encoder_profile,
+            "remove_bg": remove_bg,
+            "variants": SIZE_VARIANTS,
+        }, sort_keys=True)
+
+    @staticmethod
+    def _source_stat(image) -> Optional[list]:
+        """
+        ファイルパス入力のパス・inode・サイズ・更新時刻（変わっていなければハッシュ計算を省略）
+
+        パスと inode も含めるので、並べ替えや差し替えで同じ番号に別のファイルが来た場合は
+        サイズと更新時刻がたまたま同じでもハッシュを計算し直す。
+        """
+        if isinstance(image, (str, Path)):
+            stat = os.stat(image)
+            return [os.path.abspath(image), stat.st_ino, stat.st_size, stat.st_mtime_ns]
+        return None
+
+    @staticmethod
+    def _hash_source(image) -> str:
+        """入力画像の内容ハッシュ"""
+        digest = hashlib.sha256()
+        if isinstance(image, Image.Image):
+            digest.update(f"{image.mode}{image.size}".encode("utf-8"))
+            digest.update(image.tobytes())
+        elif isinstance(image, bytes):
+            digest.update(image)
+        elif isinstance(image, (str, Path)):
+            with open(image, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        elif hasattr(image, "read"):
+            # ストリームは読み終えたら先頭に戻す
+            for chunk in iter(lambda: image.read(1024 * 1024), b""):
+                digest.update(chunk)
+            image.seek(0)
+        else:
+            raise ValueError(f"サポートされていない画像形式: {type(image)}")
+        return digest.hexdigest()
+
+    def _load_manifest(self) -> dict:
+        """出力フォルダのマニフェストを読み込む（なければ空）"""
+        try:
+            manifest = json.loads((self.output_dir / MANIFEST_FILENAME).read_text(encoding="utf-8"))
+            if manifest.get("version") == MANIFEST_VERSION:
+                return manifest
+        except (OSError, ValueError):
+            pass
+        return {"version": MANIFEST_VERSION, "entries": {}}
+
+    def _plan_incremental(self, images: list, remove_bg: bool) -> tuple:
+        """
+        前回から変わっていない画像を判定
+
+        Returns:
+            (cached, source_keys)
+            - cached: {番号: 前回の結果}（再変換しない画像）
+            - source_keys: {番号: {key, stat}}（マニフェスト更新用）
+        """
+        manifest = self._load_manifest()
+        entries = manifest.get("entries", {})
+        params = self._params_signature(remove_bg)
+
+        cached = {}
+        source_keys = {}
+        for i, img in enumerate(images, start=1):
+            filename = get_stamp_filename(i)
+            entry = entries.get(filename)
+            try:
+                stat = self._source_stat(img)
+                # パス入力は同じファイルでサイズと更新時刻も同じならハッシュを再計算しない
+                if entry and stat and entry.get("stat") == stat and entry.get("params") == params:
+                    key = entry["key"]
+                else:
+                    key = self._hash_source(img)
+            except (OSError, ValueError):
+                continue
+            source_keys[i] = {"key": key, "stat": stat, "params": params}
+
+            if not entry or entry.get("key") != key or entry.get("params") != params:
+                continue
+            if not (self.output_dir / filename).exists():
+                continue
+
+            result = {
+                "success": True,
+                "filename": filename,
+                "path": str(self.output_dir / filename),
+                "size": tuple(entry["size"]),
+                "file_size": entry["file_size"],
+                "skipped": True
+            }
+
+            # 1枚目は main.png / tab.png も残っている場合のみ省略
+            if i == 1:
+                main_path = self.output_dir / MAIN_FILENAME
+                tab_path = self.output_dir / TAB_FILENAME
+                if not (main_path.exists() and tab_path.exists()):
+                    continue
+                result["main_path"], result["tab_path"] = str(main_path), str(tab_path)
+
+            cached[i] = result
+
+        return cached, source_keys
+
+    def _save_manifest(self, results: list, source_keys: dict) -> None:
+        """マニフェストを更新し、今回の枚数を超える古い出力を削除"""
+        old_entries = self._load_manifest().get("entries", {})
+
+        entries = {}
+        for i, result in enumerate(results, start=1):
+            if result.get("success") and i in source_keys:
+                entries[result["filename"]] = {
+                    **source_keys[i],
+                    "size": list(result["size"]),
+                    "file_size": result["file_size"]
+                }
+
+        current = {get_stamp_filename(i) for i in range(1, len(results) + 1)}
+        for filename in old_entries:
+            if filename not in current:
+                (self.output_dir / filename).unlink(missing_ok=True)
+
+        manifest_path = self.output_dir / MANIFEST_FILENAME
+        tmp_path = manifest_path.with_name(f"{MANIFEST_FILENAME}.tmp")
+        tmp_path.write_text(
+            json.dumps({"version": MANIFEST_VERSION, "entries": entries}, ensure_ascii=False),
+            encoding="utf-8"
+        )
+        os.replace(tmp_path, manifest_path)
+
     def process_grid_image(
         self,
         grid_image: Union[Image.Image, str],
         rows: int = 4,
         cols: int = 4,
-        remove_bg: bool = False
+        remove_bg: bool = False,
+        workers: Optional[int] = None,
+        detect: bool = True,
+        key_white: bool = True
     ) -> dict:
         """
         グリッド画像（4x4等）を分割して処理
@@ -151,18 +570,46 @@ class StampProcessor:
             grid_image: グリッド画像
             rows: 行数
             cols: 列数
-            remove_bg: 背景削除するか
+            remove_bg: 背景削除するか（rembg。未インストールなら白背景キー）
+            workers: 並列プロセス数（None/1 で逐次処理）
+            detect: 余白からコマの境界を自動検出するか（False で等分割）
+            key_white: remove_bg しない場合に白背景を透過にするか
 
         Returns:
-            処理結果
+            処理結果（cells に各コマのバウンディングボックス）
         """
-        pil_image = self._load_image(grid_image)
-        width, height = pil_image.size
+        with STAMP_STAGE_SECONDS.time(stage="grid_decode"):
+            pil_image = self._load_image(grid_image)
+
+        with STAMP_STAGE_SECONDS.time(stage="grid_detect"):
+            if detect:
+                cells = detect_grid_cells(pil_image, rows, cols)
+            else:
+                cells = self._split_grid_evenly(pil_image.size, rows, cols)
+
+            images = [pil_image.crop(cell) for cell in cells]
+
+        # 背景削除は共有セッションで全コマまとめて行う
+        # しない場合も Gemini の白背景はキーで透過にする（そのままだと余白をトリミングできない）
+        with STAMP_STAGE_SECONDS.time(stage="grid_background"):
+            if remove_bg:
+                images = get_background_remover().remove_batch(images)
+            elif key_white:
+                images = [self._key_white_background(image) for image in images]
+
+        result = self.process_batch(images, remove_bg=False, workers=workers)
+        result["cells"] = cells
+        return result
+
+    @staticmethod
+    def _split_grid_evenly(size: tuple, rows: int, cols: int) -> list:
+        """画像を rows x cols に等分割したバウンディングボックス"""
+        width, height = size
 
         cell_w = width // cols
         cell_h = height // rows
 
-        images = []
+        cells = []
         for row in range(rows):
             for col in range(cols):
                 left = col * cell_w
@@ -170,138 +617,315 @@ class StampProcessor:
                 right = left + cell_w
                 lower = upper + cell_h
 
-                crop = pil_image.crop((left, upper, right, lower))
-                images.append(crop)
-
-        return self.process_batch(images, remove_bg)
+                cells.append((left, upper, right, lower))
+        return cells
 
-    def resize_existing_stamps(self, input_dir: str) -> dict:
+    def resize_existing_stamps(
+        self,
+        input_dir: str,
+        workers: Optional[int] = None,
+        incremental: bool = True,
+        recursive: bool = False
+    ) -> dict:
         """
         既存のスタンプ画像をLINE仕様にリサイズ
 
         Args:
             input_dir: 入力ディレクトリ
+            workers: 並列プロセス数（None/1 で逐次処理）
+            incremental: 前回から変わっていない画像は再変換しない
+            recursive: サブディレクトリの画像も含めるか
 
         Returns:
-            処理結果
+            処理結果（枚数が LINE の範囲外なら warnings に警告）
         """
-        input_path = Path(input_dir)
-        images = []
+        images = scan_stamp_images(input_dir, recursive)
 
-        # 01.png〜16.png を探す
-        for i in range(1, 17):
-            filename = get_stamp_filename(i)
-            filepath = input_path / filename
-            if filepath.exists():
-                images.append(str(filepath))
+        warnings = []
+        if len(images) > MAX_STAMPS:
+            warnings.append(f"{len(images)}枚見つかりました。先頭の{MAX_STAMPS}枚のみ処理します")
+            images = images[:MAX_STAMPS]
+        elif len(images) < MIN_STAMPS:
+            warnings.append(f"{len(images)}枚しかありません（LINEスタンプは{MIN_STAMPS}〜{MAX_STAMPS}枚）")
 
-        if not images:
-            # PNGファイルを連番として扱う
-            png_files = sorted(input_path.glob("*.png"))
-            images = [str(f) for f in png_files if f.name not in [MAIN_FILENAME, TAB_FILENAME]]
+        result = self.process_batch(images, remove_bg=False, workers=workers, incremental=incremental)
+        result["warnings"] = warnings
+        return result
 
-        return self.process_batch(images, remove_bg=False)
+    def _load_image(
+        self,
+        image: Union[Image.Image, bytes, str, Path, BinaryIO],
+        target_size: Optional[tuple] = None
+    ) -> Image.Image:
+        """
+        様々な形式の画像を PIL Image に変換
 
-    def _load_image(self, image: Union[Image.Image, bytes, str]) -> Image.Image:
-        """様々な形式の画像を PIL Image に変換"""
+        Args:
+            image: PIL Image, バイトデータ, ファイルパス, またはファイルストリーム
+            target_size: 最終的なコンテンツサイズ。指定すると RGBA 変換の前に
+                縮小デコード・余白トリミング・整数倍縮小を行う（_decode_reduced）
+
+        Returns:
+            RGBA の PIL Image（ファイルから開いた元画像は変換後すぐ閉じる）
+        """
         if isinstance(image, Image.Image):
+            if target_size:
+                return self._decode_reduced(image, target_size)
             return image.convert(COLOR_MODE)
         elif isinstance(image, bytes):
-            return Image.open(io.BytesIO(image)).convert(COLOR_MODE)
-        elif isinstance(image, str):
-            return Image.open(image).convert(COLOR_MODE)
+            source = io.BytesIO(image)
+        elif isinstance(image, (str, Path)) or hasattr(image, "read"):
+            source = image
         else:
             raise ValueError(f"サポートされていない画像形式: {type(image)}")
 
+        with Image.open(source) as opened:
+            if target_size:
+                # JPEG は DCT スケーリングで target_size 以上を保つ範囲で縮小デコード
+                opened.draft(None, target_size)
+                return self._decode_reduced(opened, target_size)
+            return opened.convert(COLOR_MODE)
+
+    def _decode_reduced(self, image: Image.Image, target_size: tuple) -> Image.Image:
+        """
+        余白トリミングと整数倍縮小をしてから RGBA に変換
+
+        フル解像度の RGBA バッファを作らないよう、元のカラーモードのまま
+        バウンディングボックスで切り出し、target_size の2倍以上あれば
+        reduce() で縮小してから変換する。最終的な LANCZOS 縮小は
+        _resize_variants で行う。
+        """
+        if image.mode == COLOR_MODE:
+            bbox = image.getchannel("A").getbbox()
+        elif image.mode in ("RGB", "L", "CMYK", "YCbCr"):
+            # 透過のないモードは全面が不透明（トリミングなし）
+            bbox = None
+        else:
+            # パレット透過など、変換しないとアルファが分からないモード
+            image = image.convert(COLOR_MODE)
+            bbox = image.getchannel("A").getbbox()
+
+        if bbox:
+            image = image.crop(bbox)
+
+        factor = min(image.width // target_size[0], image.height // target_size[1])
+        if factor >= 2:
+            image = image.reduce(factor)
+
+        return image.convert(COLOR_MODE)
+
     def _remove_background(self, image: Image.Image) -> Image.Image:
-        """背景を削除して透過PNGに"""
-        if not REMBG_AVAILABLE:
-            raise ImportError("rembg がインストールされていません: pip install rembg")
+        """
+        背景を削除して透過PNGに
 
-        # PIL -> bytes -> rembg -> PIL
-        buffer = io.BytesIO()
-        image.save(buffer, format="PNG")
-        result = remove_background(buffer.getvalue())
-        return Image.open(io.BytesIO(result)).convert(COLOR_MODE)
+        rembg の共有セッションを使う。rembg がない場合は白背景をクロマキーで透過する。
+        """
+        return get_background_remover().remove(image)
 
-    def _resize_to_stamp_spec(self, image: Image.Image) -> Image.Image:
-        """画像をLINEスタンプ仕様にリサイズ"""
-        # バウンディングボックスで余白をトリミング
+    def _key_white_background(self, image: Image.Image) -> Image.Image:
+        """外周とつながった白背景を透過にする（内部の白は残す）"""
+        return key_white_background(image)
+
+    @staticmethod
+    def _trim_margins(image: Image.Image) -> Image.Image:
+        """バウンディングボックスで余白をトリミング"""
         bbox = image.getbbox()
         if bbox:
             image = image.crop(bbox)
+        return image
+
+    def _resize_variants(self, image: Image.Image, variants: list, trim: bool = True) -> dict:
+        """
+        1枚の元画像から複数のLINE仕様サイズをまとめて生成
 
-        # アスペクト比を維持してリサイズ
-        image.thumbnail((MAX_CONTENT_WIDTH, MAX_CONTENT_HEIGHT), Image.Resampling.LANCZOS)
+        余白のトリミングは1回だけ行い、大きいサイズから順に縮小する。
+        小さいサイズは直前の縮小結果から作るので、元画像を何度も縮小しない。
 
-        # 370x320 キャンバスに中央配置
-        canvas = Image.new(COLOR_MODE, (STAMP_WIDTH, STAMP_HEIGHT), (0, 0, 0, 0))
-        paste_x = (STAMP_WIDTH - image.width) // 2
-        paste_y = (STAMP_HEIGHT - image.height) // 2
-        canvas.paste(image, (paste_x, paste_y))
+        Args:
+            image: 元画像
+            variants: line_spec.SIZE_VARIANTS のキー（例: ["stamp", "main", "tab"]）
+            trim: 余白をトリミングするか（呼び出し元でトリミング済みなら False）
 
-        return canvas
+        Returns:
+            {バリエーション名: キャンバスに中央配置した画像}
+        """
+        if trim:
+            image = self._trim_margins(image)
 
-    def _resize_fit_center(self, image: Image.Image, target_size: tuple) -> Image.Image:
-        """指定サイズに収めて中央配置"""
-        img = image.copy()
+        # 最大コンテンツサイズの大きい順に処理
+        ordered = sorted(
+            variants,
+            key=lambda name: SIZE_VARIANTS[name][1][0] * SIZE_VARIANTS[name][1][1],
+            reverse=True
+        )
 
-        # バウンディングボックスで余白をトリミング
-        bbox = img.getbbox()
-        if bbox:
-            img = img.crop(bbox)
+        rendered = {}
+        source = image
+        for name in ordered:
+            canvas_size, content_size = SIZE_VARIANTS[name]
 
-        img.thumbnail(target_size, Image.Resampling.LANCZOS)
+            # アスペクト比を維持してリサイズ（拡大はしない）
+            fitted = source.copy()
+            fitted.thumbnail(content_size, Image.Resampling.LANCZOS)
 
-        canvas = Image.new(COLOR_MODE, target_size, (0, 0, 0, 0))
-        paste_x = (target_size[0] - img.width) // 2
-        paste_y = (target_size[1] - img.height) // 2
-        canvas.paste(img, (paste_x, paste_y))
+            # キャンバスに中央配置
+            canvas = Image.new(COLOR_MODE, canvas_size, (0, 0, 0, 0))
+            paste_x = (canvas_size[0] - fitted.width) // 2
+            paste_y = (canvas_size[1] - fitted.height) // 2
+            canvas.paste(fitted, (paste_x, paste_y))
 
-        return canvas
+            rendered[name] = canvas
+            source = fitted
 
-    def _generate_main_and_tab(self, base_image_path: Path) -> tuple:
-        """main.png と tab.png を生成"""
-        base_img = Image.open(base_image_path).convert(COLOR_MODE)
+        return rendered
+
+    def _resize_to_stamp_spec(self, image: Image.Image) -> Image.Image:
+        """画像をLINEスタンプ仕様にリサイズ"""
+        return self._resize_variants(image, [STAMP_VARIANT])[STAMP_VARIANT]
+
+    def _save_image(self, image: Image.Image, save_path: Path) -> int:
+        """
+        エンコード設定に従って PNG を保存
+
+        Returns:
+            保存したファイルのバイト数
+        """
+        return self._write_file(save_path, self._encode_image(image))
+
+    def _encode_image(self, image: Image.Image) -> bytes:
+        """エンコード設定に従って PNG にエンコード"""
+        profile = ENCODER_PROFILES[self.encoder_profile]
 
-        # main.png (240x240)
-        main_img = self._resize_fit_center(base_img, (MAIN_WIDTH, MAIN_HEIGHT))
+        if profile["quantize"]:
+            # FASTOCTREE は RGBA のまま減色でき、透過を保てる
+            image = image.quantize(colors=profile["quantize"], method=Image.Quantize.FASTOCTREE)
+
+        buffer = io.BytesIO()
+        image.save(
+            buffer, FILE_FORMAT,
+            compress_level=profile["compress_level"],
+            optimize=profile["optimize"]
+        )
+        return buffer.getvalue()
+
+    @staticmethod
+    def _write_file(save_path: Path, data: bytes) -> int:
+        """エンコード済みのデータを保存し、バイト数を返す"""
+        save_path.write_bytes(data)
+        return len(data)
+
+    def _build_size_report(self, results: list) -> dict:
+        """ファイルサイズのレポート（LINE の上限超過チェック付き）"""
+        sizes = {r["filename"]: r["file_size"] for r in results if r.get("success")}
+        for name in (MAIN_FILENAME, TAB_FILENAME):
+            path = self.output_dir / name
+            if path.exists():
+                sizes[name] = path.stat().st_size
+
+        return {
+            "encoder_profile": self.encoder_profile,
+            "files": sizes,
+            "total_bytes": sum(sizes.values()),
+            "max_bytes": max(sizes.values(), default=0),
+            "over_limit": [name for name, size in sizes.items() if size > MAX_FILE_SIZE]
+        }
+
+    def _save_main_and_tab(self, main_img: Image.Image, tab_img: Image.Image) -> tuple:
+        """生成済みの main / tab 画像を保存"""
         main_path = self.output_dir / MAIN_FILENAME
-        main_img.save(main_path, FILE_FORMAT)
+        self._save_image(main_img, main_path)
 
-        # tab.png (96x74)
-        tab_img = self._resize_fit_center(base_img, (TAB_WIDTH, TAB_HEIGHT))
         tab_path = self.output_dir / TAB_FILENAME
-        tab_img.save(tab_path, FILE_FORMAT)
+        self._save_image(tab_img, tab_path)
 
         return str(main_path), str(tab_path)
 
+    def _generate_main_and_tab(self, base_image: Union[Image.Image, str, Path]) -> tuple:
+        """main.png と tab.png を生成"""
+        rendered = self._resize_variants(self._load_image(base_image), [MAIN_VARIANT, TAB_VARIANT])
+        return self._save_main_and_tab(rendered[MAIN_VARIANT], rendered[TAB_VARIANT])
+
 
 # CLI用
 if __name__ == "__main__":
     import sys
 
-    if len(sys.argv) < 2:
+    # 値を取るオプション
+    VALUE_OPTIONS = {"--grid", "--workers", "--profile"}
+
+    def get_option(name: str, default=None):
+        if name not in sys.argv:
+            return None
+        idx = sys.argv.index(name)
+        return sys.argv[idx + 1] if idx + 1 < len(sys.argv) else default
+
+    # オプション以外の引数を入力として扱う（複数指定可）
+    inputs = []
+    args = iter(sys.argv[1:])
+    for arg in args:
+        if arg in VALUE_OPTIONS:
+            next(args, None)
+        elif not arg.startswith("--"):
+            inputs.append(arg)
+
+    if not inputs:
         print("使用方法:")
-        print("  python -m core.stamp_processor <input_dir>")
-        print("  python -m core.stamp_processor <grid_image.png> --grid 4x4")
+        print("  python -m core.stamp_processor <input_dir> [<input_dir> ...]")
+        print("  python -m core.stamp_processor <grid_image.png> [<grid_image.png> ...] --grid 4x4")
+        print("  ※ 複数指定した場合は data/output/<フォルダ名 or 画像名>/ に出力")
+        print("  ※ 多数のセットをまとめて処理する場合は python -m core.batch_runner")
+        print("  オプション: --workers N  （N プロセスで並列処理）")
+        print("              --no-detect  （コマ検出をせずに等分割）")
+        print("              --no-bg  （グリッドの背景削除・白背景キーをしない）")
+        print("              --full  （ディレクトリ処理で差分判定をせず全て再変換）")
+        print("              --recursive  （サブディレクトリの画像も1セットに含める）")
+        print(f"              --profile NAME  （PNG エンコード設定: {', '.join(ENCODER_PROFILES)}）")
         sys.exit(1)
 
-    processor = StampProcessor()
-    input_path = sys.argv[1]
+    profile = get_option("--profile", DEFAULT_ENCODER_PROFILE) or DEFAULT_ENCODER_PROFILE
 
-    if "--grid" in sys.argv:
-        # グリッド処理
-        grid_idx = sys.argv.index("--grid")
-        grid_spec = sys.argv[grid_idx + 1] if grid_idx + 1 < len(sys.argv) else "4x4"
-        rows, cols = map(int, grid_spec.split("x"))
+    workers = get_option("--workers", str(os.cpu_count()))
+    workers = int(workers) if workers else None
 
-        print(f"グリッド画像を処理中: {input_path} ({rows}x{cols})")
-        result = processor.process_grid_image(input_path, rows, cols, remove_bg=True)
-    else:
-        # ディレクトリ処理
-        print(f"ディレクトリを処理中: {input_path}")
-        result = processor.resize_existing_stamps(input_path)
-
-    print(f"\n完了: {result['success_count']}/{result['total']} 成功")
-    print(f"出力先: {result['output_dir']}")
+    used_names = set()
+    for input_path in inputs:
+        if len(inputs) > 1:
+            output_dir = Path("data/output") / unique_set_name(input_path, used_names)
+            print(f"\n=== {input_path} ===")
+        else:
+            output_dir = Path("data/output")
+        processor = StampProcessor(str(output_dir), encoder_profile=profile)
+
+        if "--grid" in sys.argv:
+            # グリッド処理
+            grid_spec = get_option("--grid", "4x4")
+            rows, cols = map(int, grid_spec.split("x"))
+
+            print(f"グリッド画像を処理中: {input_path} ({rows}x{cols})")
+            result = processor.process_grid_image(
+                input_path, rows, cols,
+                remove_bg="--no-bg" not in sys.argv,
+                key_white="--no-bg" not in sys.argv,
+                workers=workers,
+                detect="--no-detect" not in sys.argv
+            )
+        else:
+            # ディレクトリ処理
+            print(f"ディレクトリを処理中: {input_path}")
+            result = processor.resize_existing_stamps(
+                input_path, workers=workers,
+                incremental="--full" not in sys.argv,
+                recursive="--recursive" in sys.argv
+            )
+            for warning in result["warnings"]:
+                print(f"!! {warning}")
+
+        print(f"\n完了: {result['success_count']}/{result['total']} 成功")
+        if result["skipped_count"]:
+            print(f"変更なし（再変換を省略）: {result['skipped_count']}枚")
+        print(f"出力先: {result['output_dir']}")
+
+        report = result["size_report"]
+        print(f"合計サイズ: {report['total_bytes'] / 1024:.1f} KB（最大 {report['max_bytes'] / 1024:.1f} KB / 1枚）")
+        if report["over_limit"]:
+            print(f"!! 1MB を超えるファイル: {', '.join(report['over_limit'])}")
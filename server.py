@@ -6,19 +6,26 @@ Gemini APIを使った画像生成とLINE仕様への変換を行います。
 """
 
 import os
-import io
+import uuid
+import ipaddress
 import json
+import hashlib
+import threading
 import zipfile
+from collections import OrderedDict
 from functools import wraps
 from pathlib import Path
 from datetime import datetime
 
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from PIL import Image
+from flask import Flask, Response, g, request, jsonify, send_from_directory, send_file, stream_with_context
 from flask_cors import CORS
 
 # Core モジュール
-from core.gemini_client import GeminiClient
-from core.stamp_processor import StampProcessor
+from core.gemini_client import get_client, invalidate_clients
+from core.stamp_processor import StampProcessor, ENCODER_PROFILES, DEFAULT_ENCODER_PROFILE
+from core.job_queue import JobManager, JobQueueFullError, STATUS_RUNNING, STATUS_DONE
+from core import metrics
 
 # ========================================
 # Flask アプリ設定
@@ -45,10 +52,27 @@ BASE_DIR = Path(__file__).parent
 DATA_DIR = BASE_DIR / "data"
 OUTPUT_DIR = DATA_DIR / "output"
 CONFIG_FILE = DATA_DIR / "mcp_config.json"
+ZIP_CACHE_DIR = DATA_DIR / "zip_cache"
 
 # ディレクトリ作成
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# グリッドの行数・列数の上限（/api/grid-to-stamps）
+MAX_GRID_DIVISIONS = 10
+
+# 直近に生成したグリッド画像（スタンプ変換時にデコードし直さないため保持）
+MAX_RECENT_GRIDS = 8
+_recent_grids = OrderedDict()
+_recent_grids_lock = threading.Lock()
+
+# グリッド生成ジョブ（同時実行数は GRID_JOB_WORKERS で変更可能）
+GRID_JOB_STAGES = ['prompt', 'image', 'registration']
+# 状態は data/jobs/ にも保存し、別プロセスからでも取得できるようにする
+job_manager = JobManager(
+    max_workers=int(os.environ.get('GRID_JOB_WORKERS', 2)),
+    store_dir=DATA_DIR / "jobs"
+)
+
 
 # ========================================
 # セキュリティ関数
@@ -60,28 +84,101 @@ def validate_extension(filename):
     return ext in ALLOWED_EXTENSIONS
 
 
+def is_loopback(remote_addr):
+    """接続元がローカルホスト（ループバックアドレス）か"""
+    try:
+        return ipaddress.ip_address(remote_addr or '').is_loopback
+    except ValueError:
+        return False
+
+
+def is_measured_path(path):
+    """リクエストの処理時間を計測・ログ出力するパス（API のみ。/api/metrics 自体は除く）"""
+    return path.startswith('/api/') and path != '/api/metrics'
+
+
+@app.before_request
+def start_request_metrics():
+    """API リクエストの計測を開始"""
+    if is_measured_path(request.path):
+        g.metrics_token = metrics.start_request()
+
+
+@app.after_request
+def finish_request_metrics(response):
+    """API リクエストの処理時間を記録し、JSON ログを1行出力"""
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.finish_request(token, request.method, endpoint, request.path, response.status_code)
+    return response
+
+
+@app.before_request
+def allow_localhost_only():
+    """ローカルホスト以外からのリクエストを拒否（誤って外部公開した場合の保険）"""
+    if not is_loopback(request.remote_addr):
+        return jsonify({'success': False, 'error': 'ローカルホストからのみ利用できます'}), 403
+
+
+def new_output_id(prefix):
+    """
+    出力ファイル/フォルダ名を作成（例: stamps_20250101_120000_1a2b3c4d）
+
+    日時順に並ぶようにしつつ、同じ秒に複数のリクエスト・ワーカーが
+    作成しても衝突しないよう、ランダムな接尾辞を付ける。
+    """
+    return f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+
+def create_output_folder():
+    """新しいスタンプ出力フォルダを作成し、(フォルダ名, パス) を返す"""
+    folder = new_output_id('stamps')
+    output_dir = OUTPUT_DIR / folder
+    output_dir.mkdir(parents=True)
+    return folder, output_dir
+
+
+# 設定ファイルのキャッシュ（更新時刻が変わったら読み直す）
+_config_cache = {'mtime': None, 'config': {}}
+_config_lock = threading.Lock()
+
+
+def load_config():
+    """設定ファイルを読み込む（更新されていなければキャッシュを返す）"""
+    try:
+        mtime = CONFIG_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        return {}
+
+    with _config_lock:
+        if _config_cache['mtime'] != mtime:
+            try:
+                config = json.loads(CONFIG_FILE.read_text(encoding='utf-8'))
+            except:
+                config = {}
+            _config_cache['mtime'] = mtime
+            _config_cache['config'] = config
+        return dict(_config_cache['config'])
+
+
 def get_api_key():
     """設定ファイルからAPIキーを取得"""
-    if CONFIG_FILE.exists():
-        try:
-            config = json.loads(CONFIG_FILE.read_text(encoding='utf-8'))
-            return config.get('gemini_api_key')
-        except:
-            pass
-    return None
+    return load_config().get('gemini_api_key')
 
 
 def save_api_key(api_key):
     """APIキーを設定ファイルに保存"""
-    config = {}
-    if CONFIG_FILE.exists():
-        try:
-            config = json.loads(CONFIG_FILE.read_text(encoding='utf-8'))
-        except:
-            pass
+    config = load_config()
     config['gemini_api_key'] = api_key
+    CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
     CONFIG_FILE.write_text(json.dumps(config, indent=2), encoding='utf-8')
 
+    # 古いキーのクライアントとキャッシュを破棄
+    invalidate_clients()
+    with _config_lock:
+        _config_cache['mtime'] = None
+
 
 def require_api_key(f):
     """APIキーが必要なエンドポイント用デコレータ"""
@@ -94,6 +191,123 @@ def require_api_key(f):
     return decorated
 
 
+# ========================================
+# グリッド画像
+# ========================================
+
+def remember_grid(filename, image):
+    """生成したグリッド画像をメモリに保持（古いものから破棄）"""
+    with _recent_grids_lock:
+        _recent_grids[filename] = image
+        _recent_grids.move_to_end(filename)
+        while len(_recent_grids) > MAX_RECENT_GRIDS:
+            _recent_grids.popitem(last=False)
+
+
+def load_grid(filename):
+    """
+    保存済みグリッド画像を取得
+
+    メモリに残っていればそれを使い、なければ出力フォルダから読み込む。
+    見つからない場合は None。
+    """
+    with _recent_grids_lock:
+        image = _recent_grids.get(filename)
+    if image is not None:
+        return image
+
+    grid_path = OUTPUT_DIR / filename
+    if not grid_path.is_file():
+        return None
+    image = Image.open(grid_path)
+    image.load()
+    remember_grid(filename, image)
+    return image
+
+
+# ========================================
+# ZIP 配信
+# ========================================
+
+# 圧縮済みフォーマットは再圧縮しない（CPUの無駄）
+STORED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.zip'}
+
+
+class _ZipStreamWriter:
+    """
+    ZipFile の書き込み先
+
+    書き込まれたバイト列をキャッシュファイルに保存しつつ、
+    レスポンスに流すためにバッファへ溜める。
+    tell/seek を持たないので ZipFile はストリーミングモードで書き込む。
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.chunks = []
+
+    def write(self, data):
+        self.cache_file.write(data)
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        self.cache_file.flush()
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def list_zip_entries(folder_path):
+    """ZIPに含めるファイル一覧（名前順）"""
+    return sorted(
+        (entry for entry in os.scandir(folder_path)
+         if entry.is_file() and entry.name.lower().endswith('.png')),
+        key=lambda entry: entry.name
+    )
+
+
+def get_zip_cache_key(entries):
+    """フォルダ内容（名前・サイズ・更新時刻）からキャッシュキーを算出"""
+    digest = hashlib.sha1()
+    for entry in entries:
+        stat = entry.stat()
+        digest.update(f"{entry.name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def stream_zip(folder, entries, cache_path):
+    """
+    ZIPをエントリ単位で生成しながら送信し、完成したらキャッシュに保存
+
+    途中で切断された場合は書きかけのキャッシュを破棄する。
+    """
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{uuid.uuid4().hex}.tmp")
+    completed = False
+    try:
+        with open(tmp_path, 'wb') as cache_file:
+            writer = _ZipStreamWriter(cache_file)
+            with zipfile.ZipFile(writer, 'w') as zf:
+                for entry in entries:
+                    ext = Path(entry.name).suffix.lower()
+                    compress_type = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                    zf.write(entry.path, entry.name, compress_type=compress_type)
+                    yield writer.drain()
+            yield writer.drain()
+
+        # 古いキャッシュを削除して差し替え
+        for old in ZIP_CACHE_DIR.glob(f"{folder}_*.zip"):
+            if old != cache_path:
+                old.unlink(missing_ok=True)
+        os.replace(tmp_path, cache_path)
+        completed = True
+    finally:
+        if not completed:
+            tmp_path.unlink(missing_ok=True)
+
+
 # ========================================
 # 静的ファイル配信
 # ========================================
@@ -147,7 +361,7 @@ def api_config():
 def api_verify_connection(api_key):
     """API接続を確認し、実際に使用されるモデルを返す"""
     try:
-        client = GeminiClient(api_key)
+        client = get_client(api_key)
         result = client.verify_connection()
 
         # サーバーログに出力
@@ -168,6 +382,20 @@ def api_verify_connection(api_key):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def log_proposal(user_request, model_info):
+    """キャラクター提案の使用モデル・入力トークン数をサーバーログに出力"""
+    if user_request:
+        print(f"[キャラ提案] リクエスト: {user_request}")
+    print(f"[キャラ提案] 使用モデル: {model_info.get('model_version', 'unknown')}")
+    exclusion = model_info.get('exclusion')
+    if exclusion:
+        print(
+            f"[キャラ提案] 入力トークン: {model_info.get('prompt_tokens', '-')}"
+            f"（除外リスト {exclusion['sent']}/{exclusion['history']}件、"
+            f"重複差し替え {exclusion['replaced']}/{exclusion['duplicates']}件）"
+        )
+
+
 @app.route('/api/propose-characters', methods=['POST'])
 @require_api_key
 def api_propose_characters(api_key):
@@ -177,13 +405,9 @@ def api_propose_characters(api_key):
     user_request = data.get('request', '')
 
     try:
-        client = GeminiClient(api_key)
+        client = get_client(api_key)
         characters, model_info = client.propose_characters(user_request)
-
-        # サーバーログに使用モデルを出力
-        if user_request:
-            print(f"[キャラ提案] リクエスト: {user_request}")
-        print(f"[キャラ提案] 使用モデル: {model_info.get('model_version', 'unknown')}")
+        log_proposal(user_request, model_info)
 
         return jsonify({
             'success': True,
@@ -195,59 +419,268 @@ def api_propose_characters(api_key):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/generate-grid', methods=['POST'])
+@app.route('/api/prepare-characters', methods=['POST'])
 @require_api_key
-def api_generate_grid(api_key):
-    """キャラクターから6x3グリッド画像を生成"""
-    data = request.get_json()
-    character = data.get('character')
+def api_prepare_characters(api_key):
+    """複数キャラクターのグリッド画像プロンプトと登録情報を1回の呼び出しで作成"""
+    data = request.get_json() or {}
+    characters = data.get('characters')
 
-    if not character:
+    if not characters or not isinstance(characters, list):
         return jsonify({'success': False, 'error': 'キャラクターが指定されていません'}), 400
 
     try:
-        client = GeminiClient(api_key)
+        client = get_client(api_key)
+        prepared, model_info = client.prepare_characters(characters)
+        print(f"[一括準備] {len(characters)}キャラ 使用モデル: {model_info.get('model_version', 'unknown')}")
+
+        return jsonify({
+            'success': True,
+            'prepared': prepared,
+            'model_info': model_info
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 
-        # キャラクター情報から英語プロンプトを生成
+def run_grid_pipeline(client, character, update_stage=None):
+    """
+    キャラクターから6x3グリッド画像を生成し、登録情報と合わせて返す
+
+    character に /api/prepare-characters の grid_prompt / registration が
+    含まれていれば、それを使ってテキストモデルの呼び出しを省く。
+
+    Args:
+        client: GeminiClient
+        character: {name, concept, target[, grid_prompt, registration]}
+        update_stage: 進捗コールバック fn(stage, status)（省略可）
+
+    Returns:
+        /api/generate-grid のレスポンスと同じ形式の dict
+    """
+    def stage(name, status):
+        if update_stage:
+            update_stage(name, status)
+
+    prepared_registration = character.get('registration')
+
+    # 英語登録情報はキャラクター情報だけで作れるので、画像生成と並行して開始
+    stage('registration', STATUS_RUNNING)
+    if prepared_registration:
+        registration_future = None
+    else:
+        registration_future = client.submit(client.generate_registration_info, character)
+
+    # キャラクター情報から英語プロンプトを生成
+    stage('prompt', STATUS_RUNNING)
+    if character.get('grid_prompt'):
+        prompt = character['grid_prompt']
+        prompt_model_info = {'model_version': 'prepared', 'requested_model': client.text_model}
+    else:
         prompt, prompt_model_info = client.create_grid_prompt(character)
         print(f"[プロンプト生成] 使用モデル: {prompt_model_info.get('model_version', 'unknown')}")
+    stage('prompt', STATUS_DONE)
 
-        # 画像生成
-        image, image_model_info = client.generate_image(prompt)
-        print(f"[画像生成] 使用モデル: {image_model_info.get('model_version', 'unknown')}")
+    # 画像生成
+    stage('image', STATUS_RUNNING)
+    image, image_model_info = client.generate_image(prompt)
+    print(f"[画像生成] 使用モデル: {image_model_info.get('model_version', 'unknown')}")
 
-        # 保存
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"grid_{timestamp}.png"
-        save_path = OUTPUT_DIR / filename
-        image.save(save_path, 'PNG')
+    # 保存
+    filename = save_grid(image)
+    stage('image', STATUS_DONE)
 
-        # 英語登録情報を生成
+    # 英語登録情報の完了を待つ
+    if registration_future is None:
+        en_info = prepared_registration
+    else:
         try:
-            en_info = client.generate_registration_info(character)
+            en_info = registration_future.result()
             print(f"[英語登録情報] 生成完了")
         except Exception as e:
             print(f"[英語登録情報] 生成失敗: {e}")
             en_info = {'title_en': '', 'description_en': ''}
+    stage('registration', STATUS_DONE)
+
+    return grid_response(character, filename, en_info, prompt_model_info, image_model_info)
+
+
+def check_character(character):
+    """
+    /api/generate-grid に渡されたキャラクターを検証
+
+    grid_prompt / registration（/api/prepare-characters の結果）は
+    そのまま画像生成・登録情報に使うので、型が違えばここで弾く。
+
+    Returns:
+        問題があればエラーメッセージ、なければ None
+    """
+    if not character:
+        return 'キャラクターが指定されていません'
+    if not isinstance(character, dict):
+        return 'キャラクターの形式が正しくありません'
+    if character.get('grid_prompt') is not None and not isinstance(character['grid_prompt'], str):
+        return 'grid_prompt は文字列で指定してください'
+    if character.get('registration') is not None and not isinstance(character['registration'], dict):
+        return 'registration はオブジェクトで指定してください'
+    return None
+
+
+def save_grid(image):
+    """
+    グリッド画像を出力フォルダに保存し、ファイル名を返す
 
-        # 登録情報を生成
-        registration = {
-            'title_ja': character.get('name', ''),
-            'title_en': en_info.get('title_en', ''),
-            'description_ja': character.get('concept', ''),
-            'description_en': en_info.get('description_en', ''),
-            'copyright': '© 2025 Your Name'
+    別ワーカーが書きかけを読まないよう、一時ファイルに保存してから置き換える。
+    """
+    filename = f"{new_output_id('grid')}.png"
+    tmp_path = OUTPUT_DIR / f".{filename}.tmp"
+    image.save(tmp_path, 'PNG')
+    os.replace(tmp_path, OUTPUT_DIR / filename)
+    remember_grid(filename, image)
+    return filename
+
+
+def grid_response(character, filename, en_info, prompt_model_info, image_model_info):
+    """/api/generate-grid のレスポンスを作成"""
+    # 登録情報を生成
+    registration = {
+        'title_ja': character.get('name', ''),
+        'title_en': en_info.get('title_en', ''),
+        'description_ja': character.get('concept', ''),
+        'description_en': en_info.get('description_en', ''),
+        'copyright': '© 2025 Your Name'
+    }
+
+    return {
+        'success': True,
+        'image_path': str(OUTPUT_DIR / filename),
+        'image_url': f'/output/{filename}',
+        'registration': registration,
+        'model_info': {
+            'prompt_model': prompt_model_info.get('model_version', 'unknown'),
+            'image_model': image_model_info.get('model_version', 'unknown')
         }
+    }
+
+
+@app.route('/api/generate-grid', methods=['POST'])
+@require_api_key
+def api_generate_grid(api_key):
+    """キャラクターから6x3グリッド画像を生成"""
+    data = request.get_json() or {}
+    character = data.get('character')
+
+    error = check_character(character)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+
+    try:
+        client = get_client(api_key)
+        return jsonify(run_grid_pipeline(client, character))
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/generate-grid/jobs', methods=['POST'])
+@require_api_key
+def api_submit_grid_job(api_key):
+    """グリッド画像生成をジョブとして登録し、ジョブIDをすぐに返す"""
+    data = request.get_json() or {}
+    character = data.get('character')
+
+    error = check_character(character)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+
+    try:
+        client = get_client(api_key)
+        job_id = job_manager.submit(
+            lambda update_stage: run_grid_pipeline(client, character, update_stage),
+            GRID_JOB_STAGES
+        )
+    except JobQueueFullError as e:
+        return jsonify({'success': False, 'error': str(e)}), 429
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': f'/api/jobs/{job_id}'
+    }), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job_status(job_id):
+    """ジョブの進捗（ステージ単位）と結果を取得"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'ジョブが見つかりません'}), 404
+
+    return jsonify({
+        'success': True,
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'stages': job['stages'],
+        'result': job['result'],
+        'error': job['error']
+    })
+
+
+@app.route('/api/grid-to-stamps', methods=['POST'])
+def api_grid_to_stamps():
+    """
+    生成済みのグリッド画像をサーバー側で分割してLINE仕様に変換
+    /api/resize-stamps と同じ形式（folder / download_url）で返す
+    """
+    data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'グリッド画像が指定されていません'}), 400
+
+    # image_url（/output/grid_xxx.png）またはファイル名を受け付ける
+    filename = Path(data.get('image') or data.get('image_url') or '').name
+    if not (filename.startswith('grid_') and filename.endswith('.png')):
+        return jsonify({'success': False, 'error': 'グリッド画像が指定されていません'}), 400
+
+    try:
+        rows = int(data.get('rows', 3))
+        cols = int(data.get('cols', 6))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': '行数・列数が不正です'}), 400
+    if not (1 <= rows <= MAX_GRID_DIVISIONS and 1 <= cols <= MAX_GRID_DIVISIONS):
+        return jsonify({'success': False, 'error': f'行数・列数は 1〜{MAX_GRID_DIVISIONS} で指定してください'}), 400
+
+    profile = data.get('profile') or DEFAULT_ENCODER_PROFILE
+    if profile not in ENCODER_PROFILES:
+        return jsonify({'success': False, 'error': f'不明なエンコード設定です: {profile}'}), 400
+
+    grid_image = load_grid(filename)
+    if grid_image is None:
+        return jsonify({'success': False, 'error': 'グリッド画像が見つかりません'}), 404
+
+    try:
+        # 出力ディレクトリを新規作成
+        folder, output_dir = create_output_folder()
+
+        processor = StampProcessor(str(output_dir), profile)
+        batch = processor.process_grid_image(
+            grid_image, rows, cols,
+            remove_bg=bool(data.get('remove_bg', False)),
+            key_white=bool(data.get('key_white', True))
+        )
 
         return jsonify({
             'success': True,
-            'image_path': str(save_path),
-            'image_url': f'/output/{filename}',
-            'registration': registration,
-            'model_info': {
-                'prompt_model': prompt_model_info.get('model_version', 'unknown'),
-                'image_model': image_model_info.get('model_version', 'unknown')
-            }
+            'folder': folder,
+            'output_dir': str(output_dir),
+            'processed_count': batch['success_count'] - batch['skipped_count'],
+            'skipped_count': batch['skipped_count'],
+            'total_count': batch['total'],
+            'results': batch['results'],
+            'size_report': batch['size_report'],
+            'download_url': f'/api/download/{folder}'
         })
 
     except Exception as e:
@@ -261,20 +694,30 @@ def api_download(folder):
     if not folder_path.exists() or not folder_path.is_dir():
         return jsonify({'success': False, 'error': 'フォルダが見つかりません'}), 404
 
-    # ZIPを作成
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for f in folder_path.glob('*.png'):
-            zf.write(f, f.name)
-
-    buffer.seek(0)
-
-    return send_file(
-        buffer,
-        mimetype='application/zip',
-        as_attachment=True,
-        download_name=f'{folder}.zip'
+    entries = list_zip_entries(folder_path)
+    cache_key = get_zip_cache_key(entries)
+    cache_path = ZIP_CACHE_DIR / f"{folder}_{cache_key}.zip"
+
+    # キャッシュ済みならファイルとして配信（Range / ETag 対応）
+    if cache_path.exists():
+        return send_file(
+            cache_path,
+            mimetype='application/zip',
+            as_attachment=True,
+            download_name=f'{folder}.zip',
+            etag=cache_key,
+            conditional=True
+        )
+
+    # 未キャッシュならストリーミングで送信しつつキャッシュを作成
+    ZIP_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    response = Response(
+        stream_with_context(stream_zip(folder, entries, cache_path)),
+        mimetype='application/zip'
     )
+    response.headers['Content-Disposition'] = f'attachment; filename="{folder}.zip"'
+    response.set_etag(cache_key)
+    return response
 
 
 @app.route('/api/resize-stamps', methods=['POST'])
@@ -290,52 +733,99 @@ def api_resize_stamps():
     if not files or len(files) == 0:
         return jsonify({'success': False, 'error': 'ファイルがありません'}), 400
 
-    try:
-        # 出力ディレクトリを新規作成
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        output_dir = OUTPUT_DIR / f"stamps_{timestamp}"
-        output_dir.mkdir(parents=True, exist_ok=True)
-
-        processor = StampProcessor(str(output_dir))
-        results = []
-
-        for i, file in enumerate(files, start=1):
-            if file.filename and validate_extension(file.filename):
-                try:
-                    # ファイルを読み込んでPIL Imageに変換
-                    image_bytes = file.read()
-                    result = processor.process_single_image(image_bytes, i, remove_bg=False)
-                    results.append(result)
-                except Exception as e:
-                    results.append({
-                        'success': False,
-                        'filename': file.filename,
-                        'error': str(e)
-                    })
-
-        # 成功した数をカウント
-        success_count = sum(1 for r in results if r.get('success'))
-
-        # main.png と tab.png も生成（最初の画像から）
-        if success_count > 0:
-            first_stamp = output_dir / "01.png"
-            if first_stamp.exists():
-                processor._generate_main_and_tab(str(first_stamp))
+    error = check_stamp_request(request.form.get('profile'), request.form.get('folder', ''))
+    if error:
+        message, status = error
+        return jsonify({'success': False, 'error': message}), status
 
-        return jsonify({
-            'success': True,
-            'folder': f"stamps_{timestamp}",
-            'output_dir': str(output_dir),
-            'processed_count': success_count,
-            'total_count': len(files),
-            'results': results,
-            'download_url': f'/api/download/stamps_{timestamp}'
-        })
+    try:
+        # 並列プロセス数（省略時は逐次処理）
+        workers = request.form.get('workers', type=int)
+
+        # 拡張子を検証し、アップロードされたファイルのストリームをそのまま渡す
+        # （大きいファイルは Werkzeug が一時ファイルに退避済みなので全体を読み込まない）
+        images = [
+            file.stream
+            for file in files
+            if file.filename and validate_extension(file.filename)
+        ]
+
+        return jsonify(convert_stamps(
+            images, len(files),
+            profile=request.form.get('profile'),
+            folder=request.form.get('folder', ''),
+            workers=workers
+        ))
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def check_stamp_request(profile, folder):
+    """
+    /api/resize-stamps のエンコード設定・既存フォルダを検証
+
+    Returns:
+        問題があれば (エラーメッセージ, ステータスコード)、なければ None
+    """
+    profile = profile or DEFAULT_ENCODER_PROFILE
+    if profile not in ENCODER_PROFILES:
+        return f'不明なエンコード設定です: {profile}', 400
+
+    # 既存フォルダを指定すると、変更のない画像は再変換しない（差分処理）
+    if folder and not (folder.startswith('stamps_') and Path(folder).name == folder
+                       and (OUTPUT_DIR / folder).is_dir()):
+        return 'フォルダが見つかりません', 404
+    return None
+
+
+def convert_stamps(images, total_count, profile=None, folder='', workers=None):
+    """
+    アップロードされた画像をLINE仕様に変換（check_stamp_request で検証済みの前提）
+
+    Args:
+        images: 画像（ファイルパス・ファイルオブジェクト）のリスト
+        total_count: アップロードされたファイル数（拡張子で除外した分も含む）
+        profile: PNG エンコード設定（省略時は既定値）
+        folder: 差分処理する既存フォルダ（空なら新規作成）
+        workers: 並列プロセス数（省略時は逐次処理）
+
+    Returns:
+        /api/resize-stamps のレスポンスと同じ形式の dict
+    """
+    if folder:
+        output_dir = OUTPUT_DIR / folder
+    else:
+        # 出力ディレクトリを新規作成
+        folder, output_dir = create_output_folder()
+
+    processor = StampProcessor(str(output_dir), profile or DEFAULT_ENCODER_PROFILE)
+    if workers:
+        workers = min(workers, os.cpu_count() or 1)
+
+    # LINE仕様に変換（main.png と tab.png も最初の画像から生成）
+    batch = processor.process_batch(images, remove_bg=False, workers=workers, incremental=True)
+
+    return {
+        'success': True,
+        'folder': folder,
+        'output_dir': str(output_dir),
+        # 実際に変換した枚数（変更がなく再変換を省略した分は skipped_count）
+        'processed_count': batch['success_count'] - batch['skipped_count'],
+        'skipped_count': batch['skipped_count'],
+        'total_count': total_count,
+        'results': batch['results'],
+        'size_report': batch['size_report'],
+        'download_url': f'/api/download/{folder}'
+    }
+
+
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    """Gemini 呼び出し・スタンプ変換・リクエスト処理のメトリクス（Prometheus 形式）"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
 # ========================================
 # エラーハンドリング
 # ========================================
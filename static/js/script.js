@@ -14,6 +14,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const state = {
         apiKey: null,
         characters: [],
+        preparing: null,
         selectedCharacter: null,
         generatedImage: null
     };
@@ -249,6 +250,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 renderCharacterOptions(result.characters);
                 showToast('キャラクター案を生成しました', 'success');
 
+                // 全キャラのプロンプトと登録情報を提案ごとに1回だけまとめて作っておく（待たない）
+                state.preparing = prepareCharacters(result.characters);
+
                 // Log model info to console
                 if (result.model_info) {
                     console.log(`[キャラ提案] 使用モデル: ${result.model_info.model_version || result.model_info.requested_model}`);
@@ -265,6 +269,29 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    async function prepareCharacters(characters) {
+        try {
+            const resp = await fetch(`${API_BASE}/prepare-characters`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ characters })
+            });
+            const result = await resp.json();
+            if (!result.success) return;
+
+            // 同じオブジェクトに書き込むので、選択済みのキャラにも反映される
+            result.prepared.forEach((item, index) => {
+                const char = characters[index];
+                if (!char) return;
+                if (typeof item.grid_prompt === 'string') char.grid_prompt = item.grid_prompt;
+                if (item.registration && typeof item.registration === 'object') char.registration = item.registration;
+            });
+        } catch (e) {
+            // 失敗しても、グリッド生成時に選んだキャラの分だけサーバー側で作られる
+            console.warn('Prepare error:', e);
+        }
+    }
+
     function renderCharacterOptions(characters) {
         ui.characterOptions.innerHTML = characters.map((char, index) => `
             <div class="character-option" onclick="selectCharacter(${index})">
@@ -314,14 +341,21 @@ document.addEventListener('DOMContentLoaded', () => {
         ui.generatedResult.classList.add('hidden');
 
         try {
-            const resp = await fetch(`${API_BASE}/generate-grid`, {
+            // 一括準備が終わっていなければ待つ（待たずに送るとサーバーが同じ内容を個別に作り直す）
+            if (state.preparing) await state.preparing;
+
+            // ジョブを登録してステージごとの進捗をポーリング
+            const resp = await fetch(`${API_BASE}/generate-grid/jobs`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
                     character: state.selectedCharacter
                 })
             });
-            const result = await resp.json();
+            const submitted = await resp.json();
+            const result = submitted.success
+                ? await pollGridJob(submitted.status_url)
+                : submitted;
 
             if (result.success) {
                 state.generatedImage = result.image_path;
@@ -357,6 +391,37 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    const GRID_STAGE_LABELS = {
+        prompt: 'プロンプト作成中...',
+        image: 'Gemini 3 Pro で画像生成中...（30秒〜1分）',
+        registration: '登録情報を作成中...'
+    };
+    const JOB_POLL_INTERVAL = 2000;
+
+    async function pollGridJob(statusUrl) {
+        const loadingText = ui.generateLoading.querySelector('span');
+        if (loadingText) loadingText.textContent = GRID_STAGE_LABELS.prompt;
+
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+
+            const resp = await fetch(statusUrl);
+            const job = await resp.json();
+
+            if (!job.success) return job;
+            if (job.status === 'done') return job.result;
+            if (job.status === 'error') {
+                return { success: false, error: job.error };
+            }
+
+            // 実行中のステージを表示
+            const running = Object.keys(job.stages).find(stage => job.stages[stage] === 'running');
+            if (running && loadingText) {
+                loadingText.textContent = GRID_STAGE_LABELS[running] || '処理中...';
+            }
+        }
+    }
+
     function renderGeneratedImage(result) {
         ui.generatedResult.innerHTML = `
             <a href="${result.image_url}" target="_blank">
@@ -653,27 +718,31 @@ document.addEventListener('DOMContentLoaded', () => {
                     setTimeout(() => {
                         uploadStatus.classList.add('hidden');
                         resizeResult.classList.remove('hidden');
-                        resultText.textContent = `${data.processed_count}/${data.total_count}枚をLINE仕様（370x320px）にリサイズしました`;
+                        const skipped = data.skipped_count || 0;
+                        resultText.textContent = `${data.processed_count}/${data.total_count}枚をLINE仕様（370x320px）にリサイズしました`
+                            + (skipped ? `（変更なし ${skipped}枚は再変換を省略）` : '');
                         downloadLink.href = data.download_url;
 
                         // Show preview (first few images)
                         resultPreview.innerHTML = '';
-                        const successResults = data.results.filter(r => r.success).slice(0, 6);
-                        successResults.forEach(r => {
+                        const successResults = data.results.filter(r => r.success);
+                        successResults.slice(0, 6).forEach(r => {
                             const img = document.createElement('img');
                             img.src = `/output/${data.folder}/${r.filename}`;
                             img.alt = r.filename;
                             img.className = 'preview-thumb';
                             resultPreview.appendChild(img);
                         });
-                        if (data.processed_count > 6) {
+                        if (successResults.length > 6) {
                             const more = document.createElement('span');
                             more.className = 'preview-more';
-                            more.textContent = `+${data.processed_count - 6}`;
+                            more.textContent = `+${successResults.length - 6}`;
                             resultPreview.appendChild(more);
                         }
 
-                        showToast(`${data.processed_count}枚のリサイズ完了！`, 'success');
+                        showToast(skipped
+                            ? `${data.processed_count}枚のリサイズ完了！（${skipped}枚は変更なし）`
+                            : `${data.processed_count}枚のリサイズ完了！`, 'success');
                     }, 300);
                 } else {
                     uploadStatus.classList.add('hidden');
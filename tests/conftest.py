@@ -0,0 +1,49 @@
+"""テスト共通設定（リポジトリ直下を import パスに追加）"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core import gemini_client as gc  # noqa: E402
+
+
+class ScriptedClient(gc.GeminiClient):
+    """
+    _generate_text(_async) が outcomes を順に返す（例外なら送出する）クライアント
+
+    requests に (prompt, use_cache) を、single_calls に個別生成
+    （create_grid_prompt / generate_registration_info）の呼び出しを記録する。
+    """
+
+    def __init__(self, *outcomes):
+        self.text_model = gc.ALLOWED_TEXT_MODEL
+        self.outcomes = list(outcomes)
+        self.requests = []
+        self.single_calls = []
+
+    def _generate_text(self, prompt, use_cache=True, schema=None):
+        self.requests.append((prompt, use_cache))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome, {"model_version": "test", "requested_model": self.text_model, "prompt_tokens": 10}
+
+    async def _generate_text_async(self, prompt, use_cache=True, schema=None):
+        return self._generate_text(prompt, use_cache, schema)
+
+    def create_grid_prompt(self, character, use_cache=True):
+        self.single_calls.append(("grid_prompt", character["name"]))
+        return "single prompt", {}
+
+    def generate_registration_info(self, character, use_cache=True):
+        self.single_calls.append(("registration", character["name"]))
+        return {}
+
+
+@pytest.fixture
+def scripted_client():
+    """台本どおりに応答するクライアントを作る関数: scripted_client(応答1, 応答2, ...)"""
+    return ScriptedClient
@@ -0,0 +1,51 @@
+"""asgi.py の /api/download のテスト（quart がなければスキップ）"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("quart")
+pytest.importorskip("hypercorn")
+
+import asgi
+import server
+
+
+@pytest.fixture
+def cached_folder(tmp_path, monkeypatch):
+    output_dir = tmp_path / "output"
+    cache_dir = tmp_path / "zip_cache"
+    (output_dir / "stamps_test").mkdir(parents=True)
+    cache_dir.mkdir()
+    (output_dir / "stamps_test" / "01.png").write_bytes(b"png")
+
+    monkeypatch.setattr(asgi, "OUTPUT_DIR", output_dir)
+    monkeypatch.setattr(asgi, "ZIP_CACHE_DIR", cache_dir)
+    monkeypatch.setattr(asgi, "is_loopback", lambda addr: True)
+    monkeypatch.setenv("REQUEST_LOG", "0")
+
+    cache_key = server.get_zip_cache_key(server.list_zip_entries(output_dir / "stamps_test"))
+    (cache_dir / f"stamps_test_{cache_key}.zip").write_bytes(b"zip body")
+    return cache_key
+
+
+def download(headers=None):
+    async def fetch():
+        response = await asgi.app.test_client().get("/api/download/stamps_test", headers=headers or {})
+        return response.status_code, response.headers.get("ETag"), await response.get_data()
+    return asyncio.run(fetch())
+
+
+def test_cached_zip_is_sent_with_its_etag(cached_folder):
+    status, etag, body = download()
+
+    assert status == 200
+    assert etag == f'"{cached_folder}"'
+    assert body == b"zip body"
+
+
+def test_matching_if_none_match_returns_304(cached_folder):
+    status, _, body = download({"If-None-Match": f'"{cached_folder}"'})
+
+    assert status == 304
+    assert body == b""
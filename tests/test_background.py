@@ -0,0 +1,109 @@
+"""key_white_background（外周とつながった白だけが透過になる）と BackgroundRemover のテスト"""
+
+import threading
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from core import background
+from core.background import BackgroundRemover, key_white_background
+
+
+def make_character():
+    """白背景に黒い輪（内側も白）と、外周まで届く白い通路"""
+    image = Image.new("RGB", (200, 200), "white")
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((40, 40, 160, 160), outline="black", width=8)
+    draw.rectangle((10, 170, 190, 190), fill=(200, 60, 60))
+    return image
+
+
+def alpha_at(image, *points):
+    alpha = np.asarray(image)[..., 3]
+    return [int(alpha[y, x]) for x, y in points]
+
+
+def test_border_connected_white_becomes_transparent():
+    keyed = key_white_background(make_character())
+
+    assert keyed.mode == "RGBA"
+    assert alpha_at(keyed, (0, 0), (199, 0), (20, 100), (100, 195)) == [0, 0, 0, 0]
+
+
+def test_enclosed_white_stays_opaque():
+    keyed = key_white_background(make_character())
+
+    # 輪の内側の白（目・吹き出しなど）と輪・帯は不透明のまま
+    assert alpha_at(keyed, (100, 100), (70, 100), (44, 100), (100, 180)) == [255, 255, 255, 255]
+
+
+def test_white_reaching_the_border_through_a_gap_is_keyed():
+    image = make_character()
+    draw = ImageDraw.Draw(image)
+    # 輪に切れ目を入れると内側も外周とつながる
+    draw.rectangle((95, 30, 105, 50), fill="white")
+
+    keyed = key_white_background(image)
+
+    assert alpha_at(keyed, (100, 100)) == [0]
+
+
+def test_antialiased_edge_is_unmixed_from_white():
+    image = Image.new("RGB", (50, 50), "white")
+    # 赤と白が半々に混ざった縁
+    image.putpixel((25, 25), (255, 227, 227))
+    image.putpixel((26, 25), (255, 0, 0))
+
+    keyed = np.asarray(key_white_background(image))
+
+    r, g, b, a = keyed[25, 25]
+    assert 0 < a < 255
+    assert r == 255 and g < 227
+
+
+def test_existing_transparency_is_kept():
+    image = Image.new("RGBA", (40, 40), (255, 255, 255, 255))
+    image.putpixel((20, 20), (0, 0, 255, 128))
+
+    keyed = np.asarray(key_white_background(image))
+
+    assert keyed[20, 20, 3] == 128
+    assert keyed[0, 0, 3] == 0
+
+
+def test_tiny_images_are_returned_unchanged():
+    keyed = key_white_background(Image.new("RGB", (1, 5), "white"))
+
+    assert keyed.size == (1, 5)
+    assert alpha_at(keyed, (0, 0)) == [255]
+
+
+def test_long_winding_background_is_keyed_to_the_end():
+    # 外周から入る幅1の通路が100回折り返す（伝播の回数に上限があると奥まで届かない）
+    white = np.zeros((201, 60), dtype=bool)
+    for y in range(1, 200, 2):
+        white[y, 1:-1] = True
+        if y + 2 < 200:
+            white[y + 1, 1 if y % 4 == 3 else 58] = True
+    white[1, 0] = True
+    image = Image.fromarray(np.where(white[..., None], 255, 0).astype(np.uint8).repeat(3, axis=2), "RGB")
+
+    keyed = np.asarray(key_white_background(image))
+
+    assert (keyed[..., 3][white] == 0).all()
+    assert (keyed[..., 3][~white] == 255).all()
+
+
+def test_white_key_fallback_runs_in_the_calling_thread(monkeypatch):
+    threads = []
+
+    def keyed(image):
+        threads.append(threading.current_thread())
+        return key_white_background(image)
+
+    monkeypatch.setattr(background, "REMBG_AVAILABLE", False)
+    monkeypatch.setattr(background, "key_white_background", keyed)
+    images = BackgroundRemover().remove_batch([make_character(), make_character()])
+
+    assert [image.mode for image in images] == ["RGBA", "RGBA"]
+    assert threads == [threading.current_thread()] * 2
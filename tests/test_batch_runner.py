@@ -0,0 +1,60 @@
+"""BatchRunner / write_set_zip のテスト"""
+
+import zipfile
+
+from PIL import Image, ImageDraw
+
+from core.batch_runner import BatchRunner, write_set_zip
+
+
+def make_grid(path, rows=3, cols=6, cell=120):
+    grid = Image.new("RGB", (cols * cell, rows * cell), "white")
+    draw = ImageDraw.Draw(grid)
+    for r in range(rows):
+        for c in range(cols):
+            draw.ellipse((c * cell + 20, r * cell + 20, c * cell + cell - 20, r * cell + cell - 20), fill=(200, 30 * c, 60 * r))
+    grid.save(path)
+
+
+def test_zip_is_named_after_the_whole_folder_name(tmp_path):
+    output_dir = tmp_path / "v1.2"
+    output_dir.mkdir()
+    (output_dir / "01.png").write_bytes(b"png")
+
+    zip_path = write_set_zip(output_dir, [{"success": True, "path": str(output_dir / "01.png")}])
+
+    assert zip_path == tmp_path / "v1.2.zip"
+
+
+def test_zip_contains_only_this_runs_results(tmp_path):
+    output_dir = tmp_path / "set"
+    output_dir.mkdir()
+    for name in ("01.png", "02.png", "main.png", "tab.png", "99.png"):
+        (output_dir / name).write_bytes(name.encode())
+    results = [
+        {"success": True, "path": str(output_dir / "01.png"),
+         "main_path": str(output_dir / "main.png"), "tab_path": str(output_dir / "tab.png")},
+        {"success": False, "error": "x", "index": 2},
+    ]
+
+    with zipfile.ZipFile(write_set_zip(output_dir, results)) as zf:
+        assert sorted(zf.namelist()) == ["01.png", "main.png", "tab.png"]
+
+
+def test_run_processes_grids_and_reports_bad_entries(tmp_path):
+    make_grid(tmp_path / "grid.png")
+    (tmp_path / "a").mkdir()
+    make_grid(tmp_path / "a" / "grid.png")
+
+    runner = BatchRunner(output_root=str(tmp_path / "out"), workers=1)
+    summary = runner.run([
+        (str(tmp_path / "grid.png"), None),
+        (str(tmp_path / "a" / "grid.png"), "3x6"),
+        (str(tmp_path / "missing.txt"), None),
+    ])
+
+    assert [s["name"] for s in summary["sets"]] == ["grid", "grid_2", "missing"]
+    assert [s["success_count"] for s in summary["sets"]] == [18, 18, 0]
+    assert summary["sets"][2]["error"]
+    assert summary["total_images"] == 36
+    assert summary["sets"][1]["zip_path"] == str(tmp_path / "out" / "grid_2.zip")
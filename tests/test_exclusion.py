@@ -0,0 +1,50 @@
+"""キャラクター名の除外リスト（select_exclusions / find_duplicates）のテスト"""
+
+from core.exclusion import find_duplicates, name_ngrams, normalize_name, select_exclusions
+
+
+def test_normalize_ignores_width_case_and_symbols():
+    assert normalize_name("ＡＢＣ ネコ！") == normalize_name("abc・ネコ")
+    assert name_ngrams("ネコ") == frozenset(["ネコ"])
+    assert name_ngrams("") == frozenset()
+
+
+def test_select_exclusions_is_bounded_and_newest_first():
+    history = [f"キャラ{i:03d}番の{chr(0x4E00 + i * 7)}{chr(0x4E80 + i * 5)}" for i in range(100)]
+
+    selected = select_exclusions(history, limit=10, threshold=1.01)
+
+    assert selected == list(reversed(history))[:10]
+
+
+def test_select_exclusions_keeps_one_representative_per_cluster():
+    history = [
+        "会議で寝落ちするカエル",
+        "宇宙飛行士のカメ",
+        "会議で寝落ちするカエルちゃん",
+        "会議で居眠りするカエル",
+    ]
+
+    selected = select_exclusions(history)
+
+    assert selected[0] == "会議で居眠りするカエル"
+    assert "宇宙飛行士のカメ" in selected
+    assert "会議で寝落ちするカエル" not in selected
+
+
+def test_find_duplicates_matches_history_not_sent_in_prompt():
+    history = ["締め切りに追われるハムスター"] + [f"別のキャラ{i}" for i in range(200)]
+
+    duplicates = find_duplicates(["締め切りに追われるハムスターちゃん", "深海の郵便屋さん"], history)
+
+    assert duplicates == {0: "締め切りに追われるハムスター"}
+
+
+def test_find_duplicates_flags_only_the_later_copy_within_a_batch():
+    duplicates = find_duplicates(["宇宙飛行士のカメ", "推し活ウサギ", "宇宙飛行士のカメ"], [])
+
+    assert duplicates == {2: "宇宙飛行士のカメ"}
+
+
+def test_find_duplicates_ignores_loosely_similar_names():
+    assert find_duplicates(["会議で寝落ちするペンギン"], ["サウナ好きなペンギン"]) == {}
@@ -0,0 +1,96 @@
+"""detect_grid_cells のテスト（合成したキャラクターシートで検出結果を確認）"""
+
+from PIL import Image, ImageDraw
+
+from core.grid_detector import detect_grid_cells
+
+ROWS, COLS = 3, 6
+TITLE_BOTTOM = 40
+
+
+def make_sheet(title=True):
+    """
+    白背景・上部タイトル・不均一な余白の 6x3 シート
+
+    Returns:
+        (画像, 各コマの図形の範囲 [(left, top, right, bottom), ...])
+    """
+    image = Image.new("RGB", (1280, 720), "white")
+    draw = ImageDraw.Draw(image)
+    if title:
+        draw.rectangle((400, 12, 880, TITLE_BOTTOM - 12), fill="black")
+
+    shapes = []
+    col_lefts = [30, 235, 440, 645, 850, 1060]
+    row_tops = [90, 300, 510]
+    for r, top in enumerate(row_tops):
+        for c, left in enumerate(col_lefts):
+            # コマごとに大きさを変える（余白が不均一になる）
+            width, height = 150 + (c % 3) * 10, 160 + r * 10
+            box = (left, top, left + width, top + height)
+            draw.ellipse(box, fill=(40 * c, 80, 50 * r))
+            shapes.append(box)
+    return image, shapes
+
+
+def contains(cell, shape):
+    left, top, right, bottom = cell
+    return left <= shape[0] and top <= shape[1] and shape[2] <= right and shape[3] <= bottom
+
+
+def test_detects_every_panel_below_the_title():
+    image, shapes = make_sheet()
+
+    cells = detect_grid_cells(image, ROWS, COLS)
+
+    assert len(cells) == ROWS * COLS
+    for cell, shape in zip(cells, shapes):
+        assert contains(cell, shape)
+        # タイトル帯はコマに含めない
+        assert cell[1] >= TITLE_BOTTOM
+
+
+def test_cells_do_not_overlap_and_stay_in_bounds():
+    image, _ = make_sheet()
+
+    cells = detect_grid_cells(image, ROWS, COLS)
+
+    for left, top, right, bottom in cells:
+        assert 0 <= left < right <= image.width
+        assert 0 <= top < bottom <= image.height
+    for i in range(len(cells) - 1):
+        if (i + 1) % COLS:
+            assert cells[i][2] <= cells[i + 1][0]
+
+
+def test_detects_without_title_and_without_expected_counts():
+    image, shapes = make_sheet(title=False)
+
+    cells = detect_grid_cells(image)
+
+    assert len(cells) == len(shapes)
+    assert all(contains(cell, shape) for cell, shape in zip(cells, shapes))
+
+
+def test_transparent_background_is_treated_as_margin():
+    image, shapes = make_sheet()
+    rgba = image.convert("RGBA")
+    pixels = rgba.load()
+    for y in range(rgba.height):
+        for x in range(rgba.width):
+            if pixels[x, y][:3] == (255, 255, 255):
+                pixels[x, y] = (0, 0, 0, 0)
+
+    cells = detect_grid_cells(rgba, ROWS, COLS)
+
+    assert all(contains(cell, shape) for cell, shape in zip(cells, shapes))
+
+
+def test_blank_image_falls_back_to_even_split():
+    image = Image.new("RGB", (600, 300), "white")
+
+    cells = detect_grid_cells(image, ROWS, COLS)
+
+    assert len(cells) == ROWS * COLS
+    assert cells[0] == (0, 0, 100, 100)
+    assert cells[-1] == (500, 200, 600, 300)
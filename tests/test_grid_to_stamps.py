@@ -0,0 +1,20 @@
+"""/api/grid-to-stamps の入力検証のテスト"""
+
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize("body", [
+    ["grid_x.png"],
+    "grid_x.png",
+    {"image": "grid_x.png", "rows": "abc"},
+    {"image": "grid_x.png", "rows": 0},
+    {"image": "other.png"},
+])
+def test_invalid_requests_return_400(body):
+    with server.app.test_client() as http:
+        resp = http.post("/api/grid-to-stamps", json=body)
+
+    assert resp.status_code == 400
+    assert resp.get_json()["success"] is False
@@ -0,0 +1,148 @@
+"""StampProcessor の差分処理（マニフェスト）のテスト"""
+
+import json
+import os
+
+import pytest
+from PIL import Image, ImageDraw
+
+from core.stamp_processor import MANIFEST_FILENAME, StampProcessor
+
+
+def write_stamp(path, color):
+    image = Image.new("RGBA", (400, 360), (0, 0, 0, 0))
+    ImageDraw.Draw(image).ellipse((20, 20, 380, 340), fill=color)
+    image.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def sources(tmp_path):
+    source_dir = tmp_path / "src"
+    source_dir.mkdir()
+    colors = [(200, 0, 0, 255), (0, 200, 0, 255), (0, 0, 200, 255)]
+    return [write_stamp(source_dir / f"{i}.png", color) for i, color in enumerate(colors, start=1)]
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    return tmp_path / "out"
+
+
+def run(output_dir, images, profile="default"):
+    return StampProcessor(str(output_dir), profile).process_batch(images, incremental=True)
+
+
+def skipped(result):
+    return [bool(r.get("skipped")) for r in result["results"]]
+
+
+def test_first_run_converts_everything_and_writes_manifest(sources, output_dir):
+    result = run(output_dir, sources)
+
+    assert result["skipped_count"] == 0
+    assert result["success_count"] == 3
+    manifest = json.loads((output_dir / MANIFEST_FILENAME).read_text(encoding="utf-8"))
+    assert sorted(manifest["entries"]) == ["01.png", "02.png", "03.png"]
+
+
+def test_unchanged_inputs_are_skipped(sources, output_dir):
+    run(output_dir, sources)
+    before = (output_dir / "02.png").stat().st_mtime_ns
+
+    result = run(output_dir, sources)
+
+    assert skipped(result) == [True, True, True]
+    assert result["results"][0]["main_path"].endswith("main.png")
+    assert (output_dir / "02.png").stat().st_mtime_ns == before
+
+
+def test_changed_input_is_reencoded(sources, output_dir):
+    run(output_dir, sources)
+    write_stamp(sources[1], (250, 200, 0, 255))
+
+    result = run(output_dir, sources)
+
+    assert skipped(result) == [True, False, True]
+    assert Image.open(output_dir / "02.png").getpixel((185, 160))[:3] == (250, 200, 0)
+
+
+def test_missing_output_is_reencoded(sources, output_dir):
+    run(output_dir, sources)
+    (output_dir / "03.png").unlink()
+
+    result = run(output_dir, sources)
+
+    assert skipped(result) == [True, True, False]
+    assert (output_dir / "03.png").exists()
+
+
+def test_missing_main_or_tab_reencodes_the_first_stamp(sources, output_dir):
+    run(output_dir, sources)
+    (output_dir / "tab.png").unlink()
+
+    result = run(output_dir, sources)
+
+    assert skipped(result) == [False, True, True]
+    assert (output_dir / "tab.png").exists()
+
+
+def test_outputs_beyond_the_new_count_are_pruned(sources, output_dir):
+    run(output_dir, sources)
+
+    result = run(output_dir, sources[:2])
+
+    assert skipped(result) == [True, True]
+    assert not (output_dir / "03.png").exists()
+    manifest = json.loads((output_dir / MANIFEST_FILENAME).read_text(encoding="utf-8"))
+    assert sorted(manifest["entries"]) == ["01.png", "02.png"]
+
+
+def test_profile_change_reencodes_everything(sources, output_dir):
+    run(output_dir, sources)
+
+    result = run(output_dir, sources, profile="palette")
+
+    assert skipped(result) == [False, False, False]
+    assert run(output_dir, sources, profile="palette")["skipped_count"] == 3
+
+
+def test_changed_mtime_rehashes_the_content(sources, output_dir):
+    run(output_dir, sources)
+    stat = os.stat(sources[0])
+    write_stamp(sources[0], (0, 0, 0, 255))
+    # 更新時刻が変わったファイルはハッシュで判定し直す
+    os.utime(sources[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    result = run(output_dir, sources)
+
+    assert skipped(result)[0] is False
+
+
+def test_reordered_files_with_same_size_and_mtime_are_rehashed(tmp_path, output_dir):
+    source_dir = tmp_path / "src"
+    source_dir.mkdir()
+    paths = []
+    for name, color in (("a.png", (200, 0, 0, 255)), ("b.png", (0, 0, 200, 255))):
+        Image.new("RGBA", (400, 360), color).save(source_dir / name)
+        os.utime(source_dir / name, ns=(1_000_000_000, 1_000_000_000))
+        paths.append(str(source_dir / name))
+    assert os.path.getsize(paths[0]) == os.path.getsize(paths[1])
+    run(output_dir, paths)
+
+    # 番号に対応するファイルが入れ替わった（サイズ・更新時刻は同じ）
+    result = run(output_dir, paths[::-1])
+
+    assert skipped(result) == [False, False]
+    assert Image.open(output_dir / "01.png").getpixel((185, 160))[:3] == (0, 0, 200)
+
+
+def test_server_reports_only_converted_images_as_processed(sources, tmp_path, monkeypatch):
+    import server
+    monkeypatch.setattr(server, "OUTPUT_DIR", tmp_path / "output")
+
+    first = server.convert_stamps(sources, len(sources))
+    again = server.convert_stamps(sources, len(sources), folder=first["folder"])
+
+    assert (first["processed_count"], first["skipped_count"]) == (3, 0)
+    assert (again["processed_count"], again["skipped_count"]) == (0, 3)
@@ -0,0 +1,50 @@
+"""StampProcessor の並列変換（共有プール）のテスト"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from core import stamp_processor as sp
+
+
+@pytest.fixture
+def shared_pool(monkeypatch):
+    """CPU 数より多いワーカーの共有プールを、同時実行数を数えるジョブで差し替える"""
+    pool = ThreadPoolExecutor(max_workers=8)
+    lock = threading.Lock()
+    counts = {"running": 0, "max": 0}
+
+    def job(output_dir, encoder_profile, image, index, remove_bg, with_main_and_tab=False):
+        with lock:
+            counts["running"] += 1
+            counts["max"] = max(counts["max"], counts["running"])
+        time.sleep(0.02)
+        with lock:
+            counts["running"] -= 1
+        return {"success": True, "index": index, "path": f"{index:02d}.png"}
+
+    monkeypatch.setattr(sp, "get_process_pool", lambda: pool)
+    monkeypatch.setattr(sp, "_process_image_job", job)
+    yield counts
+    pool.shutdown()
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_running_jobs_never_exceed_workers(shared_pool, tmp_path, workers):
+    processor = sp.StampProcessor(str(tmp_path))
+    results = list(processor._iter_results([b"img"] * 12, remove_bg=False, workers=workers))
+
+    assert [r["index"] for r in results] == list(range(1, 13))
+    assert shared_pool["max"] == workers
+
+
+def test_cached_results_do_not_count_as_running(shared_pool, tmp_path):
+    processor = sp.StampProcessor(str(tmp_path))
+    cached = {i: {"success": True, "index": i, "cached": True} for i in (2, 4, 6)}
+    results = list(processor._iter_results([b"img"] * 8, remove_bg=False, workers=2, cached=cached))
+
+    assert [r["index"] for r in results] == list(range(1, 9))
+    assert [r["index"] for r in results if r.get("cached")] == [2, 4, 6]
+    assert shared_pool["max"] == 2
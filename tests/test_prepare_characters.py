@@ -0,0 +1,72 @@
+"""prepare_characters と /api/generate-grid のキャラクター検証のテスト"""
+
+import json
+
+import pytest
+
+import server
+
+CHARACTERS = [{"name": name, "concept": "c", "target": "t"} for name in ("A", "B", "C")]
+
+
+def prepared_item(index):
+    return {
+        "index": index, "grid_prompt": f"prompt {index}",
+        "title_ja": "タイトル", "description_ja": "説明", "title_en": "Title", "description_en": "Description",
+    }
+
+
+def test_complete_response_is_used_as_is(scripted_client):
+    client = scripted_client(json.dumps([prepared_item(i) for i in (1, 2, 3)]))
+    prepared, _ = client.prepare_characters(CHARACTERS)
+
+    assert [entry["grid_prompt"] for entry in prepared] == ["prompt 1", "prompt 2", "prompt 3"]
+    assert all(entry["missing"] == [] for entry in prepared)
+
+
+def test_missing_items_are_left_for_grid_generation(scripted_client):
+    item = prepared_item(3)
+    del item["title_en"]
+    client = scripted_client(json.dumps([prepared_item(1), item]))
+    prepared, _ = client.prepare_characters(CHARACTERS)
+
+    assert [entry["missing"] for entry in prepared] == [[], ["grid_prompt", "registration"], ["registration"]]
+    assert prepared[1]["grid_prompt"] is None and prepared[2]["registration"] is None
+    assert client.single_calls == []
+
+
+def test_invalid_response_does_not_fan_out_to_single_calls(scripted_client):
+    client = scripted_client("not json", "still not json")
+    prepared, model_info = client.prepare_characters(CHARACTERS)
+
+    assert model_info["model_version"] == "fallback"
+    assert all(entry["missing"] == ["grid_prompt", "registration"] for entry in prepared)
+    assert client.single_calls == []
+
+
+@pytest.mark.parametrize("character", [
+    None,
+    ["A"],
+    {"name": "A", "grid_prompt": ["not", "a", "string"]},
+    {"name": "A", "registration": "not a dict"},
+])
+def test_invalid_characters_are_rejected(character):
+    assert server.check_character(character)
+
+
+@pytest.mark.parametrize("character", [
+    {"name": "A"},
+    {"name": "A", "grid_prompt": "prompt", "registration": {"title_en": "A"}},
+    {"name": "A", "grid_prompt": None, "registration": None},
+])
+def test_valid_characters_are_accepted(character):
+    assert server.check_character(character) is None
+
+
+def test_generate_grid_route_returns_400_for_bad_registration(monkeypatch):
+    monkeypatch.setattr(server, "get_api_key", lambda: "key")
+    with server.app.test_client() as http:
+        for path in ("/api/generate-grid", "/api/generate-grid/jobs"):
+            resp = http.post(path, json={"character": {"name": "A", "registration": "x"}})
+            assert resp.status_code == 400
+            assert resp.get_json()["success"] is False
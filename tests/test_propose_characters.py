@@ -0,0 +1,96 @@
+"""propose_characters / propose_characters_async のテスト（テキスト生成を台本どおりの応答に差し替える）"""
+
+import asyncio
+import json
+
+import pytest
+
+from core import gemini_client as gc
+
+
+def proposal(*names):
+    return json.dumps([{"name": name, "concept": "c", "target": "t"} for name in names], ensure_ascii=False)
+
+
+@pytest.fixture(autouse=True)
+def history(monkeypatch):
+    names = ["既存のネコ"]
+    monkeypatch.setattr(gc, "load_generated_characters", lambda: list(names))
+    monkeypatch.setattr(gc, "add_generated_characters", names.extend)
+    monkeypatch.setattr(gc.response_cache, "discard", lambda model, prompt: None)
+    return names
+
+
+def propose(mode, client, **kwargs):
+    if mode == "sync":
+        return client.propose_characters("猫", **kwargs)
+    return asyncio.run(client.propose_characters_async("猫", **kwargs))
+
+
+MODES = ["sync", "async"]
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_valid_response_is_returned_and_saved(mode, scripted_client, history):
+    client = scripted_client(proposal("A", "B", "C", "D", "E"))
+    characters, model_info = propose(mode, client)
+
+    assert [c["name"] for c in characters] == ["A", "B", "C", "D", "E"]
+    assert model_info["exclusion"] == {"history": 1, "sent": 1, "duplicates": 0, "replaced": 0}
+    assert history[1:] == ["A", "B", "C", "D", "E"]
+    assert len(client.requests) == 1
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_invalid_json_is_reasked_without_cache(mode, scripted_client):
+    client = scripted_client("not json", proposal("A", "B", "C", "D", "E"))
+    characters, _ = propose(mode, client)
+
+    assert [c["name"] for c in characters] == ["A", "B", "C", "D", "E"]
+    assert client.requests[1][0].endswith(gc.REASK_NOTE)
+    assert client.requests[1][1] is False
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_falls_back_when_reask_is_also_invalid(mode, scripted_client):
+    client = scripted_client("not json", "still not json")
+    characters, model_info = propose(mode, client)
+
+    assert model_info["model_version"] == "fallback"
+    assert len(characters) == 5
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_duplicates_are_replaced(mode, scripted_client):
+    client = scripted_client(proposal("既存のネコ", "B", "C", "D", "E"), proposal("F"))
+    characters, model_info = propose(mode, client)
+
+    assert [c["name"] for c in characters] == ["F", "B", "C", "D", "E"]
+    assert model_info["exclusion"]["replaced"] == 1
+    assert model_info["prompt_tokens"] == 20
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_failed_reask_keeps_original_proposal(mode, scripted_client):
+    error = gc.GeminiDeadlineError("期限切れ", gc.ALLOWED_TEXT_MODEL, 1)
+    client = scripted_client(proposal("既存のネコ", "B", "C", "D", "E"), error)
+    characters, model_info = propose(mode, client)
+
+    assert [c["name"] for c in characters] == ["既存のネコ", "B", "C", "D", "E"]
+    assert model_info["exclusion"]["replaced"] == 0
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_api_error_on_first_request_propagates(mode, scripted_client):
+    client = scripted_client(gc.GeminiAPIError("失敗", gc.ALLOWED_TEXT_MODEL, 1))
+    with pytest.raises(gc.GeminiAPIError):
+        propose(mode, client)
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_proposals_skip_the_response_cache_by_default(mode, scripted_client):
+    client = scripted_client(proposal("A", "B", "C", "D", "E"), proposal("F", "G", "H", "I", "J"))
+    propose(mode, client)
+    propose(mode, client, use_cache=True)
+
+    assert [use_cache for _, use_cache in client.requests] == [False, True]
@@ -0,0 +1,262 @@
+"""RequestScheduler / TokenBucket のテスト（時計と sleep を差し替えて実時間を待たない）"""
+
+import threading
+import time
+
+import httpx
+import pytest
+from google.genai import errors
+
+from core import gemini_client as gc
+
+MODEL = "text"
+SLOW_MODEL = "image"
+
+
+class FakeClock:
+    """sleep で時刻だけ進める時計"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self.on_sleep = None
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        if self.on_sleep:
+            self.on_sleep()
+
+
+def api_error(code, retry_after=None):
+    response = None
+    if retry_after is not None:
+        response = httpx.Response(code, headers={"retry-after": str(retry_after)})
+    return errors.APIError(code, {"error": {"code": code}}, response=response)
+
+
+def scripted(*outcomes):
+    """呼ばれるたびに outcomes を順に返す（例外なら送出する）fn"""
+    calls = []
+
+    def fn(remaining):
+        calls.append(remaining)
+        outcome = outcomes[min(len(calls), len(outcomes)) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    fn.calls = calls
+    return fn
+
+
+@pytest.fixture(autouse=True)
+def no_jitter(monkeypatch):
+    # ジッターなし（常にバックオフの上限を待つ）
+    monkeypatch.setattr(gc.random, "uniform", lambda low, high: high)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_scheduler(clock, **kwargs):
+    options = {
+        "rate_limits": {MODEL: (1.0, 2), SLOW_MODEL: (0.1, 1)},
+        "max_concurrent": 2,
+        "backoff_base": 1.0,
+        "backoff_max": 8.0,
+        "clock": clock,
+        "sleep": clock.sleep,
+    }
+    options.update(kwargs)
+    return gc.RequestScheduler(**options)
+
+
+# ========================================
+# TokenBucket
+# ========================================
+
+def test_token_bucket_allows_burst_then_waits_for_refill(clock):
+    bucket = gc.TokenBucket(rate=0.5, capacity=2, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire(deadline=100)
+    assert bucket.acquire(deadline=100)
+    assert clock.now == 0
+
+    assert bucket.acquire(deadline=100)
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_token_bucket_gives_up_when_refill_is_past_deadline(clock):
+    bucket = gc.TokenBucket(rate=0.1, capacity=1, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire(deadline=5)
+    assert not bucket.acquire(deadline=5)
+    assert clock.sleeps == []
+
+
+# ========================================
+# リトライ・バックオフ
+# ========================================
+
+@pytest.mark.parametrize("code", [429, 503])
+def test_retries_transient_errors_with_exponential_backoff(clock, code):
+    scheduler = make_scheduler(clock, rate_limits={})
+    fn = scripted(api_error(code), api_error(code), "ok")
+
+    assert scheduler.call(MODEL, fn, timeout=60) == "ok"
+
+    assert len(fn.calls) == 3
+    assert clock.sleeps == [1.0, 2.0]
+    stats = scheduler.stats()[MODEL]
+    assert (stats["attempts"], stats["retries"], stats["successes"], stats["errors"]) == (3, 2, 1, 0)
+
+
+def test_retry_waits_at_least_retry_after(clock):
+    scheduler = make_scheduler(clock, rate_limits={})
+    fn = scripted(api_error(429, retry_after=5), "ok")
+
+    assert scheduler.call(MODEL, fn, timeout=60) == "ok"
+    assert clock.sleeps == [5.0]
+
+
+def test_transport_errors_are_retried(clock):
+    scheduler = make_scheduler(clock, rate_limits={})
+    fn = scripted(httpx.ConnectError("reset"), "ok")
+
+    assert scheduler.call(MODEL, fn, timeout=60) == "ok"
+    assert len(fn.calls) == 2
+
+
+def test_non_retryable_error_fails_immediately(clock):
+    scheduler = make_scheduler(clock, rate_limits={})
+    fn = scripted(api_error(400), "ok")
+
+    with pytest.raises(gc.GeminiAPIError) as info:
+        scheduler.call(MODEL, fn, timeout=60)
+
+    assert len(fn.calls) == 1
+    assert info.value.status_code == 400
+    assert not info.value.retryable
+    assert clock.sleeps == []
+
+
+def test_gives_up_after_max_attempts(clock):
+    scheduler = make_scheduler(clock, rate_limits={}, max_attempts=3)
+    fn = scripted(api_error(503))
+
+    with pytest.raises(gc.GeminiAPIError) as info:
+        scheduler.call(MODEL, fn, timeout=600)
+
+    assert not isinstance(info.value, gc.GeminiDeadlineError)
+    assert info.value.attempts == 3
+    assert info.value.retryable
+    assert scheduler.stats()[MODEL]["errors"] == 1
+
+
+# ========================================
+# 期限
+# ========================================
+
+def test_backoff_past_deadline_raises_deadline_error(clock):
+    scheduler = make_scheduler(clock, rate_limits={})
+    fn = scripted(api_error(503))
+
+    # 1回目の失敗後に1秒、2回目の失敗後に2秒待つと 2.5 秒の期限を過ぎる
+    with pytest.raises(gc.GeminiDeadlineError) as info:
+        scheduler.call(MODEL, fn, timeout=2.5)
+
+    assert info.value.attempts == 2
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_rate_limit_wait_past_deadline_raises_deadline_error(clock):
+    scheduler = make_scheduler(clock)
+    assert scheduler.call(SLOW_MODEL, scripted("ok"), timeout=5) == "ok"
+
+    # 次のトークンは 10 秒後
+    with pytest.raises(gc.GeminiDeadlineError):
+        scheduler.call(SLOW_MODEL, scripted("ok"), timeout=5)
+
+
+def test_fn_receives_remaining_time_as_http_timeout(clock):
+    scheduler = make_scheduler(clock, rate_limits={})
+    fn = scripted(api_error(503), "ok")
+
+    scheduler.call(MODEL, fn, timeout=30)
+    assert fn.calls == [30.0, 29.0]
+
+
+# ========================================
+# 同時実行数
+# ========================================
+
+def test_concurrency_is_capped():
+    scheduler = gc.RequestScheduler(rate_limits={}, max_concurrent=2)
+    lock = threading.Lock()
+    active = {"now": 0, "peak": 0}
+    release = threading.Event()
+
+    def fn(remaining):
+        with lock:
+            active["now"] += 1
+            active["peak"] = max(active["peak"], active["now"])
+        release.wait(5)
+        with lock:
+            active["now"] -= 1
+        return "ok"
+
+    threads = [threading.Thread(target=scheduler.call, args=(MODEL, fn, 10)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    assert active["peak"] == 2
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert active["peak"] == 2
+    assert scheduler.stats()[MODEL]["successes"] == 5
+
+
+def test_slot_is_free_while_waiting_for_rate_limit_or_backoff(clock):
+    # 同時実行枠が1つでも、レート制限・バックオフで待っている間に別の呼び出しが通る
+    scheduler = make_scheduler(clock, max_concurrent=1)
+    nested = []
+
+    def call_other_model():
+        if not nested:
+            nested.append(None)
+            nested[0] = scheduler.call(MODEL, scripted("text"), timeout=0.5)
+
+    clock.on_sleep = call_other_model
+    assert scheduler.call(SLOW_MODEL, scripted("image"), timeout=60) == "image"
+    # 2回目はトークン待ち（sleep）の間に MODEL の呼び出しを挟む
+    assert scheduler.call(SLOW_MODEL, scripted(api_error(503), "image"), timeout=60) == "image"
+    assert nested == ["text"]
+
+
+def test_call_async_shares_retry_policy(clock, monkeypatch):
+    import asyncio
+
+    async def no_wait(seconds):
+        clock.sleep(seconds)
+
+    monkeypatch.setattr(gc.asyncio, "sleep", no_wait)
+    scheduler = make_scheduler(clock, rate_limits={})
+    outcomes = iter([api_error(429), "ok"])
+
+    async def fn(remaining):
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert asyncio.run(scheduler.call_async(MODEL, fn, timeout=60)) == "ok"
+    assert clock.sleeps == [1.0]
+    assert scheduler.stats()[MODEL]["retries"] == 1
@@ -0,0 +1,50 @@
+"""scan_stamp_images / unique_set_name のテスト"""
+
+from pathlib import Path
+
+from core.stamp_processor import scan_stamp_images, unique_set_name
+
+
+def touch(directory, *names):
+    for name in names:
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"png")
+
+
+def names_of(paths, root):
+    return [Path(path).relative_to(root).as_posix() for path in paths]
+
+
+def test_main_and_tab_are_excluded_regardless_of_case(tmp_path):
+    touch(tmp_path, "01.png", "02.png", "Main.PNG", "TAB.png", "main.png.png", ".hidden.png", "note.txt")
+
+    assert names_of(scan_stamp_images(tmp_path), tmp_path) == ["01.png", "02.png", "main.png.png"]
+
+
+def test_numbered_files_are_ordered_by_their_leading_number(tmp_path):
+    touch(tmp_path, "10.png", "2.png", "3_smile.png", "01.png")
+
+    assert names_of(scan_stamp_images(tmp_path), tmp_path) == ["01.png", "2.png", "3_smile.png", "10.png"]
+
+
+def test_other_files_follow_numbered_ones_in_natural_order(tmp_path):
+    touch(tmp_path, "smile10.png", "Angry.png", "2.png", "smile2.png")
+
+    assert names_of(scan_stamp_images(tmp_path), tmp_path) == ["2.png", "Angry.png", "smile2.png", "smile10.png"]
+
+
+def test_recursive_scan_orders_subdirectories_by_relative_path(tmp_path):
+    touch(tmp_path, "1.png", "b/1.png", "a/10.png", "a/2.png", "a/main.png")
+
+    assert names_of(scan_stamp_images(tmp_path), tmp_path) == ["1.png"]
+    assert names_of(scan_stamp_images(tmp_path, recursive=True), tmp_path) == [
+        "1.png", "a/2.png", "a/10.png", "a/main.png", "b/1.png"
+    ]
+
+
+def test_same_stem_inputs_get_numbered_set_names():
+    used_names = set()
+    names = [unique_set_name(path, used_names) for path in ("a/grid.png", "b/grid.png", "grid", "c/grid.jpg", "other.png")]
+
+    assert names == ["grid", "grid_2", "grid_3", "grid_4", "other"]
@@ -0,0 +1,54 @@
+"""
+LINEスタンプ丸投げちゃん - 本番用 WSGI エントリポイント
+
+python server.py は開発用サーバー（1プロセス）で起動します。
+複数の生成・変換を同時に処理したい場合はこのファイルから起動してください。
+
+    # Windows / macOS / Linux（マルチスレッド）
+    pip install waitress
+    python wsgi.py
+
+    # gunicorn を使う場合も1プロセス（-w 1）のマルチスレッドで起動する
+    pip install gunicorn
+    gunicorn -w 1 --threads 8 -b 127.0.0.1:5000 wsgi:app
+
+どちらもローカルホスト（127.0.0.1）のみで待ち受けます
+（アプリ側でもローカルホスト以外からのリクエストは拒否します）。
+
+※ サポートするのは1プロセス・マルチスレッドの構成のみです。
+  Gemini API のレート制限・同時実行数（gemini_client.request_scheduler）、
+  メトリクス、直近のグリッド画像のキャッシュはプロセスごとに持つため、
+  複数ワーカー（gunicorn -w 2 以上）で動かすとレート制限がワーカー数倍に緩み、
+  API の 429 が増えます。同時処理数はスレッド数（WSGI_THREADS）で調整してください。
+"""
+
+import os
+
+from server import app
+
+# WSGI サーバーが参照する名前（gunicorn wsgi:app / wsgi:application）
+application = app
+
+
+if __name__ == '__main__':
+    try:
+        from waitress import serve
+    except ImportError:
+        print("waitress がインストールされていません: pip install waitress")
+        raise SystemExit(1)
+
+    port = int(os.environ.get('PORT', 5000))
+    threads = int(os.environ.get('WSGI_THREADS', 8))
+
+    print("=" * 60)
+    print("  LINEスタンプ丸投げちゃん（本番モード）")
+    print("=" * 60)
+    print()
+    print(f"  ブラウザで http://localhost:{port} を開いてください")
+    print(f"  同時処理数: {threads}スレッド")
+    print()
+    print("  終了: Ctrl+C")
+    print("=" * 60)
+
+    # 重要: host='127.0.0.1' でローカルホストのみに制限
+    serve(app, host='127.0.0.1', port=port, threads=threads)